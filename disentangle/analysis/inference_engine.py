@@ -0,0 +1,147 @@
+"""
+Device agnostic inference for trained LadderVAE models (and its subclasses), with optimizations for the CPU:
+    - the number of intra-op threads,
+    - channels_last memory format of the weights (and inputs), which lets oneDNN use its fastest convolutions,
+    - BatchNorm folded into the convolution which precedes it,
+    - optionally, the bottom-up and the top-down pass replaced by graphs exported with torch.export.
+The predictions themselves run under torch.inference_mode in analysis/mmse_prediction.py.
+"""
+import torch
+from torch import nn
+from torch.distributions import Distribution
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+from disentangle.core.stochastic_mode import StochasticMode
+
+_CONV_TYPES = (nn.Conv2d, nn.Conv3d)
+_BATCHNORM_TYPES = (nn.BatchNorm2d, nn.BatchNorm3d)
+# identities in eval mode, which may sit between a convolution and its BatchNorm.
+_EVAL_IDENTITY_TYPES = (nn.Dropout, nn.Dropout2d, nn.Dropout3d, nn.Identity)
+
+
+def get_default_device():
+    return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+
+def fuse_conv_batchnorm(model):
+    """
+    Folds every BatchNorm which directly follows a convolution (possibly through dropout) inside an nn.Sequential into
+    that convolution, in place. The model must be in eval mode. A BatchNorm which follows an activation, like the
+    first one of the 'bacdbacd' residual blocks, cannot be folded and is kept.
+    Returns:
+        the number of fused BatchNorm layers.
+    """
+    assert not model.training, 'BatchNorm can only be fused in eval mode'
+    fused = 0
+    for module in model.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        for i, conv in enumerate(module):
+            if not isinstance(conv, _CONV_TYPES):
+                continue
+            j = i + 1
+            while j < len(module) and isinstance(module[j], _EVAL_IDENTITY_TYPES):
+                j += 1
+            if j < len(module) and isinstance(module[j], _BATCHNORM_TYPES):
+                module[i] = fuse_conv_bn_eval(conv, module[j])
+                module[j] = nn.Identity()
+                fused += 1
+    return fused
+
+
+class _PassModule(nn.Module):
+
+    def __init__(self, fn):
+        super().__init__()
+        self._fn = fn
+
+    def forward(self, *inputs):
+        return self._fn(*inputs)
+
+
+class _ExportedPass:
+    """
+    A function of tensors, exported with torch.export as a graph of fixed shapes, and exported again for every new
+    input shape.
+    """
+
+    def __init__(self, fn):
+        self._module = _PassModule(fn)
+        self._exported = {}
+
+    def __call__(self, *tensors):
+        key = tuple(tuple(t.shape) for t in tensors)
+        if key not in self._exported:
+            # the argument checks of torch.distributions depend on the data, which cannot be exported.
+            validate_args = Distribution._validate_args
+            Distribution.set_default_validate_args(False)
+            try:
+                self._exported[key] = torch.export.export(self._module, tensors).module()
+            finally:
+                Distribution.set_default_validate_args(validate_args)
+        return self._exported[key](*tensors)
+
+
+def export_ladder_vae(model):
+    """
+    Replaces the bottom-up and the top-down pass which forward and sample_outputs use by exported graphs. The top-down
+    graph only returns the output, so the td_data of forward is None afterwards.
+    """
+    assert model.skip_bottomk_buvalues == 0, 'Exported bottom-up pass cannot return None values'
+    cls = model.__class__
+    bottomup = _ExportedPass(lambda x_pad: tuple(cls._get_bu_values(model, x_pad)))
+    model._get_bu_values = lambda x_pad: list(bottomup(x_pad))
+
+    topdown = {}
+
+    def _topdown_output(bu_values, img_size, x_pad):
+        img_size = tuple(img_size)
+        if img_size not in topdown:
+            topdown[img_size] = _ExportedPass(
+                lambda *tensors: cls._topdown_output(model, list(tensors[:-1]), img_size, tensors[-1])[0])
+        return topdown[img_size](*bu_values, x_pad), None
+
+    model._topdown_output = _topdown_output
+    return model
+
+
+def prepare_for_inference(model,
+                          device=None,
+                          num_threads=None,
+                          channels_last=False,
+                          fuse_batchnorm=True,
+                          export=False):
+    """
+    Moves the model to device and applies the inference optimizations, in place.
+    Args:
+        device: by default, cuda if available and cpu otherwise.
+        num_threads: number of intra-op threads (torch.set_num_threads) when running on the CPU.
+        channels_last: converts the weights to the channels_last memory format.
+        fuse_batchnorm: folds BatchNorm into the preceding convolutions (see fuse_conv_batchnorm).
+        export: replaces the bottom-up and top-down passes by exported graphs (see export_ladder_vae).
+    Returns:
+        the model.
+    """
+    device = get_default_device() if device is None else torch.device(device)
+    if device.type == 'cpu' and num_threads is not None:
+        torch.set_num_threads(num_threads)
+
+    model.eval()
+    model.requires_grad_(False)
+    model = model.to(device)
+    model.set_params_to_same_device_as(torch.zeros(1, device=device))
+    if hasattr(model, 'set_stochastic_mode') and model.mode_pred:
+        model.set_stochastic_mode(StochasticMode.Inference)
+
+    msg = f'[prepare_for_inference] device:{device} threads:{torch.get_num_threads()}'
+    if fuse_batchnorm:
+        msg += f' fused BatchNorm:{fuse_conv_batchnorm(model)}'
+    if channels_last:
+        assert not getattr(model, '_mode_3D', False), 'channels_last is only supported for 2D models'
+        model = model.to(memory_format=torch.channels_last)
+        msg += ' channels_last'
+    if export:
+        export_ladder_vae(model)
+        msg += ' exported'
+    print(msg)
+    return model
@@ -0,0 +1,148 @@
+"""
+Inference on large tiles. With the usual tiling (e.g. 64px patches on a 32px grid), the model processes up to four
+times as many pixels as the frame contains and stitch_predictions discards the margins. Since the network is fully
+convolutional, it can instead be run on tiles which are much larger than the training patches, up to the whole frame.
+Only a margin as wide as its (effective) receptive field needs to be discarded from every tile.
+
+The tiling itself is done by the dataset (TilingMode.ShiftBoundary) and the stitching by stitch_predictions, so the
+usual prediction functions work unchanged after set_large_tile_mode.
+"""
+import os
+
+import numpy as np
+import torch
+
+from disentangle.data_loader.patch_index_manager import TilingMode
+
+# fraction of the currently available memory which the tiles of one batch may use.
+MEMORY_FRACTION = 0.5
+
+
+def _uses_lateral_context(model):
+    return model._multiscale_count is not None and model._multiscale_count > 1
+
+
+def _probe_input(model, size, batch_size=1):
+    num_inputs = model._multiscale_count if _uses_lateral_context(model) else 1
+    device = next(model.parameters()).device
+    return torch.randn(batch_size, num_inputs, size, size, device=device)
+
+
+def get_receptive_field_margin(model, probe_size=None, tol=1e-3, seed=0):
+    """
+    Effective receptive field of the model, measured as the smallest margin r such that the input pixels farther than
+    r from a pixel contribute less than a fraction tol of the total absolute gradient of that pixel. The margin is
+    rounded up to a multiple of the overall downscaling factor of the model.
+    Args:
+        probe_size: size of the random input used for the measurement. By default, 4 times the training patch size.
+    """
+    if probe_size is None:
+        probe_size = 4 * model.img_shape[-1]
+    lateral_context = _uses_lateral_context(model)
+    if lateral_context:
+        model.reset_for_different_output_size(probe_size)
+
+    torch.manual_seed(seed)
+    inp = _probe_input(model, probe_size).requires_grad_(True)
+    with torch.enable_grad():
+        out = model(inp)[0]
+        c = out.shape[-1] // 2
+        out[..., c, c].sum().backward()
+
+    if lateral_context:
+        model.reset_for_different_output_size(model.img_shape[-1])
+
+    # only the full resolution input: the lateral context inputs are not tiled.
+    grad = inp.grad[0, 0].abs().cpu().numpy()
+    h, w = np.indices(grad.shape)
+    # distance (L_inf) of every input pixel to the output pixel.
+    dist = np.maximum(np.abs(h - c), np.abs(w - c))
+    # fraction of the gradient which lies farther than r, for every r.
+    mass = np.bincount(dist.ravel(), weights=grad.ravel())
+    outside = 1 - np.cumsum(mass) / mass.sum()
+    margin = int(np.argmax(outside < tol))
+    if outside[margin] >= tol:
+        print(f'[get_receptive_field_margin] probe_size {probe_size} is smaller than the receptive field')
+        margin = len(outside)
+
+    dwnsc = int(model.overall_downscale_factor)
+    return int(np.ceil(margin / dwnsc) * dwnsc)
+
+
+def get_available_memory(device):
+    if device.type == 'cuda':
+        free, _ = torch.cuda.mem_get_info(device)
+        return free
+    return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+
+def get_bytes_per_pixel(model, probe_size=None, samples_per_pass=1):
+    """
+    Memory needed by the prediction, per input pixel and per image of the batch.
+    On CUDA, it is the measured peak memory of a forward pass. On the CPU, it is the sum of the outputs of all layers,
+    which is an upper bound of the peak memory.
+    """
+    if probe_size is None:
+        probe_size = 2 * model.img_shape[-1]
+    inp = _probe_input(model, probe_size)
+    device = inp.device
+    if _uses_lateral_context(model):
+        model.reset_for_different_output_size(probe_size)
+
+    with torch.no_grad():
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+            torch.cuda.reset_peak_memory_stats(device)
+            start = torch.cuda.memory_allocated(device)
+            model(inp)
+            nbytes = torch.cuda.max_memory_allocated(device) - start
+        else:
+            output_bytes = []
+
+            def hook(module, args, output):
+                output = output[0] if isinstance(output, (tuple, list)) else output
+                if isinstance(output, torch.Tensor):
+                    output_bytes.append(output.numel() * output.element_size())
+
+            handles = [m.register_forward_hook(hook) for m in model.modules() if len(list(m.children())) == 0]
+            model(inp)
+            for handle in handles:
+                handle.remove()
+            nbytes = sum(output_bytes)
+
+    if _uses_lateral_context(model):
+        model.reset_for_different_output_size(model.img_shape[-1])
+    return samples_per_pass * nbytes / probe_size**2
+
+
+def get_tile_size(model, frame_size, margin, batch_size=1, samples_per_pass=1, memory_budget=None):
+    """
+    Largest tile (a multiple of the overall downscaling factor of the model, at most frame_size) whose batch fits into
+    memory_budget bytes. By default, the budget is MEMORY_FRACTION of the currently available memory.
+    """
+    device = next(model.parameters()).device
+    if memory_budget is None:
+        memory_budget = MEMORY_FRACTION * get_available_memory(device)
+
+    bytes_per_pixel = get_bytes_per_pixel(model, samples_per_pass=samples_per_pass)
+    dwnsc = int(model.overall_downscale_factor)
+    tile_size = int(np.sqrt(memory_budget / (batch_size * bytes_per_pixel)))
+    tile_size = min(tile_size, frame_size) // dwnsc * dwnsc
+    assert tile_size > 2 * margin, f'Memory budget {memory_budget} allows tiles of {tile_size}px only, margin {margin}'
+    return tile_size
+
+
+def set_large_tile_mode(model, dset, tile_size, margin):
+    """
+    Predictions on tiles of tile_size from now on, of which all but a margin of `margin` pixels on every side is kept
+    (except at the frame boundary). dset must use TilingMode.ShiftBoundary.
+    """
+    assert dset._tiling_mode == TilingMode.ShiftBoundary, 'Large tile mode needs TilingMode.ShiftBoundary'
+    assert model.mode_pred is True, 'KL divergence cannot be computed on tiles which differ from the training size'
+    assert tile_size % model.overall_downscale_factor == 0, f'{tile_size} not divisible by the downscaling factor'
+    grid_size = tile_size - 2 * margin
+    assert grid_size > 0, f'Tile size {tile_size} is too small for the margin {margin}'
+    dset.set_img_sz(tile_size, grid_size)
+    if _uses_lateral_context(model):
+        model.reset_for_different_output_size(tile_size)
+    print(f'[set_large_tile_mode] tile:{tile_size} margin:{margin} patches:{len(dset)}')
@@ -1,3 +1,5 @@
+import os
+import tempfile
 from typing import Tuple
 
 import numpy as np
@@ -5,13 +7,19 @@ import torch
 from torch.utils.data import DataLoader
 from tqdm import tqdm
 
+from disentangle.analysis.stitch_prediction import PredictionStitcher, allocate_stitched_output
 from disentangle.core.loss_type import LossType
 from disentangle.core.model_type import ModelType
 from disentangle.metrics.running_psnr import RunningPSNR
+from disentangle.nets.lvae import LadderVAE
+
+
+def model_device(model):
+    return next(model.parameters()).device
 
 
 def get_mmse_prediction(model, dset, inp_idx, mmse_count, padded_size: int, prediction_size: int, batch_size=16,
-                        track_progress: bool = True) -> \
+                        track_progress: bool = True, model_type=None) -> \
         Tuple[
             torch.Tensor, torch.Tensor]:
     """
@@ -25,6 +33,8 @@ def get_mmse_prediction(model, dset, inp_idx, mmse_count, padded_size: int, pred
         prediction_size: How much should be kept for prediction. Ex: padded_size=96 and prediction_size=64. 16 pixesls
                         are padded on all sides in this case.
         batch_size: Used for speeding up the computation.
+        model_type: with the model, decides whether the samples can share one bottom-up pass (see
+                    _uses_shared_bottomup). Otherwise, the model is called on batch_size copies of the input.
 
     Returns:
         MMSE prediction and the target. Both are in normalized state.
@@ -38,194 +48,346 @@ def get_mmse_prediction(model, dset, inp_idx, mmse_count, padded_size: int, pred
 
     with torch.no_grad():
         inp, tar = dset[inp_idx]
-        inp = torch.Tensor(inp[None])
-        tar = torch.Tensor(tar[None])
-        inp = inp.repeat(batch_size, 1, 1, 1)
-        tar = tar.repeat(batch_size, 1, 1, 1)
-        inp = inp.cuda()
-        tar = tar.cuda()
-        recon_img_list = []
-        range_mmse = range(0, mmse_count, batch_size)
+        device = model_device(model)
+        inp = torch.Tensor(inp[None]).to(device)
+        tar = torch.Tensor(tar[None]).to(device)
+        x_normalized = model.normalize_input(inp)
+        tar_normalized = model.normalize_target(tar)
+        if _uses_shared_bottomup(model, model_type):
+            # the bottom-up pass is shared by all samples. batch_size samples are drawn in one top-down pass.
+            sample_outputs = model.sample_outputs(x_normalized, mmse_count, samples_per_pass=batch_size)
+        else:
+            sample_outputs = (model(x_normalized.repeat(min(batch_size, mmse_count - i), 1, 1, 1))[0]
+                              for i in range(0, mmse_count, batch_size))
         if track_progress:
-            range_mmse = tqdm(range_mmse)
+            sample_outputs = tqdm(sample_outputs, total=int(np.ceil(mmse_count / batch_size)))
 
-        for i in range_mmse:
-            end = min(i + batch_size, mmse_count) - i
-            x_normalized = model.normalize_input(inp[:end])
-            tar_normalized = model.normalize_target(tar[:end])
-            recon_normalized, td_data = model(x_normalized)
+        recon_img_sum = 0
+        for recon_normalized in sample_outputs:
             recon_img = model.likelihood.get_mean_lv(recon_normalized)[0]
-            if padN > 0:
-                tar_normalized = tar_normalized[:, :, padN:-padN, padN:-padN]
-                recon_normalized = recon_normalized[:, :, padN:-padN, padN:-padN]
-                recon_img = recon_img[:, :, padN:-padN, padN:-padN]
+            recon_img_sum = recon_img_sum + recon_img.sum(dim=0, keepdim=True).cpu()
+        mmse_img = recon_img_sum / mmse_count
+        if padN > 0:
+            tar_normalized = tar_normalized[:, :, padN:-padN, padN:-padN]
+            mmse_img = mmse_img[:, :, padN:-padN, padN:-padN]
 
-            assert tar_normalized.shape[-1] == prediction_size
-            assert tar_normalized.shape[-2] == prediction_size
-            assert tar_normalized.shape[-2:] == recon_normalized.shape[-2:]
-            recon_img_list.append(recon_img.cpu())
-        mmse_img = torch.mean(torch.cat(recon_img_list, dim=0), dim=0)[None]
+        assert tar_normalized.shape[-1] == prediction_size
+        assert tar_normalized.shape[-2] == prediction_size
+        assert tar_normalized.shape[-2:] == mmse_img.shape[-2:]
 
     dset.set_img_sz(old_img_sz)
     return mmse_img, tar_normalized.cpu()
 
 
-def get_dset_predictions(model, dset, batch_size, model_type=None, mmse_count=1, num_workers=4):
-    dloader = DataLoader(dset, pin_memory=False, num_workers=num_workers, shuffle=False, batch_size=batch_size)
+def _uses_shared_bottomup(model, model_type):
+    """
+    Whether the model takes the default (LadderVAE) branch of _get_batch_predictions, so that all MMSE samples can
+    share one bottom-up pass (see LadderVAE.sample_outputs).
+    """
+    special_model_types = [
+        ModelType.UNet, ModelType.BraveNet, ModelType.LadderVaeStitch, ModelType.LadderVaeSemiSupervised,
+        ModelType.LadderVaeMixedRecons, ModelType.LadderVaeTwoDataSet, ModelType.LadderVaeTwoDatasetMultiBranch,
+        ModelType.LadderVaeTwoDatasetMultiOptim, ModelType.LVaeDeepEncoderIntensityAug, ModelType.Denoiser,
+        ModelType.DenoiserSplitter
+    ]
+    return (model_type not in special_model_types and isinstance(model, LadderVAE)
+            and type(model).forward is LadderVAE.forward)
+
+
+def _get_shared_bottomup_batch_predictions(model, batch, mmse_count, patch_psnr_channels, samples_per_pass):
+    """
+    Same as _get_batch_predictions for LadderVAE models, with one bottom-up pass for all MMSE samples (see
+    LadderVAE.mmse_prediction).
+    """
+    inp, tar = batch[:2]
+    device = model_device(model)
+    inp = inp.to(device)
+    tar = tar.to(device)
+    x_normalized = model.normalize_input(inp)
+    tar_normalized = model.normalize_target(tar)
+
+    def repeat(x, k):
+        return x.repeat(k, *([1] * (x.dim() - 1)))
+
+    first_sample = {}
+
+    def output_fn(recon_normalized):
+        k = len(recon_normalized) // len(inp)
+        splitting_mask = None
+        if not first_sample:
+            # the loss and the logvar are those of the first sample: the loss is only summed over its batch.
+            splitting_mask = torch.arange(len(recon_normalized), device=device) < len(inp)
+        rec_loss, imgs = model.get_reconstruction_loss(recon_normalized,
+                                                       repeat(tar_normalized, k),
+                                                       repeat(inp, k),
+                                                       splitting_mask=splitting_mask,
+                                                       return_predicted_img=True)
+        if not first_sample:
+            first_sample['loss'] = (rec_loss['loss'] * k).cpu().numpy()
+            q_dic = model.likelihood.distr_params(recon_normalized[:len(inp)]) if model.likelihood is not None else {
+                'logvar': None
+            }
+            first_sample['logvar'] = np.array([-1]) if q_dic['logvar'] is None else q_dic['logvar'].cpu().numpy()
+
+        for i in range(imgs.shape[1]):
+            patch_psnr_channels[i].update(imgs[:, i], repeat(tar_normalized[:, i], k))
+        return imgs
+
+    mmse_imgs, mmse_std = model.mmse_prediction(x_normalized,
+                                                mmse_count,
+                                                samples_per_pass=samples_per_pass,
+                                                output_fn=output_fn)
+    loss, logvar = first_sample['loss'], first_sample['logvar']
+    return mmse_imgs.cpu().numpy(), mmse_std.cpu().numpy(), loss, logvar
+
+
+def _get_batch_predictions(model, batch, model_type, mmse_count, patch_psnr_channels, samples_per_pass=1):
+    """
+    Returns the MMSE prediction, its standard deviation over the mmse_count samples, the reconstruction loss and the
+    predicted logvar for one batch of the dataloader. patch_psnr_channels are updated in place.
+    """
+    if _uses_shared_bottomup(model, model_type):
+        return _get_shared_bottomup_batch_predictions(model, batch, mmse_count, patch_psnr_channels, samples_per_pass)
+
+    inp, tar = batch[:2]
+    device = model_device(model)
+    inp = inp.to(device)
+    tar = tar.to(device)
+
+    recon_img_list = []
+    for mmse_idx in range(mmse_count):
+        if model_type in [ModelType.UNet, ModelType.BraveNet]:
+            x_normalized = model.normalize_input(inp)
+            tar_normalized = model.normalize_target(tar)
+
+            recon_normalized = model(x_normalized)
+            if model_type == ModelType.BraveNet:
+                recon_normalized = recon_normalized[0]
+
+            imgs = recon_normalized
+            rec_loss = model.get_reconstruction_loss(recon_normalized, tar_normalized)
+
+            if mmse_idx == 0:
+                logvar = np.array([-1])
+                loss = rec_loss.cpu().numpy()
+
+        else:
+            if model_type == ModelType.LadderVaeStitch:
+                x_normalized = model.normalize_input(inp)
+                tar_normalized = model.normalize_target(tar)
+
+                recon_normalized, td_data = model(x_normalized)
+                offset = model.compute_offset(td_data['z'])
+                rec_loss, imgs = model.get_reconstruction_loss(recon_normalized,
+                                                               tar_normalized,
+                                                               offset,
+                                                               return_predicted_img=True)
+            elif model_type == ModelType.LadderVaeSemiSupervised:
+                x_normalized = model.normalize_input(inp, torch.zeros_like(tar[:, 0, 0, 0], dtype=torch.int64))
+                tar_normalized = model.normalize_target(tar, torch.zeros_like(tar[:, 0, 0, 0],
+                                                                              dtype=torch.int64))
+
+                recon_normalized, td_data = model(x_normalized)
+                rec_loss, imgs = model.get_reconstruction_loss(recon_normalized,
+                                                               x_normalized,
+                                                               tar_normalized,
+                                                               return_predicted_img=True)
+
+            elif model_type == ModelType.LadderVaeMixedRecons:
+                x_normalized = model.normalize_input(inp)
+                tar_normalized = model.normalize_target(tar)
+
+                recon_normalized, td_data = model(x_normalized)
+                rec_loss, imgs = model.get_reconstruction_loss(recon_normalized,
+                                                               x_normalized,
+                                                               tar_normalized,
+                                                               return_predicted_img=True)
+            elif model_type in [
+                    ModelType.LadderVaeTwoDataSet, ModelType.LadderVaeTwoDatasetMultiBranch,
+                    ModelType.LadderVaeTwoDatasetMultiOptim
+            ]:
+                dset_idx, loss_idx = batch[2:]
+                dset_idx = dset_idx.to(device)
+                loss_idx = loss_idx.to(device)
+
+                x_normalized = model.normalize_input(inp)
+                tar_normalized = model.normalize_target(tar, dset_idx)
+                if model_type in [
+                        ModelType.LadderVaeTwoDatasetMultiBranch, ModelType.LadderVaeTwoDatasetMultiOptim
+                ]:
+                    mask_mixrecons = loss_idx == LossType.ElboMixedReconstruction
+                    mask_2ch = loss_idx == LossType.Elbo
+                    assert mask_2ch.sum() in [0, len(x_normalized)]
+                    assert mask_mixrecons.sum() in [0, len(x_normalized)]
+                    loss_idx_type = LossType.Elbo if mask_2ch.sum() == len(
+                        x_normalized) else LossType.ElboMixedReconstruction
+                    recon_normalized, _ = model(x_normalized, loss_idx_type)
+                else:
+                    recon_normalized, _ = model(x_normalized)
+                rec_loss, imgs = model.get_reconstruction_loss(recon_normalized,
+                                                               tar_normalized,
+                                                               dset_idx,
+                                                               loss_idx,
+                                                               return_predicted_img=True)
+
+            elif model_type == ModelType.LVaeDeepEncoderIntensityAug:
+                x_normalized = model.normalize_input(inp)
+                alpha = torch.Tensor([0.5] * len(x_normalized)).to(x_normalized.device)
+                tar_normalized = model.normalize_target(tar, batch=(None, None, alpha))
+                out_l1, out_l2, td_data = model(x_normalized)
+
+                rec_loss, imgs = model.get_reconstruction_loss(out_l1,
+                                                               out_l2,
+                                                               tar_normalized,
+                                                               return_predicted_img=True)
+                imgs = torch.cat(imgs, dim=1)
+                rec_loss = {'loss': rec_loss}
+            elif model_type == ModelType.Denoiser:
+                assert model.denoise_channel in [
+                    'Ch1', 'Ch2', 'input'
+                ], '"all" denoise channel not supported for evaluation. Pick one of "Ch1", "Ch2", "input"'
+
+                x_normalized_new, tar_new = model.get_new_input_target((inp, tar, *batch[2:]))
+                tar_normalized = model.normalize_target(tar_new)
+                recon_normalized, _ = model(x_normalized_new)
+                rec_loss, imgs = model.get_reconstruction_loss(recon_normalized,
+                                                               tar_normalized,
+                                                               x_normalized_new,
+                                                               return_predicted_img=True)
+            elif model_type == ModelType.DenoiserSplitter:
+                x_normalized, tar_normalized = model.get_normalized_input_target((inp, tar, *batch[2:]))
+                recon_normalized, _ = model(x_normalized)
+                rec_loss, imgs = model.get_reconstruction_loss(recon_normalized,
+                                                               tar_normalized,
+                                                               x_normalized,
+                                                               return_predicted_img=True)
+
+            else:
+                x_normalized = model.normalize_input(inp)
+                tar_normalized = model.normalize_target(tar)
+                recon_normalized, _ = model(x_normalized)
+                rec_loss, imgs = model.get_reconstruction_loss(recon_normalized,
+                                                               tar_normalized,
+                                                               inp,
+                                                               return_predicted_img=True)
+
+            if mmse_idx == 0:
+                q_dic = model.likelihood.distr_params(recon_normalized) if model.likelihood is not None else {
+                    'logvar': None
+                }
+                if q_dic['logvar'] is not None:
+                    logvar = q_dic['logvar'].cpu().numpy()
+                else:
+                    logvar = np.array([-1])
+
+                try:
+                    loss = rec_loss['loss'].cpu().numpy()
+                except:
+                    loss = rec_loss['loss']
+
+        for i in range(imgs.shape[1]):
+            patch_psnr_channels[i].update(imgs[:, i], tar_normalized[:, i])
+
+        recon_img_list.append(imgs.cpu()[None])
+
+    samples = torch.cat(recon_img_list, dim=0)
+    mmse_imgs = torch.mean(samples, dim=0)
+    mmse_std = torch.std(samples, dim=0)
+    return mmse_imgs.cpu().numpy(), mmse_std.cpu().numpy(), loss, logvar
+
+
+def get_dset_predictions(model, dset, batch_size, model_type=None, mmse_count=1, num_workers=4, samples_per_pass=1):
+    """
+    Args:
+        samples_per_pass: for LadderVAE models, the number of MMSE samples drawn in one top-down pass.
+    """
+    dloader = DataLoader(dset,
+                         pin_memory=model_device(model).type == 'cuda',
+                         num_workers=num_workers,
+                         shuffle=False,
+                         batch_size=batch_size)
     predictions = []
     predictions_std = []
     losses = []
     logvar_arr = []
     patch_psnr_channels = [RunningPSNR() for _ in range(dset[0][1].shape[0])]
-    with torch.no_grad():
+    with torch.inference_mode():
         for batch in tqdm(dloader):
-            inp, tar = batch[:2]
-            inp = inp.cuda()
-            tar = tar.cuda()
-
-            recon_img_list = []
-            for mmse_idx in range(mmse_count):
-                if model_type in [ModelType.UNet, ModelType.BraveNet]:
-                    x_normalized = model.normalize_input(inp)
-                    tar_normalized = model.normalize_target(tar)
-
-                    recon_normalized = model(x_normalized)
-                    if model_type == ModelType.BraveNet:
-                        recon_normalized = recon_normalized[0]
-
-                    imgs = recon_normalized
-                    rec_loss = model.get_reconstruction_loss(recon_normalized, tar_normalized)
-
-                    if mmse_idx == 0:
-                        logvar_arr.append(np.array([-1]))
-                        losses.append(rec_loss.cpu().numpy())
-
-                else:
-                    if model_type == ModelType.LadderVaeStitch:
-                        x_normalized = model.normalize_input(inp)
-                        tar_normalized = model.normalize_target(tar)
-
-                        recon_normalized, td_data = model(x_normalized)
-                        offset = model.compute_offset(td_data['z'])
-                        rec_loss, imgs = model.get_reconstruction_loss(recon_normalized,
-                                                                       tar_normalized,
-                                                                       offset,
-                                                                       return_predicted_img=True)
-                    elif model_type == ModelType.LadderVaeSemiSupervised:
-                        x_normalized = model.normalize_input(inp, torch.zeros_like(tar[:, 0, 0, 0], dtype=torch.int64))
-                        tar_normalized = model.normalize_target(tar, torch.zeros_like(tar[:, 0, 0, 0],
-                                                                                      dtype=torch.int64))
-
-                        recon_normalized, td_data = model(x_normalized)
-                        rec_loss, imgs = model.get_reconstruction_loss(recon_normalized,
-                                                                       x_normalized,
-                                                                       tar_normalized,
-                                                                       return_predicted_img=True)
-
-                    elif model_type == ModelType.LadderVaeMixedRecons:
-                        x_normalized = model.normalize_input(inp)
-                        tar_normalized = model.normalize_target(tar)
-
-                        recon_normalized, td_data = model(x_normalized)
-                        rec_loss, imgs = model.get_reconstruction_loss(recon_normalized,
-                                                                       x_normalized,
-                                                                       tar_normalized,
-                                                                       return_predicted_img=True)
-                    elif model_type in [
-                            ModelType.LadderVaeTwoDataSet, ModelType.LadderVaeTwoDatasetMultiBranch,
-                            ModelType.LadderVaeTwoDatasetMultiOptim
-                    ]:
-                        dset_idx, loss_idx = batch[2:]
-                        dset_idx = dset_idx.cuda()
-                        loss_idx = loss_idx.cuda()
-
-                        x_normalized = model.normalize_input(inp)
-                        tar_normalized = model.normalize_target(tar, dset_idx)
-                        if model_type in [
-                                ModelType.LadderVaeTwoDatasetMultiBranch, ModelType.LadderVaeTwoDatasetMultiOptim
-                        ]:
-                            mask_mixrecons = loss_idx == LossType.ElboMixedReconstruction
-                            mask_2ch = loss_idx == LossType.Elbo
-                            assert mask_2ch.sum() in [0, len(x_normalized)]
-                            assert mask_mixrecons.sum() in [0, len(x_normalized)]
-                            loss_idx_type = LossType.Elbo if mask_2ch.sum() == len(
-                                x_normalized) else LossType.ElboMixedReconstruction
-                            recon_normalized, _ = model(x_normalized, loss_idx_type)
-                        else:
-                            recon_normalized, _ = model(x_normalized)
-                        rec_loss, imgs = model.get_reconstruction_loss(recon_normalized,
-                                                                       tar_normalized,
-                                                                       dset_idx,
-                                                                       loss_idx,
-                                                                       return_predicted_img=True)
-
-                    elif model_type == ModelType.LVaeDeepEncoderIntensityAug:
-                        x_normalized = model.normalize_input(inp)
-                        alpha = torch.Tensor([0.5] * len(x_normalized)).to(x_normalized.device)
-                        tar_normalized = model.normalize_target(tar, batch=(None, None, alpha))
-                        out_l1, out_l2, td_data = model(x_normalized)
-
-                        rec_loss, imgs = model.get_reconstruction_loss(out_l1,
-                                                                       out_l2,
-                                                                       tar_normalized,
-                                                                       return_predicted_img=True)
-                        imgs = torch.cat(imgs, dim=1)
-                        rec_loss = {'loss': rec_loss}
-                    elif model_type == ModelType.Denoiser:
-                        assert model.denoise_channel in [
-                            'Ch1', 'Ch2', 'input'
-                        ], '"all" denoise channel not supported for evaluation. Pick one of "Ch1", "Ch2", "input"'
-
-                        x_normalized_new, tar_new = model.get_new_input_target((inp, tar, *batch[2:]))
-                        tar_normalized = model.normalize_target(tar_new)
-                        recon_normalized, _ = model(x_normalized_new)
-                        rec_loss, imgs = model.get_reconstruction_loss(recon_normalized,
-                                                                       tar_normalized,
-                                                                       x_normalized_new,
-                                                                       return_predicted_img=True)
-                    elif model_type == ModelType.DenoiserSplitter:
-                        x_normalized, tar_normalized = model.get_normalized_input_target((inp, tar, *batch[2:]))
-                        recon_normalized, _ = model(x_normalized)
-                        rec_loss, imgs = model.get_reconstruction_loss(recon_normalized,
-                                                                       tar_normalized,
-                                                                       x_normalized,
-                                                                       return_predicted_img=True)
-
-                    else:
-                        x_normalized = model.normalize_input(inp)
-                        tar_normalized = model.normalize_target(tar)
-                        recon_normalized, _ = model(x_normalized)
-                        rec_loss, imgs = model.get_reconstruction_loss(recon_normalized,
-                                                                       tar_normalized,
-                                                                       inp,
-                                                                       return_predicted_img=True)
-
-                    if mmse_idx == 0:
-                        q_dic = model.likelihood.distr_params(recon_normalized) if model.likelihood is not None else {
-                            'logvar': None
-                        }
-                        if q_dic['logvar'] is not None:
-                            logvar_arr.append(q_dic['logvar'].cpu().numpy())
-                        else:
-                            logvar_arr.append(np.array([-1]))
-
-                        try:
-                            losses.append(rec_loss['loss'].cpu().numpy())
-                        except:
-                            losses.append(rec_loss['loss'])
-
-                for i in range(imgs.shape[1]):
-                    patch_psnr_channels[i].update(imgs[:, i], tar_normalized[:, i])
-
-                recon_img_list.append(imgs.cpu()[None])
-
-            samples = torch.cat(recon_img_list, dim=0)
-            mmse_imgs = torch.mean(samples, dim=0)
-            mmse_std = torch.std(samples, dim=0)
-            predictions.append(mmse_imgs.cpu().numpy())
-            predictions_std.append(mmse_std.cpu().numpy())
+            mmse_imgs, mmse_std, loss, logvar = _get_batch_predictions(model, batch, model_type, mmse_count,
+                                                                       patch_psnr_channels, samples_per_pass)
+            predictions.append(mmse_imgs)
+            predictions_std.append(mmse_std)
+            losses.append(loss)
+            logvar_arr.append(logvar)
 
     psnr = [x.get() for x in patch_psnr_channels]
     return np.concatenate(predictions,
                           axis=0), np.array(losses), np.concatenate(logvar_arr), psnr, np.concatenate(predictions_std,
                                                                                                       axis=0)
+
+
+def get_stitched_dset_predictions(model,
+                                  dset,
+                                  batch_size,
+                                  model_type=None,
+                                  mmse_count=1,
+                                  num_workers=4,
+                                  memmap_dir: str = None,
+                                  samples_per_pass=1):
+    """
+    Streaming version of get_dset_predictions followed by stitch_predictions. Every batch of MMSE predictions (and
+    their std) is written straight into preallocated output frames and then freed, so the tiled predictions of the
+    whole dataset never exist in memory. Peak memory is bounded by one batch plus the two stitched outputs.
+    Args:
+        memmap_dir: if given, the stitched mean and std are backed by np.memmap (.npy) files in a new subdirectory of
+                    memmap_dir. The files are not deleted.
+        samples_per_pass: for LadderVAE models, the number of MMSE samples drawn in one top-down pass.
+    Returns:
+        stitched MMSE prediction, reconstruction losses, patch PSNR and stitched std. For MultiFileDset, the stitched
+        outputs are lists with one entry per file.
+    """
+    dloader = DataLoader(dset,
+                         pin_memory=model_device(model).type == 'cuda',
+                         num_workers=num_workers,
+                         shuffle=False,
+                         batch_size=batch_size)
+    pred_stitcher = std_stitcher = None
+    losses = []
+    patch_psnr_channels = [RunningPSNR() for _ in range(dset[0][1].shape[0])]
+    with torch.inference_mode():
+        for batch in tqdm(dloader):
+            mmse_imgs, mmse_std, loss, _ = _get_batch_predictions(model, batch, model_type, mmse_count,
+                                                                  patch_psnr_channels, samples_per_pass)
+            losses.append(loss)
+            if mmse_imgs.shape[-1] != dset.get_img_sz():
+                pad = (dset.get_img_sz() - mmse_imgs.shape[-1]) // 2
+                pad_width = ((0, 0),) * (mmse_imgs.ndim - 2) + ((pad, pad), (pad, pad))
+                mmse_imgs = np.pad(mmse_imgs, pad_width)
+                mmse_std = np.pad(mmse_std, pad_width)
+
+            if pred_stitcher is None:
+                num_channels = mmse_imgs.shape[1]
+                pred_fpath = std_fpath = None
+                if memmap_dir is not None:
+                    os.makedirs(memmap_dir, exist_ok=True)
+                    # a new directory per call, so that the outputs of earlier calls are not overwritten.
+                    output_dir = tempfile.mkdtemp(prefix='stitched_', dir=memmap_dir)
+                    pred_fpath = os.path.join(output_dir, 'pred.npy')
+                    std_fpath = os.path.join(output_dir, 'pred_std.npy')
+                pred_stitcher = PredictionStitcher(dset,
+                                                   num_channels,
+                                                   dtype=mmse_imgs.dtype,
+                                                   output=allocate_stitched_output(dset, num_channels,
+                                                                                   mmse_imgs.dtype, pred_fpath))
+                std_stitcher = PredictionStitcher(dset,
+                                                  num_channels,
+                                                  dtype=mmse_std.dtype,
+                                                  output=allocate_stitched_output(dset, num_channels, mmse_std.dtype,
+                                                                                  std_fpath))
+
+            pred_stitcher.add_batch(mmse_imgs)
+            std_stitcher.add_batch(mmse_std)
+            del batch, mmse_imgs, mmse_std
+
+    psnr = [x.get() for x in patch_psnr_channels]
+    return pred_stitcher.get_output(), np.array(losses), psnr, std_stitcher.get_output()
@@ -90,9 +90,10 @@ def get_predictions(idx, val_dset, model, mmse_count=50, patch_size=256, grid_si
 
         inp = torch.Tensor(inp[None])
         tar = torch.Tensor(tar[None])
-        inp = inp.cuda()
+        device = next(model.parameters()).device
+        inp = inp.to(device)
         x_normalized = model.normalize_input(inp)
-        tar = tar.cuda()
+        tar = tar.to(device)
         tar_normalized = model.normalize_target(tar)
 
         recon_img_list = []
@@ -0,0 +1,154 @@
+"""
+Post-training reduced precision inference for a loaded checkpoint (after prepare_for_inference, see
+inference_engine.py):
+    - BF16: the bottom-up and the top-down pass run under torch.autocast with bfloat16, and their outputs are cast back
+      to float32.
+    - INT8: static quantization of the convolutions of the ResidualBlocks (including their gates) and of the
+      NormalStochasticBlocks, which make up nearly all of the FLOPs. The weights are quantized per channel and the
+      activations per tensor, with ranges calibrated on a few training patches. Every quantized convolution quantizes
+      its input and dequantizes its output, so everything else (likelihood, distributions, crops) stays in float32.
+"""
+import numpy as np
+import torch
+from torch import nn
+from torch.ao import quantization
+from torch.utils.data import DataLoader, Subset
+
+from disentangle.core.inference_precision import InferencePrecision
+from disentangle.core.nn_submodules import ResidualBlock
+from disentangle.core.stochastic import NormalStochasticBlock
+
+_CONV_TYPES = (nn.Conv2d, nn.Conv3d)
+
+
+def _to_float32(obj):
+    if isinstance(obj, torch.Tensor):
+        return obj.float() if obj.is_floating_point() else obj
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_float32(x) for x in obj)
+    if isinstance(obj, dict):
+        return {k: _to_float32(v) for k, v in obj.items()}
+    return obj
+
+
+def enable_bf16_autocast(model):
+    """
+    Runs the bottom-up and the top-down pass, which forward and sample_outputs use, under bfloat16 autocast.
+    """
+    device_type = next(model.parameters()).device.type
+    get_bu_values = model._get_bu_values
+    topdown_output = model._topdown_output
+
+    def _get_bu_values(x_pad):
+        with torch.autocast(device_type, dtype=torch.bfloat16):
+            return get_bu_values(x_pad)
+
+    def _topdown_output(bu_values, img_size, x_pad):
+        with torch.autocast(device_type, dtype=torch.bfloat16):
+            out, td_data = topdown_output(bu_values, img_size, x_pad)
+        return out.float(), _to_float32(td_data)
+
+    model._get_bu_values = _get_bu_values
+    model._topdown_output = _topdown_output
+    return model
+
+
+class QuantizedConv(nn.Module):
+    """
+    A convolution with a quantized input and a dequantized output. After quantization.convert, the convolution itself
+    runs on INT8.
+    """
+
+    def __init__(self, conv):
+        super().__init__()
+        self.quant = quantization.QuantStub()
+        self.conv = conv
+        self.dequant = quantization.DeQuantStub()
+
+    def forward(self, x):
+        return self.dequant(self.conv(self.quant(x)))
+
+
+def _quantizable_convs(model):
+    """
+    (parent, name) of every convolution of the ResidualBlocks and the NormalStochasticBlocks.
+    """
+    convs = []
+    for block in model.modules():
+        if not isinstance(block, (ResidualBlock, NormalStochasticBlock)):
+            continue
+        for parent in block.modules():
+            for name, child in parent.named_children():
+                if isinstance(child, _CONV_TYPES):
+                    convs.append((parent, name))
+    return convs
+
+
+def get_calibration_inputs(model, dset, num_patches=32, batch_size=16, seed=0):
+    """
+    Normalized inputs of num_patches random patches of dset, in batches.
+    """
+    rng = np.random.RandomState(seed)
+    idx_list = rng.choice(len(dset), size=min(num_patches, len(dset)), replace=False)
+    dloader = DataLoader(Subset(dset, idx_list.tolist()), batch_size=batch_size, shuffle=False)
+    device = next(model.parameters()).device
+    return [model.normalize_input(batch[0].to(device)) for batch in dloader]
+
+
+def quantize_int8(model, calibration_inputs, backend=None):
+    """
+    Static INT8 quantization of the convolutions of the ResidualBlocks and the NormalStochasticBlocks which the
+    calibration inputs reach, in place. The model must be on the CPU and in eval mode, with BatchNorm already folded
+    into the convolutions.
+    Args:
+        calibration_inputs: normalized input batches on which the activation ranges are observed.
+        backend: quantized engine. By default, x86 if supported and qnnpack otherwise.
+    Returns:
+        the number of quantized convolutions.
+    """
+    assert not model.training, 'Quantization needs the model in eval mode'
+    assert next(model.parameters()).device.type == 'cpu', 'Quantized convolutions only run on the CPU'
+    assert len(calibration_inputs) > 0, 'No calibration inputs'
+    if backend is None:
+        backend = 'x86' if 'x86' in torch.backends.quantized.supported_engines else 'qnnpack'
+    torch.backends.quantized.engine = backend
+
+    # convolutions which the inputs never reach (e.g. conv_in_p of the top layer) have no activation range.
+    reached = set()
+    handles = [getattr(parent, name).register_forward_pre_hook(lambda module, args: reached.add(module))
+               for parent, name in _quantizable_convs(model)]
+    with torch.no_grad():
+        model(calibration_inputs[0])
+    for handle in handles:
+        handle.remove()
+    convs = [(parent, name) for parent, name in _quantizable_convs(model) if getattr(parent, name) in reached]
+
+    qconfig = quantization.get_default_qconfig(backend)
+    for parent, name in convs:
+        wrapped = QuantizedConv(getattr(parent, name))
+        wrapped.qconfig = qconfig
+        setattr(parent, name, wrapped)
+
+    quantization.prepare(model, inplace=True)
+    with torch.no_grad():
+        for inp in calibration_inputs:
+            model(inp)
+    quantization.convert(model, inplace=True)
+    return len(convs)
+
+
+def set_inference_precision(model, precision, calibration_inputs=None):
+    """
+    Applies the precision (InferencePrecision) to the model, in place. calibration_inputs are needed for INT8.
+    Returns:
+        the model.
+    """
+    assert InferencePrecision.contains(precision), f'Invalid precision: {precision}'
+    if precision == InferencePrecision.BF16:
+        enable_bf16_autocast(model)
+        print('[set_inference_precision] bf16 autocast')
+    elif precision == InferencePrecision.INT8:
+        assert calibration_inputs is not None, 'INT8 quantization needs calibration inputs'
+        count = quantize_int8(model, calibration_inputs)
+        print(f'[set_inference_precision] int8 convolutions:{count} engine:{torch.backends.quantized.engine}')
+    return model
@@ -1,3 +1,4 @@
+import os
 from dataclasses import dataclass
 from typing import Iterable
 
@@ -7,85 +8,161 @@ from disentangle.data_loader.multifile_dset import MultiFileDset
 from disentangle.data_loader.patch_index_manager import TilingMode
 
 
-# from disentangle.analysis.stitch_prediction import * 
-def stitch_predictions(predictions, dset):
+def compute_stitching_slices(mng, dataset_idx_arr=None):
     """
+    Computes, in one vectorized pass, where each patch goes in the stitched output and which part of the patch is kept.
     Args:
-        smoothening_pixelcount: number of pixels which can be interpolated
+        mng: GridIndexManager of the dataset.
+        dataset_idx_arr: dataset indices of the patches. If None, all patches of the dataset are used.
+    Returns:
+        (vgs, vge, rs, re): (N, ndim) integer arrays. vgs/vge are the start/end of the valid region in the output and
+        rs/re are the start/end of the same region relative to the patch.
+    """
+    if dataset_idx_arr is None:
+        dataset_idx_arr = np.arange(mng.total_grid_count())
+
+    data_shape = np.array(mng.data_shape, dtype=np.int64)
+    # grid start, grid end
+    gs = mng.get_location_from_dataset_idx_arr(dataset_idx_arr)
+    ge = gs + np.array(mng.grid_shape, dtype=np.int64)
+
+    # patch start, patch end
+    ps = gs - mng.patch_offset()
+    pe = ps + np.array(mng.patch_shape, dtype=np.int64)
+
+    # valid grid start, valid grid end
+    vgs = np.maximum(gs, 0)
+    vge = np.minimum(ge, data_shape)
+    assert np.all(vgs == gs)
+    assert np.all(vge == ge)
+
+    if mng.tiling_mode == TilingMode.ShiftBoundary:
+        vgs[ps == 0] = 0
+        vge = np.where(pe == data_shape, data_shape, vge)
+
+    # relative start, relative end. This will be used on pred_tiled
+    rs = vgs - ps
+    re = rs + (vge - vgs)
+    return vgs, vge, rs, re
+
+
+def allocate_stitched_output(dset, num_channels: int, dtype=np.float32, memmap_fpath: str = None):
+    """
+    Allocates the (zero-filled) stitched output for dset. If memmap_fpath is given, the output is an np.memmap backed
+    .npy file. For MultiFileDset, a list with one array per file is returned and the file index is appended to the path.
     """
     if isinstance(dset, MultiFileDset):
-        cum_count = 0
-        output = []
-        for dset in dset.dsets:
-            cnt = dset.idx_manager.total_grid_count()
-            output.append(
-                stitch_predictions(predictions[cum_count:cum_count + cnt], dset))
-            cum_count += cnt
-        return output
-
-    else:
-        mng = dset.idx_manager
-        
-        # if there are more channels, use all of them.
-        shape = list(dset.get_data_shape())
-        shape[-1] = max(shape[-1], predictions.shape[1])
-
-        output = np.zeros(shape, dtype=predictions.dtype)
-        # frame_shape = dset.get_data_shape()[:-1]
-        for dset_idx in range(predictions.shape[0]):
-            # loc = get_location_from_idx(dset, dset_idx, predictions.shape[-2], predictions.shape[-1])
-            # grid start, grid end
-            gs = np.array(mng.get_location_from_dataset_idx(dset_idx), dtype=int)
-            ge = gs + mng.grid_shape
-
-            # patch start, patch end
-            ps = gs - mng.patch_offset()
-            pe = ps + mng.patch_shape
-            # print('PS')
-            # print(ps)
-            # print(pe)
-
-            # valid grid start, valid grid end
-            vgs = np.array([max(0,x) for x in gs], dtype=int)
-            vge = np.array([min(x,y) for x,y in zip(ge, mng.data_shape)], dtype=int)
-            assert np.all(vgs ==gs)
-            assert np.all(vge ==ge)
-            # print('VGS')
-            # print(gs)
-            # print(ge)
-            
-            if mng.tiling_mode == TilingMode.ShiftBoundary:
-                for dim in range(len(vgs)):
-                    if ps[dim] == 0:
-                        vgs[dim] = 0
-                    if pe[dim] == mng.data_shape[dim]:
-                        vge[dim]= mng.data_shape[dim]
-
-            # relative start, relative end. This will be used on pred_tiled
-            rs = vgs - ps
-            re = rs + ( vge - vgs)
-            # print('RS')
-            # print(rs)
-            # print(re)
-            
-            # print(output.shape)
-            # print(predictions.shape)
-            for ch_idx in range(predictions.shape[1]):
-                if len(output.shape) == 4:
-                    # channel dimension is the last one.
-                    output[vgs[0]:vge[0],
-                        vgs[1]:vge[1],
-                        vgs[2]:vge[2],
-                        ch_idx] = predictions[dset_idx][ch_idx,rs[1]:re[1], rs[2]:re[2]]
-                elif len(output.shape) == 5:
-                    # channel dimension is the last one.
-                    assert vge[0] - vgs[0] == 1, 'Only one frame is supported'
-                    output[vgs[0],
-                        vgs[1]:vge[1],
-                        vgs[2]:vge[2],
-                        vgs[3]:vge[3],
-                        ch_idx] = predictions[dset_idx][ch_idx, rs[1]:re[1], rs[2]:re[2], rs[3]:re[3]]
-                else:
-                    raise ValueError(f'Unsupported shape {output.shape}')
-                
-        return output
+        outputs = []
+        for i, cur_dset in enumerate(dset.dsets):
+            fpath = None
+            if memmap_fpath is not None:
+                root, ext = os.path.splitext(memmap_fpath)
+                fpath = f'{root}_{i}{ext}'
+            outputs.append(allocate_stitched_output(cur_dset, num_channels, dtype=dtype, memmap_fpath=fpath))
+        return outputs
+
+    # if there are more channels, use all of them.
+    shape = list(dset.get_data_shape())
+    shape[-1] = max(shape[-1], num_channels)
+    if memmap_fpath is None:
+        return np.zeros(shape, dtype=dtype)
+    # a freshly created .npy memmap is zero-filled.
+    return np.lib.format.open_memmap(memmap_fpath, mode='w+', dtype=dtype, shape=tuple(shape))
+
+
+class PredictionStitcher:
+    """
+    Stitches tiled predictions into full frames. Predictions can be added batch by batch (in dataset order) so that the
+    tiled predictions for the whole dataset never need to exist in memory. The placement of every patch is precomputed
+    once with compute_stitching_slices and all channels of a patch are written with a single assignment.
+    """
+
+    def __init__(self, dset, num_channels: int, dtype=np.float32, output=None):
+        """
+        Args:
+            dset: the dataset which was used to generate the tiled predictions.
+            num_channels: number of channels in the predictions.
+            dtype: dtype of the stitched output.
+            output: optional preallocated output, see allocate_stitched_output. A list of arrays for MultiFileDset.
+        """
+        if isinstance(dset, MultiFileDset):
+            self._dsets = dset.dsets
+            self._is_multifile = True
+        else:
+            self._dsets = [dset]
+            self._is_multifile = False
+
+        self._num_channels = num_channels
+        self._slices = []
+        self._outputs = []
+        self._offsets = [0]
+        for i, cur_dset in enumerate(self._dsets):
+            mng = cur_dset.idx_manager
+            self._slices.append(compute_stitching_slices(mng))
+            self._offsets.append(self._offsets[-1] + mng.total_grid_count())
+            if output is None:
+                self._outputs.append(allocate_stitched_output(cur_dset, num_channels, dtype=dtype))
+            else:
+                self._outputs.append(output[i] if self._is_multifile else output)
+
+        self._next_idx = 0
+
+    def __len__(self):
+        return self._offsets[-1]
+
+    def _place(self, output, predictions, vgs, vge, rs, re):
+        C = predictions.shape[1]
+        if len(output.shape) == 4:
+            for i in range(len(predictions)):
+                # channel dimension is the last one.
+                output[vgs[i, 0]:vge[i, 0], vgs[i, 1]:vge[i, 1], vgs[i, 2]:vge[i, 2], :C] = np.moveaxis(
+                    predictions[i, :, rs[i, 1]:re[i, 1], rs[i, 2]:re[i, 2]], 0, -1)
+        elif len(output.shape) == 5:
+            assert np.all(vge[:, 0] - vgs[:, 0] == 1), 'Only one frame is supported'
+            for i in range(len(predictions)):
+                output[vgs[i, 0], vgs[i, 1]:vge[i, 1], vgs[i, 2]:vge[i, 2], vgs[i, 3]:vge[i, 3], :C] = np.moveaxis(
+                    predictions[i, :, rs[i, 1]:re[i, 1], rs[i, 2]:re[i, 2], rs[i, 3]:re[i, 3]], 0, -1)
+        else:
+            raise ValueError(f'Unsupported shape {output.shape}')
+
+    def add_batch(self, predictions, start_idx: int = None):
+        """
+        Places a batch of tiled predictions with shape (B, C, ...) in the output.
+        Args:
+            predictions: tiled predictions for the dataset indices [start_idx, start_idx + B).
+            start_idx: dataset index of the first patch of the batch. By default, batches are assumed to arrive in order.
+        """
+        if start_idx is None:
+            start_idx = self._next_idx
+        end_idx = start_idx + len(predictions)
+        assert end_idx <= len(self), f'Predictions for indices [{start_idx},{end_idx}) exceed the dataset size {len(self)}'
+
+        # a batch can span multiple files.
+        for dset_i in range(len(self._dsets)):
+            f_start, f_end = self._offsets[dset_i], self._offsets[dset_i + 1]
+            b_start, b_end = max(start_idx, f_start), min(end_idx, f_end)
+            if b_start >= b_end:
+                continue
+            vgs, vge, rs, re = self._slices[dset_i]
+            sl = slice(b_start - f_start, b_end - f_start)
+            self._place(self._outputs[dset_i], predictions[b_start - start_idx:b_end - start_idx], vgs[sl], vge[sl],
+                        rs[sl], re[sl])
+
+        self._next_idx = end_idx
+
+    def get_output(self):
+        if self._is_multifile:
+            return self._outputs
+        return self._outputs[0]
+
+
+# from disentangle.analysis.stitch_prediction import *
+def stitch_predictions(predictions, dset):
+    """
+    Args:
+        predictions: tiled predictions of the whole dataset, with shape (N, C, ...).
+        dset: the dataset which was used to generate the tiled predictions.
+    """
+    stitcher = PredictionStitcher(dset, predictions.shape[1], dtype=predictions.dtype)
+    stitcher.add_batch(predictions, start_idx=0)
+    return stitcher.get_output()
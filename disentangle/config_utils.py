@@ -7,6 +7,7 @@ import pickle
 
 import ml_collections
 from disentangle.core.loss_type import LossType
+from disentangle.data_loader.data_pipeline import DATALOADER_DEFAULTS
 
 
 def load_config(config_fpath):
@@ -28,7 +29,11 @@ def get_updated_config(config):
         config = ml_collections.ConfigDict(config)
 
     with config.unlocked():
-        pass
+        if 'dataloader' not in config:
+            config.dataloader = ml_collections.ConfigDict()
+        for key, value in DATALOADER_DEFAULTS.items():
+            if key not in config.dataloader:
+                config.dataloader[key] = value
 
     if frozen_dict:
         return ml_collections.FrozenConfigDict(config)
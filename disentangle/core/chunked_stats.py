@@ -0,0 +1,205 @@
+"""
+Statistics over large (N, ..., C) arrays computed in chunks of frames, so that no full-size temporary array is created.
+The quantiles are exact and equal to np.quantile (linear interpolation). The moments are combined with the parallel
+algorithm of Chan et al., and agree with np.mean/np.std up to floating point rounding.
+"""
+import numpy as np
+
+# number of elements which are processed at once.
+CHUNK_ELEMENTS = 2**24
+
+
+def iter_frame_chunks(data, chunk_elements=CHUNK_ELEMENTS):
+    """
+    Yields slices over the first axis of data, each covering about chunk_elements elements.
+    """
+    frame_size = int(np.prod(data.shape[1:]))
+    chunk_frames = max(1, chunk_elements // max(1, frame_size))
+    for start in range(0, len(data), chunk_frames):
+        yield slice(start, min(len(data), start + chunk_frames))
+
+
+def _lerp_like_numpy(previous, next, n, q, dtype):
+    """
+    np.quantile only looks at the two sorted values around the virtual index (n - 1) * q. With the same two values in a
+    2-element array and the same interpolation weight, np.quantile returns the same (bit-identical) result.
+    """
+    virtual_index = (n - 1) * q
+    gamma = float(virtual_index - np.floor(virtual_index))
+    return np.quantile(np.array([previous, next], dtype=dtype), gamma)
+
+
+def _chunk_values(data, sl, channel):
+    return data[sl] if channel is None else data[sl][..., channel]
+
+
+class TailQuantile:
+    """
+    Exact q-quantile (the same value as np.quantile) of n values which are seen chunk by chunk, in a single pass. Only
+    the values between the quantile and the nearer end of the sorted data can matter, so at most
+    min(q, 1 - q) * n + 2 candidates are kept. Once there are enough of them, the values of a new chunk are first
+    compared with the current candidates and only those which can still be among them are partitioned.
+    """
+
+    def __init__(self, q, n):
+        self._q = q
+        self._n = n
+        # the dtype of the values, known with the first chunk.
+        self._dtype = None
+        virtual_index = (n - 1) * q
+        self._previous_rank = int(np.floor(virtual_index))
+        self._next_rank = min(self._previous_rank + 1, n - 1)
+        self._upper = q >= 0.5
+        # number of candidates: the values at or above previous_rank (upper tail) or at or below next_rank.
+        self._k = n - self._previous_rank if self._upper else self._next_rank + 1
+        # until there are k values, they are only collected. Afterwards, threshold is the k-th most extreme value so far.
+        self._candidates = []
+        self._count = 0
+        self._threshold = None
+
+    def update(self, values):
+        if self._threshold is None:
+            values = values.reshape(-1)
+        elif self._upper:
+            values = values[values >= self._threshold]
+        else:
+            values = values[values <= self._threshold]
+        if len(values) == 0:
+            return
+        if self._dtype is None:
+            self._dtype = values.dtype
+        self._candidates.append(values.astype(self._dtype, copy=False))
+        self._count += len(values)
+        if self._count < self._k:
+            return
+        candidates = np.concatenate(self._candidates)
+        if self._upper:
+            candidates = np.partition(candidates, len(candidates) - self._k)[len(candidates) - self._k:]
+            self._threshold = candidates[0]
+        else:
+            candidates = np.partition(candidates, self._k - 1)[:self._k]
+            self._threshold = candidates[-1]
+        self._candidates = [candidates]
+        self._count = self._k
+
+    def get(self):
+        assert self._threshold is not None, f'Only {self._count} of {self._n} values were seen'
+        candidates = self._candidates[0]
+        if self._k == 1:
+            previous = next = candidates[0]
+        elif self._upper:
+            # the candidates are the values from previous_rank onwards.
+            previous, next = np.partition(candidates, 1)[:2]
+            next = previous if self._next_rank == self._previous_rank else next
+        else:
+            # the candidates are the values up to next_rank.
+            previous, next = np.partition(candidates, self._k - 2)[-2:]
+            previous = next if self._next_rank == self._previous_rank else previous
+        return _lerp_like_numpy(previous, next, self._n, self._q, self._dtype)
+
+
+def get_tail_quantiles(data, q, channelwise):
+    """
+    TailQuantile for every channel of data, or a single one for all of it.
+    """
+    if channelwise:
+        return [TailQuantile(q, data.size // data.shape[-1]) for _ in range(data.shape[-1])]
+    return [TailQuantile(q, data.size)]
+
+
+def update_tail_quantiles(quantiles, chunk):
+    """
+    Adds a chunk of frames to the quantiles of get_tail_quantiles.
+    """
+    if len(quantiles) == 1:
+        quantiles[0].update(chunk.reshape(-1))
+        return
+    for channel, quantile in enumerate(quantiles):
+        quantile.update(chunk[..., channel])
+
+
+def chunked_quantile(data, q, channel=None, chunk_elements=CHUNK_ELEMENTS):
+    """
+    Same as np.quantile(data, q) (or np.quantile(data[..., channel], q)), in one pass over the data and without copying
+    it (see TailQuantile).
+    """
+    n = data.size if channel is None else data.size // data.shape[-1]
+    quantile = TailQuantile(q, n)
+    for sl in iter_frame_chunks(data, chunk_elements):
+        quantile.update(_chunk_values(data, sl, channel))
+    return quantile.get()
+
+
+def combine_moments(count_a, mean_a, m2_a, count_b, mean_b, m2_b):
+    """
+    Combines (count, mean, sum of squared deviations) of two sets of values (Chan et al.).
+    """
+    count = count_a + count_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (count_b / count)
+    m2 = m2_a + m2_b + delta**2 * (count_a * count_b / count)
+    return count, mean, m2
+
+
+def _add_chunk_moments(moments, chunk, noise=None):
+    """
+    Combines the per channel moments with those of a chunk of frames (of chunk + noise, if noise is given). Every
+    channel is reduced on its own, in float64 and without converting the whole chunk.
+    """
+    C = chunk.shape[-1]
+    mean = np.zeros(C)
+    m2 = np.zeros(C)
+    for ch in range(C):
+        values = chunk[..., ch] if noise is None else chunk[..., ch] + noise[..., ch]
+        mean[ch] = values.mean(dtype=np.float64)
+        deviation = (values - mean[ch]).reshape(-1)
+        m2[ch] = np.dot(deviation, deviation)
+    return combine_moments(*moments, chunk.size // C, mean, m2)
+
+
+def channel_moments(data, noise=None, chunk_elements=CHUNK_ELEMENTS):
+    """
+    Per channel (count, mean, sum of squared deviations) of data, in one sweep. If noise is given, the moments of
+    data + noise are returned as well.
+    Returns:
+        (count, mean, m2) or ((count, mean, m2), (count, mean, m2) of data + noise). mean and m2 have shape (C,).
+    """
+    C = data.shape[-1]
+    moments = (0, np.zeros(C), np.zeros(C))
+    noisy_moments = (0, np.zeros(C), np.zeros(C))
+    for sl in iter_frame_chunks(data, chunk_elements):
+        moments = _add_chunk_moments(moments, data[sl])
+        if noise is not None:
+            noisy_moments = _add_chunk_moments(noisy_moments, data[sl], noise=noise[sl])
+    if noise is None:
+        return moments
+    return moments, noisy_moments
+
+
+def merge_channel_moments(count, mean, m2):
+    """
+    Moments over all channels from the per channel moments.
+    """
+    merged = (0, 0.0, 0.0)
+    for ch in range(len(mean)):
+        merged = combine_moments(*merged, count, mean[ch], m2[ch])
+    return merged
+
+
+def upperclip_(data, max_val, chunk_elements=CHUNK_ELEMENTS, return_moments=False):
+    """
+    In place data[data > max_val] = max_val, one chunk at a time and without boolean masks. max_val is a scalar or a
+    per channel list.
+    Args:
+        return_moments: if True, the channel_moments of the clipped data are computed in the same sweep and returned.
+    """
+    # the same casting as in the masked assignment.
+    max_val = np.asarray(max_val).astype(data.dtype)
+    C = data.shape[-1]
+    moments = (0, np.zeros(C), np.zeros(C))
+    for sl in iter_frame_chunks(data, chunk_elements):
+        np.minimum(data[sl], max_val, out=data[sl])
+        if return_moments:
+            moments = _add_chunk_moments(moments, data[sl])
+    if return_moments:
+        return moments
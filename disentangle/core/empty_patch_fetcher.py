@@ -1,61 +1,105 @@
+import hashlib
+import os
+
 import numpy as np
-from tqdm import tqdm
+
+
+def running_max_1d(arr, window, axis):
+    """
+    Sliding-window max along axis using the van Herk/Gil-Werman algorithm: 3 comparisons per element, independent of
+    the window size. output[..., i, ...] = arr[..., i:i + window, ...].max(). The output is shorter than arr by
+    window - 1 along axis.
+    """
+    arr = np.moveaxis(arr, axis, -1)
+    n = arr.shape[-1]
+    assert window <= n, f'Window {window} is larger than the axis length {n}'
+    block_count = int(np.ceil(n / window))
+    pad = block_count * window - n
+    padded = np.pad(arr, [(0, 0)] * (arr.ndim - 1) + [(0, pad)], mode='edge')
+    blocks = padded.reshape(*arr.shape[:-1], block_count, window)
+    # prefix max within each block, and suffix max within each block.
+    prefix = np.maximum.accumulate(blocks, axis=-1).reshape(*arr.shape[:-1], -1)
+    suffix = np.flip(np.maximum.accumulate(np.flip(blocks, axis=-1), axis=-1), axis=-1).reshape(*arr.shape[:-1], -1)
+    out_len = n - window + 1
+    output = np.maximum(suffix[..., :out_len], prefix[..., window - 1:window - 1 + out_len])
+    return np.moveaxis(output, -1, axis)
 
 
 class EmptyPatchFetcher:
     """
-    The idea is to fetch empty patches so that real content can be replaced with this. 
+    The idea is to fetch empty patches so that real content can be replaced with this.
     """
 
-    def __init__(self, idx_manager, patch_size, data_frames, max_val_threshold=None):
+    def __init__(self, idx_manager, patch_size, data_frames, max_val_threshold=None, cache_dir=None, cache_key=None):
+        """
+        Args:
+            cache_dir: if given, the list of empty indices is saved here and reused by later runs.
+            cache_key: identifies the data_frames, e.g. get_cache_key of the data config, split and channel. It is
+                combined with the data shape, max_val_threshold and the patch/grid configuration. Needed with cache_dir.
+        """
         self._frames = data_frames
         self._idx_manager = idx_manager
         self._max_val_threshold = max_val_threshold
         self._idx_list = []
         self._patch_size = patch_size
         self._grid_size = 1
+        self._cache_dir = cache_dir
+        self._cache_key = cache_key
+        assert cache_dir is None or cache_key is not None, 'cache_key is needed to cache the empty indices'
         self.set_empty_idx()
 
-        print(f'[{self.__class__.__name__}] MaxVal:{self._max_val_threshold}')
+        print(f'[{self.__class__.__name__}] MaxVal:{self._max_val_threshold} EmptyCount:{len(self._idx_list)}')
 
     def compute_max(self, window):
         """
-        Rolling compute.
+        max_data[n, h, w] is the max of the window x window patch of frame n starting at (h, w). It is computed as two
+        separable running-max passes.
         """
         N, H, W = self._frames.shape
-        randnum = -954321
-        assert self._grid_size == 1
-        max_data = np.zeros((N, H - window, W - window)) * randnum
-
-        for h in tqdm(range(H - window)):
-            for w in range(W - window):
-                max_data[:, h, w] = self._frames[:, h:h + window, w:w + window].max(axis=(1, 2))
-
-        assert (max_data != 954321).any()
+        max_data = running_max_1d(self._frames, window, axis=1)
+        max_data = running_max_1d(max_data, window, axis=2)
         return max_data
 
+    def _cache_fpath(self):
+        key = '_'.join([
+            str(self._cache_key),
+            str(self._frames.shape),
+            str(self._frames.dtype),
+            str(self._max_val_threshold),
+            str(self._patch_size),
+            str(self._idx_manager.data_shape),
+            str(self._idx_manager.grid_shape),
+            str(self._idx_manager.patch_shape),
+            str(self._idx_manager.tiling_mode),
+        ])
+        key_hash = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self._cache_dir, f'{self.__class__.__name__}_{key_hash}.npy')
+
     def set_empty_idx(self):
+        if self._cache_dir is not None:
+            fpath = self._cache_fpath()
+            if os.path.exists(fpath):
+                self._idx_list = np.load(fpath)
+                print(f'[{self.__class__.__name__}] Loaded empty indices from {fpath}')
+                assert len(self._idx_list) > 0
+                return
+
         max_data = self.compute_max(self._patch_size)
-        empty_loc = np.where(np.logical_and(max_data >= 0, max_data < self._max_val_threshold))
-        # print(max_data.shape, len(empty_loc))
-        self._idx_list = []
-        for idx in range(len(empty_loc[0])):
-            n_idx = empty_loc[0][idx]
-            h_start = empty_loc[1][idx]
-            w_start = empty_loc[2][idx]
-            # print(n_idx,h_start,w_start)
-            # channel_idx = self._idx_manager.get_location_from_dataset_idx(0)[-1]
-            loc = (n_idx, h_start, w_start,0)
-            idx = self._idx_manager.get_dataset_idx_from_location(loc)
-            t,h,w,_ = self._idx_manager.get_location_from_dataset_idx(idx)
-            assert h == h_start, f'{h} != {h_start}'
-            assert w == w_start, f'{w} != {w_start}'
-            assert t == n_idx, f'{t} != {n_idx}'
-            self._idx_list.append(idx)
-        
-        self._idx_list = np.array(self._idx_list)
-        
+        # a patch is empty if its max is below the threshold. Look up every patch of the index manager at once.
+        all_idx = np.arange(self._idx_manager.total_grid_count())
+        patch_loc = self._idx_manager.get_patch_location_from_dataset_idx_arr(all_idx)
+        n_idx, h_start, w_start = patch_loc[:, 0], patch_loc[:, 1], patch_loc[:, 2]
+        valid = (h_start >= 0) & (w_start >= 0) & (h_start < max_data.shape[1]) & (w_start < max_data.shape[2])
+        patch_max = np.full(len(all_idx), np.inf)
+        patch_max[valid] = max_data[n_idx[valid], h_start[valid], w_start[valid]]
+        empty_mask = np.logical_and(patch_max >= 0, patch_max < self._max_val_threshold)
+        self._idx_list = all_idx[empty_mask]
+
         assert len(self._idx_list) > 0
 
+        if self._cache_dir is not None:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            np.save(fpath, self._idx_list)
+
     def sample(self):
         return (np.random.choice(self._idx_list), self._grid_size)
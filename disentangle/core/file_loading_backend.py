@@ -0,0 +1,11 @@
+from disentangle.core.custom_enum import Enum
+
+
+class FileLoadingBackend(Enum):
+    """
+    Pool in which the raw data files are decoded (see data_loader/parallel_file_loader.py).
+    """
+    # decoders which release the GIL (tifffile, czifile, nd2) and no pickling of the decoded arrays.
+    Thread = 'thread'
+    # for decoders which hold the GIL. The decoded arrays are pickled back to the main process.
+    Process = 'process'
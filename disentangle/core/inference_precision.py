@@ -0,0 +1,12 @@
+from disentangle.core.custom_enum import Enum
+
+
+class InferencePrecision(Enum):
+    """
+    Numerical precision of the predictions (see analysis/quantized_inference.py).
+    """
+    FP32 = 'fp32'
+    # bfloat16 autocast of the bottom-up and the top-down pass.
+    BF16 = 'bf16'
+    # static INT8 quantization of the convolutions of the residual and the stochastic blocks, CPU only.
+    INT8 = 'int8'
@@ -111,6 +111,9 @@ class NoiseModelLikelihood(LikelihoodModule):
         # x_cloned = x_cloned.permute(1, 0, 2, 3)
         # x_reduced = x_cloned[0, ...]
         # import pdb;pdb.set_trace()
+        if hasattr(self.noiseModel, 'log_likelihood'):
+            return self.noiseModel.log_likelihood(x_denormalized, predicted_s_denormalized)
+
         likelihoods = self.noiseModel.likelihood(x_denormalized, predicted_s_denormalized)
         # likelihoods = self.noiseModel.likelihood(x, params['mean'])
         logprob = torch.log(likelihoods)
@@ -13,6 +13,7 @@ from torch.distributions.normal import Normal
 
 from disentangle.core.stable_dist_params import StableLogVar, StableMean
 from disentangle.core.stable_exp import log_prob
+from disentangle.core.stochastic_mode import StochasticMode
 
 
 class NormalStochasticBlock(nn.Module):
@@ -31,7 +32,8 @@ class NormalStochasticBlock(nn.Module):
                  transform_p_params: bool = True,
                  vanilla_latent_hw: int = None,
                  restricted_kl:bool = False,
-                 use_naive_exponential=False):
+                 use_naive_exponential=False,
+                 stochastic_mode=StochasticMode.Full):
         """
         Args:
             c_in:   This is the channel count of the tensor input to this module.
@@ -39,6 +41,7 @@ class NormalStochasticBlock(nn.Module):
             c_out:  Output of the stochastic layer. Note that this is different from z.
             kernel: kernel used in convolutional layers.
             transform_p_params: p_params are transformed if this is set to True.
+            stochastic_mode: StochasticMode. Which of the KL metrics, log q(z) and diagnostics get computed.
         """
         super().__init__()
         assert kernel % 2 == 1
@@ -55,6 +58,8 @@ class NormalStochasticBlock(nn.Module):
         
         self._vanilla_latent_hw = vanilla_latent_hw
         self._restricted_kl = restricted_kl
+        assert StochasticMode.contains(stochastic_mode), f'Invalid stochastic_mode: {stochastic_mode}'
+        self.stochastic_mode = stochastic_mode
 
         if transform_p_params:
             self.conv_in_p = conv_cls(c_in, 2 * c_vars, kernel, padding=pad)
@@ -120,6 +125,7 @@ class NormalStochasticBlock(nn.Module):
         Compute KL (analytical or MC estimate) and then process it in multiple ways.
         """
         kl_samplewise_restricted = None
+        kl_channelwise = kl_spatial = None
         if mode_pred is False:  # if not predicting
             if analytical_kl:
                 kl_elementwise = kl_divergence(q, p)
@@ -135,10 +141,14 @@ class NormalStochasticBlock(nn.Module):
                 kl_samplewise_restricted = tmp.sum(all_dims[1:])
             
             kl_samplewise = kl_elementwise.sum(all_dims[1:])
-            kl_channelwise = kl_elementwise.sum(all_dims[2:])
-            # Compute spatial KL analytically (but conditioned on samples from
-            # previous layers)
-            kl_spatial = kl_elementwise.sum(1)
+            if self.stochastic_mode == StochasticMode.Full:
+                kl_channelwise = kl_elementwise.sum(all_dims[2:])
+                # Compute spatial KL analytically (but conditioned on samples from
+                # previous layers)
+                kl_spatial = kl_elementwise.sum(1)
+            else:
+                # only the samplewise KL enters the loss.
+                kl_elementwise = None
         else:  # if predicting, no need to compute KL
             kl_elementwise = kl_samplewise = kl_spatial = kl_channelwise = None
 
@@ -209,12 +219,15 @@ class NormalStochasticBlock(nn.Module):
             analytical_kl: If True, typical KL divergence is calculated. Otherwise, a one-sample approximate of it is
                             calculated.
             mode_pred: If True, then only prediction happens. Otherwise, KL divergence loss also gets computed.
+                            KL is not computed either in StochasticMode.Inference.
             use_uncond_mode: Used only when mode_pred=True
             var_clip_max: This is the maximum value the log of the variance of the latent vector for any layer can reach.
             
         """
-
-        debug_qvar_max = 0
+        full_mode = self.stochastic_mode == StochasticMode.Full
+        skip_kl = mode_pred or self.stochastic_mode == StochasticMode.Inference
+        # in the lean mode, max log(var) of q is computed from q_params, and only when it gets logged.
+        debug_qvar_max = 0 if full_mode else None
         assert (forced_latent is None) or (not use_mode)
 
         p_mu, p_lv, p = self.process_p_params(p_params, var_clip_max)
@@ -225,7 +238,8 @@ class NormalStochasticBlock(nn.Module):
             # At inference time, just don't centercrop the q_params even if they are odd in size.
             q_mu, q_lv, q = self.process_q_params(q_params, var_clip_max, allow_oddsizes=mode_pred is True)
             q_params = (q_mu, q_lv)
-            debug_qvar_max = torch.max(q_lv.get())
+            if full_mode:
+                debug_qvar_max = torch.max(q_lv.get())
             # Sample from q(z)
             sampling_distrib = q
             q_size = q_mu.get().shape[-1]
@@ -257,9 +271,9 @@ class NormalStochasticBlock(nn.Module):
 
         if q_params is not None:
             # Compute log q(z)
-            logprob_q = q.log_prob(z).sum((1, 2, 3))
+            logprob_q = q.log_prob(z).sum((1, 2, 3)) if full_mode else None
             # compute KL divergence metrics
-            kl_dict = self.compute_kl_metrics(p, p_params, q, q_params, mode_pred, analytical_kl, z)
+            kl_dict = self.compute_kl_metrics(p, p_params, q, q_params, skip_kl, analytical_kl, z)
         else:
             kl_dict = {}
             logprob_q = None
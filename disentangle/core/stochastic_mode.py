@@ -0,0 +1,13 @@
+from disentangle.core.custom_enum import Enum
+
+
+class StochasticMode(Enum):
+    """
+    What the stochastic blocks of the top-down pass compute besides the latent sample.
+    """
+    # log q(z), all KL reductions (elementwise, samplewise, channelwise, spatial) and max log(var) of q.
+    Full = 'full'
+    # Training: only the samplewise KL which the loss uses. Diagnostics are computed from q_params when logged.
+    Lean = 'lean'
+    # Prediction only: no KL, no log q(z) and no diagnostics.
+    Inference = 'inference'
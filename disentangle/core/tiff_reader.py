@@ -1,6 +1,8 @@
 import numpy as np
 from skimage.io import imread, imsave
 
+import tifffile
+
 
 def load_tiff(path):
     """
@@ -15,5 +17,29 @@ def save_tiff(path, data):
 
 
 def load_tiffs(paths):
-    data = [load_tiff(path) for path in paths]
-    return np.concatenate(data, axis=0)
+    """
+    Concatenates the files along the first axis. When the shapes in the tiff headers match the loaded arrays, the output
+    is allocated once and filled file by file, instead of holding every file and the concatenated array at the same time.
+    """
+    if len(paths) == 1:
+        return load_tiff(paths[0])
+
+    shapes = []
+    for path in paths:
+        with tifffile.TiffFile(path) as tif:
+            shapes.append(tif.series[0].shape)
+
+    data = None
+    start = 0
+    for i, (path, shape) in enumerate(zip(paths, shapes)):
+        cur_data = load_tiff(path)
+        if cur_data.shape != shape or shape[1:] != shapes[0][1:]:
+            # load_tiff can reorder the axes, in which case the header shapes are of no use.
+            loaded = [] if data is None else [data[:start]]
+            return np.concatenate(loaded + [cur_data] + [load_tiff(p) for p in paths[i + 1:]], axis=0)
+        if data is None:
+            data = np.empty((sum([s[0] for s in shapes]), *shape[1:]), dtype=cur_data.dtype)
+        data[start:start + len(cur_data)] = cur_data
+        start += len(cur_data)
+        del cur_data
+    return data
@@ -5,6 +5,7 @@ import numpy as np
 import nd2
 from disentangle.core.data_split_type import DataSplitType
 from disentangle.core.tiff_reader import load_tiff
+from disentangle.data_loader.parallel_file_loader import get_file_loading_kwargs, load_files
 
 
 def zebrafish_train_fnames():
@@ -40,7 +41,7 @@ def get_train_val_data(datadir, data_config, datasplit_type: DataSplitType, val_
         
         print('Loading zebrafish data:', datadir, fnames)
         fpaths = [os.path.join(datadir, x) for x in fnames]
-        data = [(load_tiff(x),x) for x in fpaths]
+        data = list(zip(load_files(load_tiff, fpaths, **get_file_loading_kwargs(data_config)), fpaths))
         return data
     
     elif data_config.subdset_type == 'liver':
@@ -0,0 +1,81 @@
+"""
+Flip/rot90 augmentation (the dihedral group D4 of the square, plus an optional flip along Z) applied to whole batches.
+Every sample gets its own random transform, and samples with the same transform are processed together, so a batch
+needs at most 16 array operations. Works on numpy arrays and on torch tensors (on any device), with the spatial
+dimensions last: (B, ..., H, W) or, with the Z flip, (B, ..., Z, H, W).
+"""
+import numpy as np
+import torch
+from torch.utils.data import default_collate
+
+
+def sample_d4_params(n, flip_z=False, rng=np.random):
+    """
+    Random transforms of n samples: number of 90 degree rotations, horizontal flip and Z flip. Together, the rotation
+    and the horizontal flip cover all 8 elements of D4 with equal probability.
+    """
+    rot_k = rng.randint(0, 4, size=n)
+    hflip = rng.rand(n) < 0.5
+    zflip = rng.rand(n) < 0.5 if flip_z else np.zeros(n, dtype=bool)
+    return rot_k, hflip, zflip
+
+
+def _transform(x, rot_k, hflip, zflip):
+    if isinstance(x, torch.Tensor):
+        if zflip:
+            x = torch.flip(x, dims=(-3, ))
+        if hflip:
+            x = torch.flip(x, dims=(-1, ))
+        return torch.rot90(x, int(rot_k), dims=(-2, -1))
+
+    if zflip:
+        x = np.flip(x, axis=-3)
+    if hflip:
+        x = np.flip(x, axis=-1)
+    return np.rot90(x, int(rot_k), axes=(-2, -1))
+
+
+def apply_d4(x, rot_k, hflip, zflip=None):
+    """
+    Applies the transform (rot_k[i], hflip[i], zflip[i]) to x[i]. H and W must be equal.
+    """
+    assert x.shape[-1] == x.shape[-2], f'Rotation by 90 degrees needs square patches, got {tuple(x.shape)}'
+    if zflip is None:
+        zflip = np.zeros(len(rot_k), dtype=bool)
+    codes = np.asarray(rot_k) * 4 + np.asarray(hflip) * 2 + np.asarray(zflip)
+    is_tensor = isinstance(x, torch.Tensor)
+    output = torch.empty_like(x) if is_tensor else np.empty_like(x)
+    for code in np.unique(codes):
+        idx = np.where(codes == code)[0]
+        if is_tensor:
+            idx = torch.from_numpy(idx).to(x.device)
+        output[idx] = _transform(x[idx], code // 4, (code // 2) % 2 == 1, code % 2 == 1)
+    return output
+
+
+class D4Augmentation:
+    """
+    Applies the same random flip/rot90 to all given arrays of a batch, e.g. input and target.
+    It can be used on the device after the transfer:
+        inp, target = augmentation(inp, target)
+    or, on the CPU, as collate_fn of a DataLoader. Then it augments the first num_arrays entries of the samples.
+    """
+
+    def __init__(self, flip_z=False, num_arrays=2, seed=None):
+        self._flip_z = flip_z
+        self._num_arrays = num_arrays
+        # None stands for the global np.random, which (being a module) can not be pickled for spawned workers.
+        self._rng = None if seed is None else np.random.RandomState(seed)
+
+    def sample_params(self, n):
+        rng = np.random if self._rng is None else self._rng
+        return sample_d4_params(n, flip_z=self._flip_z, rng=rng)
+
+    def __call__(self, *arrays):
+        params = self.sample_params(len(arrays[0]))
+        return tuple(apply_d4(x, *params) for x in arrays)
+
+    def collate(self, samples):
+        batch = default_collate(samples)
+        augmented = self(*batch[:self._num_arrays])
+        return type(batch)([*augmented, *batch[self._num_arrays:]])
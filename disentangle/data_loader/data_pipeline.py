@@ -0,0 +1,151 @@
+"""
+Settings of the torch DataLoaders (config.dataloader) and the sharing of the dataset arrays with the workers.
+
+Every worker gets a copy of the dataset. With the fork start method, the arrays are shared copy-on-write, but with
+spawn or forkserver (multiprocessing_context) every worker unpickles its own copy of them, memory-mapped arrays
+included. share_dataset_memory moves the arrays into shared memory and makes memory-mapped arrays reopen their file, so
+that the workers get handles instead. With persistent_workers, the workers (and so the copies) are not recreated every
+epoch.
+"""
+import mmap
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+# the defaults are the settings which were used before they were configurable.
+DATALOADER_DEFAULTS = {
+    'pin_memory': False,
+    'persistent_workers': False,
+    'prefetch_factor': 2,
+    # moves the dataset arrays into shared memory (see share_dataset_memory).
+    'share_memory': False,
+    # start method of the workers: None (the default of the platform), 'fork', 'spawn' or 'forkserver'.
+    'multiprocessing_context': None,
+}
+
+# arrays smaller than this are not worth sharing.
+MIN_SHARED_BYTES = 1024 * 1024
+
+
+def get_dataloader_kwargs(config, num_workers=None):
+    """
+    Keyword arguments of DataLoader for config.dataloader (DATALOADER_DEFAULTS for the missing entries).
+    Args:
+        num_workers: by default, config.training.num_workers.
+    """
+    settings = dict(DATALOADER_DEFAULTS)
+    if 'dataloader' in config:
+        settings.update(config.dataloader)
+    if num_workers is None:
+        num_workers = config.training.num_workers
+
+    kwargs = {
+        'num_workers': num_workers,
+        'pin_memory': settings['pin_memory'] and torch.cuda.is_available(),
+    }
+    # these only apply to worker processes.
+    if num_workers > 0:
+        kwargs['persistent_workers'] = settings['persistent_workers']
+        kwargs['prefetch_factor'] = settings['prefetch_factor']
+        kwargs['multiprocessing_context'] = settings['multiprocessing_context']
+    return kwargs
+
+
+def _rebuild_shared_array(tensor, dtype, shape):
+    return SharedArray.from_tensor(tensor, dtype, shape)
+
+
+class SharedArray(np.ndarray):
+    """
+    A numpy array whose buffer is a torch tensor in shared memory. When it is sent to a worker, only a handle to the
+    shared memory is pickled (torch registers the reduction of tensors for multiprocessing). Views and results of
+    computations on it are pickled as usual.
+    """
+
+    @classmethod
+    def from_tensor(cls, tensor, dtype, shape):
+        array = tensor.numpy().view(dtype).reshape(shape).view(cls)
+        array._shared_tensor = tensor
+        return array
+
+    @classmethod
+    def from_array(cls, array):
+        # share_memory_ copies the buffer into shared memory.
+        array = np.ascontiguousarray(array)
+        tensor = torch.from_numpy(array.reshape(-1).view(np.uint8)).share_memory_()
+        return cls.from_tensor(tensor, array.dtype, array.shape)
+
+    def __array_finalize__(self, obj):
+        self._shared_tensor = None
+
+    def __reduce__(self):
+        if self._shared_tensor is None:
+            return np.asarray(self).__reduce__()
+        return _rebuild_shared_array, (self._shared_tensor, self.dtype, self.shape)
+
+
+def _open_mapped_array(filename, dtype, mode, offset, shape, order):
+    return MappedArray.from_memmap(np.memmap(filename, dtype=dtype, mode=mode, offset=offset, shape=shape, order=order))
+
+
+class MappedArray(np.memmap):
+    """
+    A memory-mapped array which is pickled as a reference to its file: a worker maps the same file instead of
+    unpickling a copy of its content. Views and results of computations on it are pickled as usual.
+    """
+
+    @classmethod
+    def can_reopen(cls, array):
+        # only a map of a file which still exists, not a view into it. A copy-on-write map has private changes.
+        return (isinstance(array.base, mmap.mmap) and array.filename is not None and os.path.exists(array.filename)
+                and array.mode != 'c')
+
+    @classmethod
+    def from_memmap(cls, array):
+        assert cls.can_reopen(array)
+        output = array.view(cls)
+        output._is_reference = True
+        return output
+
+    def __array_finalize__(self, obj):
+        super().__array_finalize__(obj)
+        self._is_reference = False
+
+    def __reduce__(self):
+        if not self._is_reference:
+            return np.asarray(self).__reduce__()
+        # w+ would truncate the file.
+        mode = 'r+' if self.mode == 'w+' else self.mode
+        order = 'F' if self.flags.f_contiguous and not self.flags.c_contiguous else 'C'
+        return _open_mapped_array, (self.filename, self.dtype, mode, self.offset, self.shape, order)
+
+
+def _is_dataset(obj):
+    # the datasets of this repository keep their data in _data.
+    return isinstance(obj, Dataset) or hasattr(obj, '_data')
+
+
+def share_dataset_memory(dset):
+    """
+    Moves the numpy arrays of dset (and of the datasets it holds) into shared memory, in place. Memory-mapped arrays
+    whose file can be reopened become MappedArray instead. Others (e.g. maps of unlinked files) are moved into shared
+    memory.
+    Returns:
+        the number of bytes moved into shared memory.
+    """
+    nbytes = 0
+    for key, value in vars(dset).items():
+        if _is_dataset(value):
+            nbytes += share_dataset_memory(value)
+        elif isinstance(value, (list, tuple)) and len(value) > 0 and all(_is_dataset(v) for v in value):
+            nbytes += sum(share_dataset_memory(v) for v in value)
+        elif (isinstance(value, np.ndarray) and not isinstance(value, (MappedArray, SharedArray))
+              and value.nbytes >= MIN_SHARED_BYTES):
+            if isinstance(value, np.memmap) and MappedArray.can_reopen(value):
+                setattr(dset, key, MappedArray.from_memmap(value))
+                continue
+            setattr(dset, key, SharedArray.from_array(value))
+            nbytes += value.nbytes
+    return nbytes
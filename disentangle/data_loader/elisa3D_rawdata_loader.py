@@ -1,21 +1,24 @@
 import os
+from functools import partial
 
 import numpy as np
 
-import nd2
 from disentangle.core.data_split_type import DataSplitType, get_datasplit_tuples
-from nis2pyr.reader import read_nd2file
+from disentangle.data_loader.lazy_nd2 import get_nd2_sizes, read_nd2_subset
+from disentangle.data_loader.parallel_file_loader import get_file_loading_kwargs, load_files
 
 
-def load_7D(fpath):    
-    print(f'Loading from {fpath}')
-    with nd2.ND2File(fpath) as nd2file:
-        data = read_nd2file(nd2file)
-    return data
-
-def load_filtered_zstacks(fpath, zstart=20, zstop=44):
-    data = load_7D(fpath)
-    return data[0,:,zstart:zstop,...,0]
+def load_filtered_zstacks(fpath, zstart=20, zstop=44, positions=None, channels=None):
+    """
+    P*Z*C*H*W stacks between zstart and zstop. Only the given positions and channels (by default, all) are read.
+    """
+    selection = {'T': 0, 'Z': slice(zstart, zstop), 'S': 0}
+    if positions is not None:
+        selection['P'] = positions
+    if channels is not None:
+        selection['C'] = channels
+    data = read_nd2_subset(fpath, **selection)
+    return data[0,:,:,...,0]
 
 def datafiles():
     return ['20240725/WTC11_WT_DIV25_3_1_0001.nd2']
@@ -26,31 +29,33 @@ def get_train_val_data(datadir, data_config, datasplit_type: DataSplitType, val_
     zstop = data_config.zstop
     ch_list = data_config.channel_idx_list
     fpaths = [os.path.join(datadir, x) for x in fnames]
-    data_arr = [load_filtered_zstacks(fpath, zstart=zstart, zstop=zstop)[:,:,ch_list] for fpath in fpaths]
-    if len(data_arr) == 1:
-        data = data_arr[0]
-    else:
+    if len(fpaths) != 1:
         raise Exception("Multiple files not supported")
 
-    idx_list = np.random.RandomState(955).permutation(len(data))
-    train_idx, val_idx, test_idx = get_datasplit_tuples(val_fraction, test_fraction, len(data))
+    # the split is computed from the metadata, so that only the positions of the split are read.
+    num_positions = get_nd2_sizes(fpaths[0])['P']
+    idx_list = np.random.RandomState(955).permutation(num_positions)
+    train_idx, val_idx, test_idx = get_datasplit_tuples(val_fraction, test_fraction, num_positions)
     train_idx = idx_list[train_idx]
     val_idx = idx_list[val_idx]
     test_idx = idx_list[test_idx]
 
     if datasplit_type == DataSplitType.All:
-        data = data.astype(np.float32)
+        positions = None
     elif datasplit_type == DataSplitType.Train:
         print("train_idx", train_idx)
-        data = data[train_idx].astype(np.float32)
+        positions = train_idx
     elif datasplit_type == DataSplitType.Val:
         print("val_idx", val_idx)
-        data = data[val_idx].astype(np.float32)
+        positions = val_idx
     elif datasplit_type == DataSplitType.Test:
         print("test_idx", test_idx)
-        data = data[test_idx].astype(np.float32)
+        positions = test_idx
     else:
         raise Exception("invalid datasplit")
+
+    load_fn = partial(load_filtered_zstacks, zstart=zstart, zstop=zstop, positions=positions, channels=ch_list)
+    data = load_files(load_fn, fpaths, **get_file_loading_kwargs(data_config))[0].astype(np.float32)
     
     data = np.transpose(data, (0,1,3,4,2))
     return data
@@ -187,6 +187,34 @@ class GridIndexManager:
             return True
         return False
 
+    def on_boundary_arr(self, index_arr, grid_size=None):
+        """
+        Vectorized on_boundary. Returns a boolean array.
+        """
+        if self.use_default_grid(grid_size):
+            grid_size = self._default_grid_size
+
+        index_arr = np.asarray(index_arr, dtype=np.int64)
+        ncols = self.grid_cols(grid_size)
+        factor = index_arr // self.N
+        on_left = (factor // ncols) != (factor - 1) // ncols
+        on_right = (factor // ncols) != (factor + 1) // ncols
+        on_top = index_arr < self.N * ncols
+        on_bottom = index_arr + self.N * ncols > self.grid_count(grid_size=grid_size)
+        return on_left | on_right | on_top | on_bottom
+
+    def get_nbr_idx_arr(self, index_arr, grid_size=None):
+        """
+        Vectorized get_left_nbr_idx, get_right_nbr_idx, get_top_nbr_idx and get_bottom_nbr_idx for indices which are
+        not on the boundary. Returns an (N, 4) array with the left, right, top and bottom neighbors.
+        """
+        if self.use_default_grid(grid_size):
+            grid_size = self._default_grid_size
+
+        ncols = self.grid_cols(grid_size)
+        offsets = np.array([-self.N, self.N, -self.N * ncols, self.N * ncols], dtype=np.int64)
+        return np.asarray(index_arr, dtype=np.int64)[:, None] + offsets[None]
+
     def get_deterministic_hw(self, index: int, grid_size=None):
         """
         Fixed starting position for the crop for the img with index `index`.
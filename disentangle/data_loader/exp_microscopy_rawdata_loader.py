@@ -12,6 +12,7 @@ from disentangle.core.data_split_type import DataSplitType, get_datasplit_tuples
 from disentangle.core.data_type import DataType
 from disentangle.core.tiff_reader import load_tiff
 from disentangle.data_loader.multifile_raw_dloader import MultiChannelData, SubDsetType
+from disentangle.data_loader.parallel_file_loader import get_file_loading_kwargs, load_files
 
 
 def get_multi_channel_files_v1():
@@ -70,7 +71,7 @@ def get_train_val_data(datadir, data_config, datasplit_type: DataSplitType, val_
             fnames = fnames[-1:]
       
     fpaths = [os.path.join(datadir, fname) for fname in fnames]
-    data = [load_data(fpath) for fpath in fpaths]
+    data = load_files(load_data, fpaths, **get_file_loading_kwargs(data_config))
     if datasplit_type in [DataSplitType.Val, DataSplitType.Test] and data_config.data_type == DataType.ExpMicroscopyV2:
         assert len(data) == 1
         zN = data[0].shape[1]
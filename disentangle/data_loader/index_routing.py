@@ -0,0 +1,36 @@
+"""
+Routing of global indices of a concatenation of datasets (or arrays) to the individual datasets. The offsets of the
+datasets are cumulative lengths, computed once, and indices are routed with np.searchsorted.
+"""
+import numpy as np
+
+
+def get_offsets(lengths):
+    """
+    Start index of every dataset in the concatenation, followed by the total length.
+    """
+    return np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+
+
+def route_indices(offsets, indices):
+    """
+    Returns:
+        the dataset index and the index within that dataset, for every global index. Scalars for a scalar index.
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    if np.any((indices < 0) | (indices >= offsets[-1])):
+        raise IndexError('Index out of range')
+    dset_idx = np.searchsorted(offsets, indices, side='right') - 1
+    return dset_idx, indices - offsets[dset_idx]
+
+
+def group_indices(offsets, indices):
+    """
+    Groups a batch of global indices by dataset, so that every dataset is accessed once per batch.
+    Returns:
+        list of (dataset index, positions in indices, indices within the dataset), in the order of the datasets.
+    """
+    dset_idx, rel_idx = route_indices(offsets, np.asarray(indices).reshape(-1))
+    order = np.argsort(dset_idx, kind='stable')
+    unique_dset_idx, starts = np.unique(dset_idx[order], return_index=True)
+    return [(int(i), positions, rel_idx[positions]) for i, positions in zip(unique_dset_idx, np.split(order, starts[1:]))]
@@ -0,0 +1,60 @@
+"""
+Reading of a subset of the planes of an ND2 file. The file is opened as a dask array (one chunk per frame), the
+requested positions, channels, Z planes, etc. are selected on it and only the frames which they need are read. So the
+load time and the peak memory scale with the selected subset and not with the size of the file.
+The output has the axis layout of nis2pyr's read_nd2file, which the raw data loaders index into.
+"""
+import numpy as np
+
+import nd2
+
+ND2_AXES = 'TPZCYXS'
+
+
+def get_nd2_sizes(fpath):
+    """
+    Size of every axis of ND2_AXES (1 for the axes which the file does not have). Only the metadata is read.
+    """
+    with nd2.ND2File(fpath) as nd2file:
+        sizes = dict(nd2file.sizes)
+    return {axis: sizes.get(axis, 1) for axis in ND2_AXES}
+
+
+def _as_index(index):
+    # an integer keeps its axis, so that the layout is always ND2_AXES.
+    if isinstance(index, (int, np.integer)):
+        return [int(index)]
+    if isinstance(index, slice):
+        return index
+    return list(index)
+
+
+def read_nd2_subset(fpath, **selection):
+    """
+    Reads the selected planes of an ND2 file.
+    Args:
+        selection: axis (one of ND2_AXES) -> index, list of indices or slice. E.g. P=[0, 3], C=[1, 2], Z=slice(20, 44).
+            The other axes are read in full.
+    Returns:
+        array with the axes ND2_AXES.
+    """
+    for axis in selection:
+        assert axis in ND2_AXES, f'Invalid axis: {axis}'
+    print(f'Loading from {fpath} {selection}')
+    with nd2.ND2File(fpath) as nd2file:
+        file_axes = list(nd2file.sizes.keys())
+        data = nd2file.to_dask()
+        # one axis at a time: dask does not index several axes with lists at once.
+        for i, axis in enumerate(file_axes):
+            if axis in selection:
+                data = data[(slice(None), ) * i + (_as_index(selection[axis]), )]
+        data = data.compute()
+
+    missing_axes = [axis for axis in ND2_AXES if axis not in file_axes]
+    data = data.reshape(data.shape + (1, ) * len(missing_axes))
+    axes = file_axes + missing_axes
+    data = np.transpose(data, [axes.index(axis) for axis in ND2_AXES])
+    for axis in missing_axes:
+        if axis in selection:
+            data = np.take(data, np.arange(1)[_as_index(selection[axis])], axis=ND2_AXES.index(axis))
+    return data
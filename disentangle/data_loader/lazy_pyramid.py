@@ -0,0 +1,133 @@
+"""
+Low resolution versions of the data for the lateral context inputs, computed on demand for the windows which are
+needed instead of for the whole dataset.
+
+Level s is skimage.transform.resize of level s - 1 to half of its height and width, as done eagerly in
+LCMultiChDloader. With a factor of 2, resize is a gaussian filter (sigma 0.5, radius 2) followed by the average of
+2x2 blocks. So the rows [h0, h1) of level s only depend on the rows [2 * h0 - 2, 2 * h1 + 2) of level s - 1, and the
+same holds for the columns. Such a window (mirrored at the frame boundary, as ndimage does) is downsampled and the
+margin is dropped.
+The result is the same as resizing the whole frame, except that resize clips its output to the range of its input.
+The clipping only changes values which the gaussian filter pushed outside of that range by float32 rounding, so the
+values can differ by float32 rounding, which is at most 1 after the cast to integer data.
+
+Note that the context of a patch at level s covers 2**s times the patch size at level 0. Computing it per patch
+costs more than the eager pyramid (amortized) if many patches are drawn from every frame, in exchange for no startup
+time and no extra memory.
+"""
+import numpy as np
+from scipy import ndimage as ndi
+
+# rows/columns of level s - 1 on either side of a window, needed by the gaussian filter.
+MARGIN = 2
+
+
+def _halve(img):
+    """
+    skimage.transform.resize of (..., H, W, C) to (..., H // 2, W // 2, C) for even H and W, without the final
+    clipping to the input range: the gaussian anti-aliasing filter of resize (mode='reflect' of resize is 'mirror' of
+    ndimage), followed by the linear interpolation of ndi.zoom, which at the centers of 2x2 blocks is their average.
+    """
+    sigma = [0.0] * img.ndim
+    sigma[-3] = sigma[-2] = 0.5
+    filtered = ndi.gaussian_filter(img, sigma, mode='mirror').astype(np.float64)
+    output = filtered[..., 0::2, 0::2, :] + filtered[..., 0::2, 1::2, :]
+    output += filtered[..., 1::2, 0::2, :]
+    output += filtered[..., 1::2, 1::2, :]
+    return (output * 0.25).astype(img.dtype)
+
+
+class LazyPyramid:
+
+    def __init__(self, data, num_scales, cast_to_float32=True):
+        """
+        Args:
+            data: (N, ..., H, W, C) array, level 0 of the pyramid.
+            cast_to_float32: as for the data in LCMultiChDloader, every level is resized in float32 and cast back to the
+                dtype of data. Otherwise, the output of resize is kept (used for the noise).
+        """
+        self._data = data
+        self.num_scales = num_scales
+        self._cast_to_float32 = cast_to_float32
+        H, W = data.shape[-3:-1]
+        factor = 2**(num_scales - 1)
+        assert H % factor == 0 and W % factor == 0, f'Frame size {(H, W)} must be divisible by {factor}'
+
+    def shape(self, level):
+        shape = self._data.shape
+        return (*shape[:-3], shape[-3] // 2**level, shape[-2] // 2**level, shape[-1])
+
+    def get_window(self, level, frame_idx, h_range, w_range):
+        """
+        Returns the rows h_range[0]:h_range[1] and the columns w_range[0]:w_range[1] of frame frame_idx at level,
+        with shape (..., h, w, C). The ranges must lie inside the frame.
+        """
+        return self.get_windows(frame_idx, {level: (h_range, w_range)})[level]
+
+    def _input_range(self, level, h_range, w_range):
+        """
+        Rows and columns of level - 1 which are needed for the window of level, clipped to the frame.
+        """
+        prev_H, prev_W = self.shape(level - 1)[-3:-1]
+        (h0, h1), (w0, w1) = h_range, w_range
+        return (max(0, 2 * h0 - MARGIN), min(prev_H, 2 * h1 + MARGIN)), (max(0, 2 * w0 - MARGIN),
+                                                                         min(prev_W, 2 * w1 + MARGIN))
+
+    def get_windows(self, frame_idx, windows):
+        """
+        Several windows of one frame. windows maps level to (h_range, w_range). Every level is downsampled only once:
+        for a window which contains the windows of that level which are needed.
+        Returns:
+            dict mapping level to the window.
+        """
+        for level, (h_range, w_range) in windows.items():
+            H, W = self.shape(level)[-3:-1]
+            (h0, h1), (w0, w1) = h_range, w_range
+            assert 0 <= h0 < h1 <= H and 0 <= w0 < w1 <= W, f'Window {h_range},{w_range} is outside of {(H, W)}'
+
+        # from the highest level down, the bounding box of what is needed at every level.
+        needed = {}
+        for level in range(max(windows), -1, -1):
+            boxes = [windows[level]] if level in windows else []
+            if level + 1 in needed:
+                boxes.append(self._input_range(level + 1, *needed[level + 1]))
+            if len(boxes) > 0:
+                needed[level] = ((min(b[0][0] for b in boxes), max(b[0][1] for b in boxes)),
+                                 (min(b[1][0] for b in boxes), max(b[1][1] for b in boxes)))
+
+        (h0, h1), (w0, w1) = needed[0]
+        computed = self._data[frame_idx][..., h0:h1, w0:w1, :]
+        output = {}
+        for level in range(0, max(windows) + 1):
+            if level > 0:
+                computed = self._downsample(computed, needed[level - 1], level, needed[level])
+            if level in windows:
+                (h0, h1), (w0, w1) = windows[level]
+                (bh0, _), (bw0, _) = needed[level]
+                output[level] = computed[..., h0 - bh0:h1 - bh0, w0 - bw0:w1 - bw0, :]
+        return output
+
+    def _downsample(self, prev_window, prev_range, level, window_range):
+        """
+        prev_window holds the rows and columns prev_range of level - 1. Returns the window window_range of level.
+        """
+        (ph0, ph1), (pw0, pw1) = self._input_range(level, *window_range)
+        (bh0, _), (bw0, _) = prev_range
+        prev = prev_window[..., ph0 - bh0:ph1 - bh0, pw0 - bw0:pw1 - bw0, :]
+        if self._cast_to_float32:
+            dtype = prev.dtype
+            prev = prev.astype(np.float32)
+
+        # outside of the frame, the gaussian filter of resize mirrors the frame (mode='reflect' of np.pad).
+        (h0, h1), (w0, w1) = window_range
+        padding = [(0, 0)] * prev.ndim
+        padding[-3] = (ph0 - (2 * h0 - MARGIN), (2 * h1 + MARGIN) - ph1)
+        padding[-2] = (pw0 - (2 * w0 - MARGIN), (2 * w1 + MARGIN) - pw1)
+        prev = np.pad(prev, padding, mode='reflect')
+
+        output = _halve(prev)
+        m = MARGIN // 2
+        output = output[..., m:output.shape[-3] - m, m:output.shape[-2] - m, :]
+        if self._cast_to_float32:
+            output = output.astype(dtype)
+        return output
@@ -7,6 +7,7 @@ import numpy as np
 from skimage.transform import resize
 
 from disentangle.core.data_split_type import DataSplitType
+from disentangle.data_loader.lazy_pyramid import LazyPyramid
 from disentangle.data_loader.patch_index_manager import TilingMode
 from disentangle.data_loader.vanilla_dloader import MultiChDloader
 
@@ -65,14 +66,25 @@ class LCMultiChDloader(MultiChDloader):
                          print_vars=print_vars)
         self.num_scales = num_scales
         assert self.num_scales is not None
-        self._scaled_data = [self._data]
-        self._scaled_noise_data = [self._noise_data]
+        # if set, the low resolution inputs are computed on demand for the patches instead of for the whole dataset.
+        self._lazy_pyramid = data_config.get('lazy_lowres_pyramid', False)
 
         assert isinstance(self.num_scales, int) and self.num_scales >= 1
         self._lowres_supervision = lowres_supervision
         assert isinstance(self._padding_kwargs, dict)
         assert 'mode' in self._padding_kwargs
+        self._set_scaled_data()
+
+    def _set_scaled_data(self):
+        if self._lazy_pyramid:
+            self._scaled_data = LazyPyramid(self._data, self.num_scales)
+            self._scaled_noise_data = None
+            if self._noise_data is not None:
+                self._scaled_noise_data = LazyPyramid(self._noise_data, self.num_scales, cast_to_float32=False)
+            return
 
+        self._scaled_data = [self._data]
+        self._scaled_noise_data = [self._noise_data]
         for _ in range(1, self.num_scales):
             shape = self._scaled_data[-1].shape
             # assert len(shape) == 4
@@ -96,11 +108,17 @@ class LCMultiChDloader(MultiChDloader):
         assert w_end is None
 
         self._data = self._data[t_list].copy()
-        self._scaled_data = [self._scaled_data[i][t_list].copy() for i in range(len(self._scaled_data))]
-
         if self._noise_data is not None:
             self._noise_data = self._noise_data[t_list].copy()
-            self._scaled_noise_data = [self._scaled_noise_data[i][t_list].copy() for i in range(len(self._scaled_noise_data))]
+
+        if self._lazy_pyramid:
+            self._set_scaled_data()
+        else:
+            self._scaled_data = [self._scaled_data[i][t_list].copy() for i in range(len(self._scaled_data))]
+            if self._noise_data is not None:
+                self._scaled_noise_data = [
+                    self._scaled_noise_data[i][t_list].copy() for i in range(len(self._scaled_noise_data))
+                ]
 
         self.N = len(t_list)
         self.set_img_sz(self._img_sz, self._grid_sz)
@@ -124,9 +142,14 @@ class LCMultiChDloader(MultiChDloader):
         nidx = patch_loc_list[0]
 
         imgs = self._scaled_data[scaled_index][nidx]
-        imgs = tuple([imgs[None,..., i] for i in range(imgs.shape[-1])])
+        noisedata = None
         if self._noise_data is not None:
             noisedata = self._scaled_noise_data[scaled_index][nidx]
+        return self._split_scaled_img(imgs, noisedata)
+
+    def _split_scaled_img(self, imgs, noisedata):
+        imgs = tuple([imgs[None,..., i] for i in range(imgs.shape[-1])])
+        if noisedata is not None:
             noise = tuple([noisedata[None,..., i] for i in range(noisedata.shape[-1])])
             factor = np.sqrt(2) if self._input_is_sum else 1.0
             # since we are using this lowres images for just the input, we need to add the noise of the input.
@@ -134,6 +157,42 @@ class LCMultiChDloader(MultiChDloader):
             imgs = tuple([img + noise[0] * factor for img in imgs])
         return imgs
 
+    def _load_scaled_crops(self, index: Union[int, Tuple[int, int]], patch_start_locs):
+        """
+        Same as cropping the output of _load_scaled_img at patch_start_locs[scaled_index] for every scaled_index of
+        patch_start_locs, but only the part of the frame inside the patches is downsampled, in one pass over the
+        levels (see LazyPyramid.get_windows).
+        Returns:
+            dict mapping scaled_index to the crops of the channels.
+        """
+        if isinstance(index, int):
+            idx = index
+        else:
+            idx, _ = index
+        nidx = self.idx_manager.get_patch_location_from_dataset_idx(idx)[0]
+
+        windows = {}
+        for scaled_index, patch_start_loc in patch_start_locs.items():
+            H, W = self._scaled_data.shape(scaled_index)[-3:-1]
+            h_start, w_start = patch_start_loc[-2:]
+            h_range = (max(0, h_start), min(H, h_start + self._img_sz))
+            w_range = (max(0, w_start), min(W, w_start + self._img_sz))
+            windows[scaled_index] = (h_range, w_range)
+        imgs = self._scaled_data.get_windows(nidx, windows)
+        noisedata = None
+        if self._noise_data is not None:
+            noisedata = self._scaled_noise_data.get_windows(nidx, windows)
+
+        output = {}
+        for scaled_index, patch_start_loc in patch_start_locs.items():
+            scaled_imgs = self._split_scaled_img(imgs[scaled_index],
+                                                 None if noisedata is None else noisedata[scaled_index])
+            # the patch start relative to the window. The part outside of the frame is padded in _crop_img.
+            (h0, _), (w0, _) = windows[scaled_index]
+            window_start_loc = [*patch_start_loc[:-2], patch_start_loc[-2] - h0, patch_start_loc[-1] - w0]
+            output[scaled_index] = [self._crop_flip_img(img, window_start_loc, False, False) for img in scaled_imgs]
+        return output
+
     def _crop_img(self, img: np.ndarray, patch_start_loc:Tuple):
         """
         Here, h_start, w_start could be negative. That simply means we need to pick the content from 0. So,
@@ -164,18 +223,25 @@ class LCMultiChDloader(MultiChDloader):
         h_center = h_start + self._img_sz // 2
         w_center = w_start + self._img_sz // 2
         allres_versions = {i: [cropped_img_tuples[i]] for i in range(len(cropped_img_tuples))}
+        scaled_patch_start_locs = {}
         for scale_idx in range(1, self.num_scales):
-            scaled_img_tuples = self._load_scaled_img(scale_idx, index)
-
             h_center = h_center // 2
             w_center = w_center // 2
 
             h_start = h_center - self._img_sz // 2
             w_start = w_center - self._img_sz // 2
-            patch_start_loc[-2:] = [h_start, w_start]
-            scaled_cropped_img_tuples = [
-                self._crop_flip_img(img, patch_start_loc, False, False) for img in scaled_img_tuples
-            ]
+            scaled_patch_start_locs[scale_idx] = [*patch_start_loc[:-2], h_start, w_start]
+
+        if self._lazy_pyramid and len(scaled_patch_start_locs) > 0:
+            scaled_cropped_imgs = self._load_scaled_crops(index, scaled_patch_start_locs)
+        for scale_idx, scaled_patch_start_loc in scaled_patch_start_locs.items():
+            if self._lazy_pyramid:
+                scaled_cropped_img_tuples = scaled_cropped_imgs[scale_idx]
+            else:
+                scaled_img_tuples = self._load_scaled_img(scale_idx, index)
+                scaled_cropped_img_tuples = [
+                    self._crop_flip_img(img, scaled_patch_start_loc, False, False) for img in scaled_img_tuples
+                ]
             for ch_idx in range(len(img_tuples)):
                 allres_versions[ch_idx].append(scaled_cropped_img_tuples[ch_idx])
 
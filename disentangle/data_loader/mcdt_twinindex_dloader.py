@@ -15,9 +15,9 @@ class TwinIndexDloader(MultiChDloader):
         _, img2 = self._get_img(idx2)
 
         if self._enable_rotation:
-            rot_dic = self._rotation_transform(image=img1[0], mask=img2[0])
-            img1 = rot_dic['image'][None]
-            img2 = rot_dic['mask'][None]
+            (img1, img2), _ = self._rotate([img1[0], img2[0]], [])
+            img1 = img1[None]
+            img2 = img2[None]
         target = np.concatenate([img1, img2], axis=0)
         if self._normalized_input:
             img1, img2 = self.normalize_img(img1, img2)
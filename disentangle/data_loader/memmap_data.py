@@ -0,0 +1,96 @@
+"""
+On-disk (memory-mapped) storage of the loaded data. The raw data of a split is converted once into an .npy file in
+(N, H, W, C) order (or (N, Z, H, W, C)) and is memory-mapped afterwards. Only the pages of the patches which are read
+are loaded, and the DataLoader workers share them through the OS page cache.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from disentangle.data_loader.train_val_data import get_train_val_data
+
+# data config entries which only say where things are cached or how the data is loaded. They do not change the data.
+NON_DATA_KEYS = [
+    'memmap_dir', 'preprocessing_cache_dir', 'empty_patch_cache_dir', 'lazy_lowres_pyramid', 'load_num_workers',
+    'load_backend', 'load_memory_budget_gb'
+]
+
+
+def get_cache_key(data_config, fpath, datasplit_type, val_fraction, test_fraction, **extra_keys):
+    """
+    Hash of everything which determines the output of get_train_val_data. extra_keys are added to the hash as well.
+    """
+    config_dict = data_config.to_dict() if hasattr(data_config, 'to_dict') else dict(data_config)
+    config_dict = {k: v for k, v in config_dict.items() if k not in NON_DATA_KEYS}
+    key = json.dumps(
+        {
+            'data_config': config_dict,
+            'fpath': fpath,
+            'datasplit_type': datasplit_type,
+            'val_fraction': val_fraction,
+            'test_fraction': test_fraction,
+            **extra_keys,
+        },
+        sort_keys=True,
+        default=str)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def save_memmap(fpath, data):
+    """
+    Writes data as an .npy file. It is first written to a temporary file which is then renamed so that a concurrent
+    reader never sees a partially written file.
+    """
+    dirname = os.path.dirname(fpath)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp_fpath = tempfile.mkstemp(suffix='.npy', dir=dirname)
+    os.close(fd)
+    output = np.lib.format.open_memmap(tmp_fpath, mode='w+', dtype=data.dtype, shape=data.shape)
+    for idx in range(len(data)):
+        output[idx] = data[idx]
+    output.flush()
+    del output
+    os.replace(tmp_fpath, fpath)
+
+
+def get_memmap_train_val_data(memmap_dir, data_config, fpath, datasplit_type, val_fraction=None, test_fraction=None,
+                              allow_generation=None):
+    """
+    Same as get_train_val_data, but the returned array is a read-only memmap. The data is loaded with
+    get_train_val_data and written to memmap_dir only the first time.
+    """
+    key = get_cache_key(data_config, fpath, datasplit_type, val_fraction, test_fraction)
+    memmap_fpath = os.path.join(memmap_dir, f'data_{key}.npy')
+    if not os.path.exists(memmap_fpath):
+        data = get_train_val_data(data_config,
+                                  fpath,
+                                  datasplit_type,
+                                  val_fraction=val_fraction,
+                                  test_fraction=test_fraction,
+                                  allow_generation=allow_generation)
+        assert isinstance(data, np.ndarray), f'Only a single array can be memory-mapped, got {type(data)}'
+        save_memmap(memmap_fpath, data)
+        del data
+        print(f'[memmap_data] Saved {memmap_fpath}')
+
+    return np.load(memmap_fpath, mmap_mode='r')
+
+
+def create_working_copy(data, memmap_dir, dtype=None, keep_file=False):
+    """
+    Returns a writable copy of data, stored in a temporary .npy memmap in memmap_dir and filled one frame at a time. The
+    file is unlinked right away: the mapping stays valid for this process and its forked workers, and the disk space is
+    released when the last of them exits. With keep_file, the file is kept (at output.filename) instead.
+    """
+    os.makedirs(memmap_dir, exist_ok=True)
+    fd, fpath = tempfile.mkstemp(suffix='.npy', dir=memmap_dir)
+    os.close(fd)
+    output = np.lib.format.open_memmap(fpath, mode='w+', dtype=data.dtype if dtype is None else dtype, shape=data.shape)
+    if not keep_file:
+        os.remove(fpath)
+    for idx in range(len(data)):
+        output[idx] = data[idx]
+    return output
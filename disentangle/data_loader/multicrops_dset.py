@@ -1,20 +1,16 @@
 """
 Here, we have multiple folders, each containing images of a single channel. 
 """
-from collections import defaultdict
 from functools import cache
 
-import albumentations as A
 import numpy as np
 
+from disentangle.core.chunked_stats import combine_moments
 from disentangle.core.data_split_type import DataSplitType
+from disentangle.data_loader.d4_augmentation import D4Augmentation, apply_d4
 from disentangle.data_loader.train_val_data import get_train_val_data
 
 
-def l2(x):
-    return np.sqrt(np.mean(np.array(x)**2))
-
-
 class MultiCropDset:
     def __init__(self,
                  data_config,
@@ -47,46 +43,93 @@ class MultiCropDset:
                 final_data_arr.append([x - self._background_values[ch_idx] for x in data_float])
             self._data_arr = final_data_arr
 
-        self._rotation_transform = None
+        self._d4_augmentation = None
         if self._enable_rotation:
-            self._rotation_transform = A.Compose([A.Flip(), A.RandomRotate90()])
+            self._d4_augmentation = D4Augmentation()
         
         print(f'{self.__class__.__name__} N:{len(self)} Rot:{self._enable_rotation} Ch:{len(self._data_arr)} MaxVal:{self.max_val} Bg:{self._background_values}')
 
 
-    def compute_mean_std(self):
-        mean_tar_dict = defaultdict(list)
-        std_tar_dict = defaultdict(list)
-        mean_inp = []
-        std_inp = []
-        for _ in range(30000):
-            crops = []
-            for ch_idx in range(len(self._data_arr)):
-                crop = self.sample_crop(ch_idx)
-                mean_tar_dict[ch_idx].append(np.mean(crop))
-                std_tar_dict[ch_idx].append(np.std(crop))
-                crops.append(crop)
-
+    def _valid_imgs(self, ch_idx):
+        """
+        Images of the channel which are large enough for a crop, see sample_crop.
+        """
+        return [x for x in self._data_arr[ch_idx] if x.shape[0] >= self._img_sz and x.shape[1] >= self._img_sz]
+
+    def channel_moments(self, ch_idx):
+        """
+        (count, mean, sum of squared deviations) of the pixels of the images from which the crops of the channel are
+        sampled. The moments of every image are merged into the running moments one image at a time (Chan et al.).
+        Images are picked with a probability proportional to their area, so pooling their pixels is area weighted.
+        """
+        moments = (0, 0.0, 0.0)
+        for img in self._valid_imgs(ch_idx):
+            values = img.reshape(-1).astype(np.float64)
+            mean = values.mean()
+            moments = combine_moments(*moments, values.size, mean, np.sum((values - mean)**2))
+        assert moments[0] > 0, f'No image of channel {ch_idx} is large enough for a crop'
+        return moments
+
+    def _sample_crops(self, ch_idx, num_crops, rng):
+        """
+        Vectorized sample_crop: num_crops random crops of the channel, gathered image by image.
+        """
+        imgs = self._valid_imgs(ch_idx)
+        sizes = np.array([x.size for x in imgs])
+        img_idx = rng.choice(len(imgs), size=num_crops, p=sizes / sizes.sum())
+        crops = np.empty((num_crops, self._img_sz, self._img_sz), dtype=np.float64)
+        for idx in np.unique(img_idx):
+            mask = img_idx == idx
+            img = imgs[idx]
+            h = rng.randint(0, max(1, img.shape[0] - self._img_sz), size=mask.sum())
+            w = rng.randint(0, max(1, img.shape[1] - self._img_sz), size=mask.sum())
+            crops[mask] = np.lib.stride_tricks.sliding_window_view(img, (self._img_sz, self._img_sz))[h, w]
+        return crops
+
+    def _sampled_moments(self, num_crops, rng, batch_size=1024):
+        """
+        Monte-Carlo estimate of the moments of the pixels of the crops of every channel and of their sum (the input).
+        """
+        NC = len(self._data_arr)
+        tar_moments = [(0, 0.0, 0.0)] * NC
+        inp_moments = (0, 0.0, 0.0)
+        for start in range(0, num_crops, batch_size):
+            n = min(batch_size, num_crops - start)
             inp = 0
-            for img in crops:
-                inp += img
-
-            mean_inp.append(np.mean(inp))
-            std_inp.append(np.std(inp))
-
-        output_mean = defaultdict(list)
-        output_std = defaultdict(list)
+            for ch_idx in range(NC):
+                crops = self._sample_crops(ch_idx, n, rng)
+                tar_moments[ch_idx] = combine_moments(*tar_moments[ch_idx], crops.size, crops.mean(),
+                                                      np.sum((crops - crops.mean())**2))
+                inp = inp + crops
+            inp_moments = combine_moments(*inp_moments, inp.size, inp.mean(), np.sum((inp - inp.mean())**2))
+        return tar_moments, inp_moments
+
+    def compute_mean_std(self, num_crops=None, seed=None):
+        """
+        Mean and std of the pixels of the crops of every channel (target) and of their sum (input).
+        By default, they are exact: the target moments are those of channel_moments. The crops of the channels are
+        sampled independently, so the mean and the variance of the input are the sums of those of the channels.
+        Args:
+            num_crops: if given, the moments are instead estimated from this many random crops of every channel.
+            seed: seed of the random crops.
+        """
         NC = len(self._data_arr)
-        for ch_idx in range(NC):
-            output_mean['target'].append(np.mean(mean_tar_dict[ch_idx]))
-            output_std['target'].append(l2(std_tar_dict[ch_idx]))
-        
-        output_mean['target'] = np.array(output_mean['target']).reshape(-1,NC,1,1)
-        output_std['target'] = np.array(output_std['target']).reshape(-1,NC,1,1)
-
-        output_mean['input'] = np.array([np.mean(mean_inp)]).reshape(-1,1,1,1)
-        output_std['input'] = np.array([l2(std_inp)]).reshape(-1,1,1,1)
-        return dict(output_mean), dict(output_std)
+        if num_crops is None:
+            tar_moments = [self.channel_moments(ch_idx) for ch_idx in range(NC)]
+            inp_mean = sum(mean for _, mean, _ in tar_moments)
+            inp_var = sum(m2 / count for count, _, m2 in tar_moments)
+        else:
+            rng = np.random.RandomState(seed)
+            tar_moments, (inp_count, inp_mean, inp_m2) = self._sampled_moments(num_crops, rng)
+            inp_var = inp_m2 / inp_count
+
+        output_mean = {}
+        output_std = {}
+        output_mean['target'] = np.array([mean for _, mean, _ in tar_moments]).reshape(-1, NC, 1, 1)
+        output_std['target'] = np.sqrt([m2 / count for count, _, m2 in tar_moments]).reshape(-1, NC, 1, 1)
+        output_mean['input'] = np.array([inp_mean]).reshape(-1, 1, 1, 1)
+        output_std['input'] = np.array([np.sqrt(inp_var)]).reshape(-1, 1, 1, 1)
+        return output_mean, output_std
 
     def set_mean_std(self, mean_dict, std_dict):
         self._data_mean = mean_dict
@@ -133,21 +176,9 @@ class MultiCropDset:
         return self._rotate2D(img_tuples)
 
     def _rotate2D(self, img_tuples):
-        img_kwargs = {}
-        for i,img in enumerate(img_tuples):
-            img_kwargs[f'img{i}'] = img
-        
-        
-        keys = list(img_kwargs.keys())
-        self._rotation_transform.add_targets({k: 'image' for k in keys})
-        rot_dic = self._rotation_transform(image=img_tuples[0], **img_kwargs)
-
-        rotated_img_tuples = []
-        for i,img in enumerate(img_tuples):
-            rotated_img_tuples.append(rot_dic[f'img{i}'])
-
-        
-        return rotated_img_tuples
+        # the same flip/rot90 for all channels.
+        params = self._d4_augmentation.sample_params(1)
+        return list(apply_d4(np.stack(img_tuples)[None], *params)[0])
 
     def _compute_input(self, imgs):
         inp = 0
@@ -1,7 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
 from disentangle.core.data_split_type import DataSplitType
+from disentangle.data_loader.index_routing import get_offsets, group_indices, route_indices
 from disentangle.data_loader.lc_multich_dloader import LCMultiChDloader
+from disentangle.data_loader.parallel_file_loader import get_file_loading_kwargs
 from disentangle.data_loader.patch_index_manager import TilingMode
 from disentangle.data_loader.train_val_data import get_train_val_data
 from disentangle.data_loader.vanilla_dloader import MultiChDloader
@@ -54,6 +58,10 @@ class SingleFileLCDset(LCMultiChDloader):
     def rm_bkground_set_max_val_and_upperclip_data(self, max_val, datasplit_type):
         pass
 
+    def _get_preprocessing_cache(self, data_config, datasplit_type, val_fraction, test_fraction, max_val):
+        # the data is preloaded by MultiFileDset.
+        return None
+
     def load_data(self, data_config, datasplit_type, val_fraction=None, test_fraction=None, allow_generation=None):
         self._data = self._preloaded_data
         assert 'channel_1' not in data_config or isinstance(data_config.channel_1, str)
@@ -98,6 +106,10 @@ class SingleFileDset(MultiChDloader):
     def rm_bkground_set_max_val_and_upperclip_data(self, max_val, datasplit_type):
         pass
 
+    def _get_preprocessing_cache(self, data_config, datasplit_type, val_fraction, test_fraction, max_val):
+        # the data is preloaded by MultiFileDset.
+        return None
+
     @property
     def data_path(self):
         return self._fpath
@@ -137,50 +149,54 @@ class MultiFileDset:
                                   datasplit_type,
                                   val_fraction=val_fraction,
                                   test_fraction=test_fraction)
-        self.dsets = []
 
-        for i in range(len(data)):
+        def build_dset(i):
             prefetched_data, fpath_tuple = data[i]
             if data_config.multiscale_lowres_count is not None and data_config.multiscale_lowres_count > 1:
-
-                self.dsets.append(
-                    SingleFileLCDset(prefetched_data[None],
-                                     data_config,
-                                     fpath_tuple,
-                                     datasplit_type=datasplit_type,
-                                     val_fraction=val_fraction,
-                                     test_fraction=test_fraction,
-                                     normalized_input=normalized_input,
-                                     enable_rotation_aug=enable_rotation_aug,
-                                     enable_random_cropping=enable_random_cropping,
-                                     use_one_mu_std=use_one_mu_std,
-                                     allow_generation=False,
-                                     num_scales=data_config.multiscale_lowres_count,
-                                     max_val=max_val,
-                                     tiling_mode=tiling_mode,
-                                     padding_kwargs=padding_kwargs,
-                                     overlapping_padding_kwargs=overlapping_padding_kwargs,
-                                     print_vars=i == len(data) - 1))
-
-            else:
-                self.dsets.append(
-                    SingleFileDset(prefetched_data[None],
-                                   data_config,
-                                   fpath_tuple,
-                                   datasplit_type=datasplit_type,
-                                   val_fraction=val_fraction,
-                                   test_fraction=test_fraction,
-                                   normalized_input=normalized_input,
-                                   enable_rotation_aug=enable_rotation_aug,
-                                   enable_random_cropping=enable_random_cropping,
-                                   use_one_mu_std=use_one_mu_std,
-                                   allow_generation=False,
-                                   max_val=max_val,
-                                   tiling_mode=tiling_mode,
-                                   overlapping_padding_kwargs=overlapping_padding_kwargs,
-                                   print_vars=i == len(data) - 1))
+                return SingleFileLCDset(prefetched_data[None],
+                                        data_config,
+                                        fpath_tuple,
+                                        datasplit_type=datasplit_type,
+                                        val_fraction=val_fraction,
+                                        test_fraction=test_fraction,
+                                        normalized_input=normalized_input,
+                                        enable_rotation_aug=enable_rotation_aug,
+                                        enable_random_cropping=enable_random_cropping,
+                                        use_one_mu_std=use_one_mu_std,
+                                        allow_generation=False,
+                                        num_scales=data_config.multiscale_lowres_count,
+                                        max_val=max_val,
+                                        tiling_mode=tiling_mode,
+                                        padding_kwargs=padding_kwargs,
+                                        overlapping_padding_kwargs=overlapping_padding_kwargs,
+                                        print_vars=i == len(data) - 1)
+
+            return SingleFileDset(prefetched_data[None],
+                                  data_config,
+                                  fpath_tuple,
+                                  datasplit_type=datasplit_type,
+                                  val_fraction=val_fraction,
+                                  test_fraction=test_fraction,
+                                  normalized_input=normalized_input,
+                                  enable_rotation_aug=enable_rotation_aug,
+                                  enable_random_cropping=enable_random_cropping,
+                                  use_one_mu_std=use_one_mu_std,
+                                  allow_generation=False,
+                                  max_val=max_val,
+                                  tiling_mode=tiling_mode,
+                                  overlapping_padding_kwargs=overlapping_padding_kwargs,
+                                  print_vars=i == len(data) - 1)
+
+        # the per-file datasets are built in threads, since the data is already in memory. Noise which is added while
+        # building them comes from the global NumPy RNG, so then they are built one after another to stay reproducible.
+        num_workers = get_file_loading_kwargs(data_config)['num_workers']
+        if self._has_random_preprocessing(data_config):
+            num_workers = 1
+        with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+            self.dsets = list(executor.map(build_dset, range(len(data))))
 
         self.rm_bkground_set_max_val_and_upperclip_data(max_val, datasplit_type)
+        self._update_offsets()
         count = 0
         avg_height = 0
         avg_width = 0
@@ -194,6 +210,10 @@ class MultiFileDset:
         avg_width = int(avg_width / len(self.dsets))
         print(f'{self.__class__.__name__} avg height: {avg_height}, avg width: {avg_width}, count: {count}')
 
+    @staticmethod
+    def _has_random_preprocessing(data_config):
+        return data_config.get('poisson_noise_factor', -1) > 0 or data_config.get('enable_gaussian_noise', False)
+
     def rm_bkground_set_max_val_and_upperclip_data(self, max_val, datasplit_type):
         assert self._background_quantile == 0.0
         self.set_max_val(max_val, datasplit_type)
@@ -232,6 +252,7 @@ class MultiFileDset:
     def set_img_sz(self, image_size, grid_size):
         for dset in self.dsets:
             dset.set_img_sz(image_size, grid_size)
+        self._update_offsets()
 
     def compute_mean_std(self):
         cur_mean = {'target': 0, 'input': 0}
@@ -268,20 +289,45 @@ class MultiFileDset:
         assert w_start is None
         assert w_end is None
         self.dsets = [self.dsets[t] for t in t_list]
+        self._update_offsets()
         print(f'[{self.__class__.__name__}] Data reduced. New data count: {len(self.dsets)}')
 
+    def _update_offsets(self):
+        """
+        Caches the global index at which every file starts. The lengths of the files change with set_img_sz.
+        """
+        self._offsets = get_offsets([len(dset) for dset in self.dsets])
+
+    def get_dset_idx(self, idx):
+        """
+        Returns the file index and the index within that file of the global index (or array of indices) idx.
+        """
+        return route_indices(self._offsets, idx)
+
+    def group_indices_by_dset(self, indices):
+        """
+        Returns:
+            list of (file index, positions in indices, indices within the file), one entry per file in the batch.
+        """
+        return group_indices(self._offsets, indices)
+
     def __len__(self):
-        out = 0
-        for dset in self.dsets:
-            out += len(dset)
-        return out
+        return int(self._offsets[-1])
 
     def __getitem__(self, idx):
-        cum_len = 0
-        for dset in self.dsets:
-            cum_len += len(dset)
-            if idx < cum_len:
-                rel_idx = idx - (cum_len - len(dset))
-                return dset[rel_idx]
-
-        raise IndexError('Index out of range')
+        dset_idx, rel_idx = self.get_dset_idx(idx)
+        return self.dsets[int(dset_idx)][int(rel_idx)]
+
+    def __getitems__(self, indices):
+        """
+        Used by torch DataLoader to fetch a whole batch. Every file fetches its part of the batch at once, in batched form
+        when the file dataset supports it.
+        """
+        if not all(isinstance(idx, (int, np.integer)) for idx in indices):
+            return [self[idx] for idx in indices]
+
+        samples = [None] * len(indices)
+        for dset_idx, positions, rel_idx in self.group_indices_by_dset(indices):
+            for pos, sample in zip(positions, self.dsets[dset_idx].__getitems__(rel_idx.tolist())):
+                samples[pos] = sample
+        return samples
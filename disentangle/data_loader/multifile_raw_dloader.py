@@ -9,6 +9,18 @@ import numpy as np
 from disentangle.core.custom_enum import Enum
 from disentangle.core.data_split_type import DataSplitType, get_datasplit_tuples
 from disentangle.core.tiff_reader import load_tiff
+from disentangle.data_loader.index_routing import get_offsets, group_indices, route_indices
+from disentangle.data_loader.parallel_file_loader import get_file_loading_kwargs, load_files
+
+
+def _get_items(data, offsets, indices, get_paths):
+    items = [None] * len(indices)
+    for dataidx, positions, rel_idx in group_indices(offsets, indices):
+        frames = data[dataidx][rel_idx]
+        paths = get_paths(dataidx)
+        for pos, frame in zip(positions, frames):
+            items[pos] = (frame, paths)
+    return items
 
 
 class TwoChannelData(Sequence):
@@ -27,23 +39,25 @@ class TwoChannelData(Sequence):
             assert len(
                 data_arr1[i].shape) == 3, f'Each element in data arrays should be a N*H*W, but {data_arr1[i].shape}'
             self._data.append(np.concatenate([data_arr1[i][..., None], data_arr2[i][..., None]], axis=-1))
+        self._offsets = get_offsets([x.shape[0] for x in self._data])
 
     def __len__(self):
-        n = 0
-        for x in self._data:
-            n += x.shape[0]
-        return n
+        return int(self._offsets[-1])
+
+    def _get_paths(self, dataidx):
+        if self.paths1 is None:
+            return None
+        return (self.paths1[dataidx], self.paths2[dataidx])
 
     def __getitem__(self, idx):
-        n = 0
-        for dataidx, x in enumerate(self._data):
-            if idx < n + x.shape[0]:
-                if self.paths1 is None:
-                    return x[idx - n], None
-                else:
-                    return x[idx - n], (self.paths1[dataidx], self.paths2[dataidx])
-            n += x.shape[0]
-        raise IndexError('Index out of range')
+        dataidx, rel_idx = route_indices(self._offsets, idx)
+        return self._data[dataidx][rel_idx], self._get_paths(dataidx)
+
+    def get_items(self, indices):
+        """
+        Batched __getitem__: the frames of every array are gathered with a single indexing operation.
+        """
+        return _get_items(self._data, self._offsets, indices, self._get_paths)
 
 
 class MultiChannelData(Sequence):
@@ -55,23 +69,23 @@ class MultiChannelData(Sequence):
         self.paths = paths
 
         self._data = data_arr
+        self._offsets = get_offsets([x.shape[0] for x in self._data])
 
     def __len__(self):
-        n = 0
-        for x in self._data:
-            n += x.shape[0]
-        return n
+        return int(self._offsets[-1])
+
+    def _get_paths(self, dataidx):
+        return None if self.paths is None else self.paths[dataidx]
 
     def __getitem__(self, idx):
-        n = 0
-        for dataidx, x in enumerate(self._data):
-            if idx < n + x.shape[0]:
-                if self.paths is None:
-                    return x[idx - n], None
-                else:
-                    return x[idx - n], (self.paths[dataidx])
-            n += x.shape[0]
-        raise IndexError('Index out of range')
+        dataidx, rel_idx = route_indices(self._offsets, idx)
+        return self._data[dataidx][rel_idx], self._get_paths(dataidx)
+
+    def get_items(self, indices):
+        """
+        Batched __getitem__: the frames of every array are gathered with a single indexing operation.
+        """
+        return _get_items(self._data, self._offsets, indices, self._get_paths)
 
 
 class SubDsetType(Enum):
@@ -114,25 +128,28 @@ def get_train_val_data(datadir,
     dset_subtype = data_config.subdset_type
     if load_data_fn is None:
         load_data_fn = load_tiff
+    loading_kwargs = get_file_loading_kwargs(data_config)
 
     if dset_subtype == SubDsetType.TwoChannel:
         fnamesA, fnamesB = get_multi_channel_files_fn()
         fpathsA = [os.path.join(datadir, x) for x in fnamesA]
         fpathsB = [os.path.join(datadir, x) for x in fnamesB]
-        dataA = [load_data_fn(fpath) for fpath in fpathsA]
-        dataB = [load_data_fn(fpath) for fpath in fpathsB]
+        # A and B in one pool.
+        dataAB = load_files(load_data_fn, fpathsA + fpathsB, **loading_kwargs)
+        dataA = dataAB[:len(fpathsA)]
+        dataB = dataAB[len(fpathsA):]
     elif dset_subtype == SubDsetType.OneChannel:
         fnamesmixed = get_multi_channel_files_fn()
         fpathsmixed = [os.path.join(datadir, x) for x in fnamesmixed]
         fpathsA = fpathsB = fpathsmixed
-        dataA = [load_data_fn(fpath) for fpath in fpathsmixed]
+        dataA = load_files(load_data_fn, fpathsmixed, **loading_kwargs)
         # Note that this is important. We need to ensure that the sum of the two channels is the same as sum of these two channels.
         dataA = [x / 2 for x in dataA]
         dataB = [x.copy() for x in dataA]
     elif dset_subtype == SubDsetType.MultiChannel:
         fnamesA = get_multi_channel_files_fn()
         fpathsA = [os.path.join(datadir, x) for x in fnamesA]
-        dataA = [load_data_fn(fpath) for fpath in fpathsA]
+        dataA = load_files(load_data_fn, fpathsA, **loading_kwargs)
         fnamesB = None
         fpathsB = None
         dataB = None
@@ -1,11 +1,13 @@
 import os
+from functools import partial
 
 import numpy as np
 
-import nd2
 from disentangle.core.custom_enum import Enum
 from disentangle.core.data_split_type import DataSplitType, get_datasplit_tuples
-from nis2pyr.reader import read_nd2file
+from disentangle.data_loader.index_routing import get_offsets, group_indices
+from disentangle.data_loader.lazy_nd2 import get_nd2_sizes, read_nd2_subset
+from disentangle.data_loader.parallel_file_loader import get_file_loading_kwargs, load_files
 
 
 class NikolaChannelList(Enum):
@@ -70,62 +72,94 @@ def get_raw_files_dict():
     return files_dict
 
 
-def load_7D(fpath):    
-    print(f'Loading from {fpath}')
-    with nd2.ND2File(fpath) as nd2file:
-        # Stdout: ND2 dimensions: {'P': 20, 'C': 19, 'Y': 1608, 'X': 1608}; RGB: False; datatype: uint16; legacy: False
-        data = read_nd2file(nd2file)
-    return data
+# positions which are left out of every file with this name prefix.
+BAD_POSITIONS = {
+    'uSplit_20022025_001': [2],
+    'uSplit_14022025': [17, 19],
+}
+
 
-def load_one_fpath(fpath, channel_list):
-    data = load_7D(fpath)    
-    # data.shape: (1, 20, 1, 19, 1608, 1608, 1) 
+def get_valid_positions(fpath):
+    """
+    Positions of the file which are used. Only the metadata is read.
+    """
+    # ND2 dimensions: {'P': 20, 'C': 19, 'Y': 1608, 'X': 1608}
+    num_positions = get_nd2_sizes(fpath)['P']
+    fname_prefix = '_'.join(os.path.basename(fpath).split('.')[0].split('_')[:-1])
+    bad_positions = BAD_POSITIONS.get(fname_prefix, [])
+    return [p for p in range(num_positions) if p not in bad_positions]
+
+def load_one_fpath(fpath, channel_list, positions=None):
+    """
+    Reads the channels of channel_list at the given positions (by default, all valid positions).
+    """
+    if positions is None:
+        positions = get_valid_positions(fpath)
+    data = read_nd2_subset(fpath, T=0, Z=0, S=0, P=positions, C=channel_list)
+    # data.shape: (1, P, 1, C, 1608, 1608, 1)
     data = data[0, :, 0, :, :, :, 0]
-    # data.shape: (20, 19, 1608, 1608)
-    # Here, 20 are different locations and 19 are different channels.
-    data = data[:, channel_list,...]
     # swap the second and fourth axis
     data = np.swapaxes(data[...,None], 1, 4)[:,0]
-    
-    fname_prefix = '_'.join(os.path.basename(fpath).split('.')[0].split('_')[:-1])
-    if fname_prefix == 'uSplit_20022025_001':
-        data = np.delete(data, 2, axis=0)
-    elif fname_prefix == 'uSplit_14022025':
-        data = np.delete(data, [17, 19], axis=0)
-
-    # data.shape: (20, 1608, 1608, C)
+    # data.shape: (P, 1608, 1608, C)
     return data
 
-def load_data(datadir, dset_type, channel_list):
-    files_dict = get_raw_files_dict()[dset_type]
-    data_list = []
-    for fname in files_dict:
-        fpath = os.path.join(datadir, fname)
-        data = load_one_fpath(fpath, channel_list)
-        data_list.append(data)
+def _load_selected_positions(fpath, channel_list, positions_dict):
+    return load_one_fpath(fpath, channel_list, positions=positions_dict[fpath])
+
+def get_fpaths(datadir, dset_type):
+    return [os.path.join(datadir, fname) for fname in get_raw_files_dict()[dset_type]]
+
+def load_data(datadir, dset_type, channel_list, loading_kwargs=None, frame_idx=None):
+    """
+    Args:
+        loading_kwargs: keyword arguments of load_files (see parallel_file_loader.py).
+        frame_idx: indices of the frames to load, in the concatenation of the valid positions of all files. Only these
+            positions are read. By default, all frames.
+    """
+    fpaths = get_fpaths(datadir, dset_type)
+    valid_positions = [get_valid_positions(fpath) for fpath in fpaths]
+    if frame_idx is None:
+        frame_idx = np.arange(sum(len(x) for x in valid_positions))
+    frame_idx = np.asarray(frame_idx, dtype=np.int64)
+
+    # the frames are read sorted, file by file, and reordered at the end.
+    sorted_idx = np.unique(frame_idx)
+    offsets = get_offsets([len(x) for x in valid_positions])
+    positions_dict = {}
+    for file_idx, _, rel_idx in group_indices(offsets, sorted_idx):
+        positions_dict[fpaths[file_idx]] = [valid_positions[file_idx][i] for i in rel_idx]
+    if len(positions_dict) == 0:
+        # an empty split: no frames of the first file.
+        positions_dict[fpaths[0]] = []
+    load_fn = partial(_load_selected_positions, channel_list=channel_list, positions_dict=positions_dict)
+    data_list = load_files(load_fn, list(positions_dict.keys()), **(loading_kwargs or {}))
     if len(data_list) > 1:
         data = np.concatenate(data_list, axis=0)
     else:
         data = data_list[0]
+
+    if not np.array_equal(sorted_idx, frame_idx):
+        data = data[np.searchsorted(sorted_idx, frame_idx)]
     return data
 
 def get_train_val_data(datadir, data_config, datasplit_type: DataSplitType, val_fraction=None, test_fraction=None):
     dset_type = data_config.dset_type
-    data = load_data(datadir, dset_type, data_config.channel_idx_list)
-    train_idx, val_idx, test_idx = get_datasplit_tuples(val_fraction, test_fraction, len(data))
+    # the split is computed from the metadata, so that only the frames of the split are read.
+    count = sum(len(get_valid_positions(fpath)) for fpath in get_fpaths(datadir, dset_type))
+    train_idx, val_idx, test_idx = get_datasplit_tuples(val_fraction, test_fraction, count)
     if datasplit_type == DataSplitType.All:
-        data = data.astype(np.float32)
+        frame_idx = None
     elif datasplit_type == DataSplitType.Train:
-        data = data[train_idx].astype(np.float32)
+        frame_idx = train_idx
     elif datasplit_type == DataSplitType.Val:
-        data = data[val_idx].astype(np.float32)
+        frame_idx = val_idx
     elif datasplit_type == DataSplitType.Test:
-        data = data[test_idx].astype(np.float32)
+        frame_idx = test_idx
     else:
         raise Exception("invalid datasplit")
 
-    return data
-
+    data = load_data(datadir, dset_type, data_config.channel_idx_list, get_file_loading_kwargs(data_config), frame_idx)
+    return data.astype(np.float32)
 
 if __name__ == '__main__':
     import matplotlib.pyplot as plt
@@ -0,0 +1,125 @@
+"""
+Concurrent decoding of the files of the raw data loaders. The files are decoded in a bounded thread or process pool
+and returned in the order of the file paths, whatever the order in which they finish. The data config controls it:
+    load_num_workers: size of the pool. 0 or 1 decodes the files one after another in the main process.
+    load_backend: FileLoadingBackend.Thread or FileLoadingBackend.Process.
+    load_memory_budget_gb: upper bound on the decoded size of the files which are being decoded at the same time. The
+        decoded size of a file is estimated from its size on disk, times the largest ratio of decoded to on-disk size
+        seen so far. Until the first file is decoded, that ratio is unknown, so only one file is decoded. A file which
+        alone exceeds the budget is decoded on its own.
+"""
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import numpy as np
+
+from disentangle.core.file_loading_backend import FileLoadingBackend
+
+FILE_LOADING_DEFAULTS = {
+    'load_num_workers': 4,
+    'load_backend': FileLoadingBackend.Thread,
+    'load_memory_budget_gb': None,
+}
+
+
+def get_file_loading_kwargs(data_config):
+    """
+    Keyword arguments of load_files for the data config (FILE_LOADING_DEFAULTS for the missing entries).
+    """
+    return {
+        'num_workers': data_config.get('load_num_workers', FILE_LOADING_DEFAULTS['load_num_workers']),
+        'backend': data_config.get('load_backend', FILE_LOADING_DEFAULTS['load_backend']),
+        'memory_budget_gb': data_config.get('load_memory_budget_gb', FILE_LOADING_DEFAULTS['load_memory_budget_gb']),
+    }
+
+
+def _get_nbytes(data):
+    if isinstance(data, np.ndarray):
+        return data.nbytes
+    if isinstance(data, (list, tuple)):
+        return sum(_get_nbytes(x) for x in data)
+    if isinstance(data, dict):
+        return sum(_get_nbytes(x) for x in data.values())
+    return 0
+
+
+def _get_file_size(fpath):
+    return os.path.getsize(fpath) if isinstance(fpath, str) and os.path.isfile(fpath) else 0
+
+
+def _timed_load(load_fn, fpath):
+    start = time.perf_counter()
+    data = load_fn(fpath)
+    return data, time.perf_counter() - start
+
+
+def _get_executor(backend, num_workers):
+    assert FileLoadingBackend.contains(backend), f'Invalid backend: {backend}'
+    if backend == FileLoadingBackend.Thread:
+        return ThreadPoolExecutor(max_workers=num_workers)
+    # spawn instead of fork: forking a process which already uses torch threads can deadlock.
+    return ProcessPoolExecutor(max_workers=num_workers, mp_context=mp.get_context('spawn'))
+
+
+def load_files(load_fn, fpaths, num_workers=0, backend=FileLoadingBackend.Thread, memory_budget_gb=None,
+               return_timings=False):
+    """
+    [load_fn(fpath) for fpath in fpaths], with up to num_workers files decoded at the same time.
+    Args:
+        load_fn: decodes one file. With the process backend, it must be picklable (a module level function or a
+            functools.partial of one).
+        memory_budget_gb: see the module docstring. None for no limit.
+        return_timings: if True, the per-file timings (dicts with fpath, seconds and nbytes) are returned as well.
+    """
+    fpaths = list(fpaths)
+    num_workers = min(num_workers, len(fpaths))
+    budget = None if memory_budget_gb is None else memory_budget_gb * 1e9
+    file_sizes = [_get_file_size(fpath) for fpath in fpaths]
+    output = [None] * len(fpaths)
+    timings = [None] * len(fpaths)
+    start = time.perf_counter()
+
+    def on_loaded(idx, data, seconds):
+        output[idx] = data
+        timings[idx] = {'fpath': fpaths[idx], 'seconds': seconds, 'nbytes': _get_nbytes(data)}
+        print(f'[load_files] {idx + 1}/{len(fpaths)} {fpaths[idx]}: {timings[idx]["nbytes"] / 1e9:.2f}GB '
+              f'in {seconds:.1f}s')
+
+    if num_workers <= 1:
+        for idx, fpath in enumerate(fpaths):
+            on_loaded(idx, *_timed_load(load_fn, fpath))
+    else:
+        expansion = 1.0
+        expansion_known = False
+        next_idx = 0
+        running = {}
+        in_flight = 0
+        with _get_executor(backend, num_workers) as executor:
+            while next_idx < len(fpaths) or running:
+                # files are submitted in order, so that the first files are available first.
+                while next_idx < len(fpaths) and len(running) < num_workers:
+                    estimate = file_sizes[next_idx] * expansion
+                    if running and budget is not None and (not expansion_known or in_flight + estimate > budget):
+                        break
+                    future = executor.submit(_timed_load, load_fn, fpaths[next_idx])
+                    running[future] = (next_idx, estimate)
+                    in_flight += estimate
+                    next_idx += 1
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    idx, estimate = running.pop(future)
+                    in_flight -= estimate
+                    on_loaded(idx, *future.result())
+                    expansion_known = True
+                    if file_sizes[idx] > 0:
+                        expansion = max(expansion, timings[idx]['nbytes'] / file_sizes[idx])
+
+    total_bytes = sum(t['nbytes'] for t in timings)
+    print(f'[load_files] {len(fpaths)} files, {total_bytes / 1e9:.2f}GB in {time.perf_counter() - start:.1f}s '
+          f'workers:{max(num_workers, 1)} backend:{backend if num_workers > 1 else "sequential"}')
+    if return_timings:
+        return output, timings
+    return output
@@ -28,16 +28,30 @@ class GridIndexManager:
             if pad % 2 != 0:
                 raise ValueError(f"Patch shape:{self.patch_shape} must have even padding in dimension {dim}")
 
+        # per-dimension grid counts and strides are fixed for a given shape. They are cached here so that the
+        # per-index lookups done in every __getitem__ do not recompute them.
+        self._dim_grid_counts = np.array([self._compute_individual_dim_grid_count(dim) for dim in range(len(self.data_shape))],
+                                         dtype=np.int64)
+        self._grid_counts = np.ones(len(self.data_shape), dtype=np.int64)
+        for dim in range(len(self.data_shape) - 2, -1, -1):
+            self._grid_counts[dim] = self._grid_counts[dim + 1] * self._dim_grid_counts[dim + 1]
+        self._patch_offset = (np.array(self.patch_shape) - np.array(self.grid_shape)) // 2
+        # python ints for the scalar lookups.
+        self._dim_grid_count_tuple = tuple(int(x) for x in self._dim_grid_counts)
+        self._grid_count_tuple = tuple(int(x) for x in self._grid_counts)
+
     def patch_offset(self):
-        return (np.array(self.patch_shape) - np.array(self.grid_shape))//2
-    
+        return self._patch_offset.copy()
+
     def get_individual_dim_grid_count(self, dim:int):
         """
         Returns the number of the grid in the specified dimension, ignoring all other dimensions.
         """
         assert dim < len(self.data_shape), f"Dimension {dim} is out of bounds for data shape {self.data_shape}"
         assert dim >= 0, "Dimension must be greater than or equal to 0"
+        return self._dim_grid_count_tuple[dim]
 
+    def _compute_individual_dim_grid_count(self, dim:int):
         if self.grid_shape[dim]==1 and self.patch_shape[dim]==1:
             return self.data_shape[dim]
         elif self.tiling_mode == TilingMode.PadBoundary:
@@ -53,7 +67,7 @@ class GridIndexManager:
         """
         Returns the total number of grids in the dataset.
         """
-        return self.grid_count(0) * self.get_individual_dim_grid_count(0)
+        return self._grid_count_tuple[0] * self._dim_grid_count_tuple[0]
     
     def grid_count(self, dim:int):
         """
@@ -61,10 +75,7 @@ class GridIndexManager:
         """
         assert dim < len(self.data_shape), f"Dimension {dim} is out of bounds for data shape {self.data_shape}"
         assert dim >= 0, "Dimension must be greater than or equal to 0"
-        if dim == len(self.data_shape)-1:
-            return 1
-        
-        return self.get_individual_dim_grid_count(dim+1) * self.grid_count(dim+1)
+        return self._grid_count_tuple[dim]
     
     def get_grid_index(self, dim:int, coordinate:int):
         """
@@ -100,7 +111,7 @@ class GridIndexManager:
         assert len(grid_idx) == len(self.data_shape), f"Dimension indices {grid_idx} must have the same dimension as data shape {self.data_shape}"
         index = 0
         for dim in range(len(grid_idx)):
-            index += grid_idx[dim] * self.grid_count(dim)
+            index += grid_idx[dim] * self._grid_count_tuple[dim]
         return index
     
     def get_patch_location_from_dataset_idx(self, dataset_idx:int):
@@ -148,8 +159,8 @@ class GridIndexManager:
         """
         grid_idx = []
         for dim in range(len(self.data_shape)):
-            grid_idx.append(dataset_idx // self.grid_count(dim))
-            dataset_idx = dataset_idx % self.grid_count(dim)
+            grid_idx.append(dataset_idx // self._grid_count_tuple[dim])
+            dataset_idx = dataset_idx % self._grid_count_tuple[dim]
         location = [self.get_gridstart_location_from_dim_index(dim, grid_idx[dim]) for dim in range(len(self.data_shape))]
         return tuple(location)
     
@@ -161,14 +172,107 @@ class GridIndexManager:
         assert dim >= 0, "Dimension must be greater than or equal to 0"
         
         if dim > 0:
-            dataset_idx = dataset_idx % self.grid_count(dim-1)
+            dataset_idx = dataset_idx % self._grid_count_tuple[dim-1]
 
-        dim_index = dataset_idx // self.grid_count(dim)
+        dim_index = dataset_idx // self._grid_count_tuple[dim]
         if only_end:
-            return dim_index == self.get_individual_dim_grid_count(dim) - 1
+            return dim_index == self._dim_grid_count_tuple[dim] - 1
         
-        return dim_index == 0 or dim_index == self.get_individual_dim_grid_count(dim) - 1
+        return dim_index == 0 or dim_index == self._dim_grid_count_tuple[dim] - 1
     
+    # Bulk versions of the lookups above. They take arrays of indices (or (N, ndim) arrays of locations) and resolve all
+    # of them in a few NumPy calls.
+
+    def get_grid_index_arr(self, dim:int, coordinate_arr):
+        """
+        Vectorized get_grid_index. Returns an integer array of grid indices in the specified dimension.
+        """
+        coordinate_arr = np.asarray(coordinate_arr, dtype=np.int64)
+        if self.grid_shape[dim]==1 and self.patch_shape[dim]==1:
+            return coordinate_arr
+        elif self.tiling_mode == TilingMode.PadBoundary:
+            return coordinate_arr // self.grid_shape[dim]
+        elif self.tiling_mode == TilingMode.TrimBoundary:
+            excess_size = (self.patch_shape[dim] - self.grid_shape[dim])//2
+            return np.maximum(0, (coordinate_arr - excess_size) // self.grid_shape[dim])
+        elif self.tiling_mode == TilingMode.ShiftBoundary:
+            excess_size = (self.patch_shape[dim] - self.grid_shape[dim])//2
+            return np.where(coordinate_arr + self.grid_shape[dim] + excess_size == self.data_shape[dim],
+                            self._dim_grid_counts[dim] - 1,
+                            np.maximum(0, (coordinate_arr - excess_size) // self.grid_shape[dim]))
+        else:
+            raise ValueError(f"Unsupported tiling mode {self.tiling_mode}")
+
+    def get_gridstart_location_from_dim_index_arr(self, dim:int, dim_index_arr):
+        """
+        Vectorized get_gridstart_location_from_dim_index.
+        """
+        dim_index_arr = np.asarray(dim_index_arr, dtype=np.int64)
+        if self.grid_shape[dim]==1 and self.patch_shape[dim]==1:
+            return dim_index_arr
+        elif self.tiling_mode == TilingMode.PadBoundary:
+            return dim_index_arr * self.grid_shape[dim]
+        elif self.tiling_mode == TilingMode.TrimBoundary:
+            excess_size = (self.patch_shape[dim] - self.grid_shape[dim])//2
+            return dim_index_arr * self.grid_shape[dim] + excess_size
+        elif self.tiling_mode == TilingMode.ShiftBoundary:
+            excess_size = (self.patch_shape[dim] - self.grid_shape[dim])//2
+            # on boundary. grid should be placed such that the patch covers the entire data.
+            return np.where(dim_index_arr < self._dim_grid_counts[dim] - 1,
+                            dim_index_arr * self.grid_shape[dim] + excess_size,
+                            self.data_shape[dim] - self.grid_shape[dim] - excess_size)
+        else:
+            raise ValueError(f"Unsupported tiling mode {self.tiling_mode}")
+
+    def get_grid_idx_from_dataset_idx_arr(self, dataset_idx_arr):
+        """
+        Returns an (N, ndim) array with the grid index in every dimension.
+        """
+        dataset_idx_arr = np.asarray(dataset_idx_arr, dtype=np.int64)
+        return (dataset_idx_arr[:, None] // self._grid_counts[None]) % self._dim_grid_counts[None]
+
+    def get_location_from_dataset_idx_arr(self, dataset_idx_arr):
+        """
+        Returns an (N, ndim) array with the start location of the grid for every dataset index.
+        """
+        grid_idx = self.get_grid_idx_from_dataset_idx_arr(dataset_idx_arr)
+        location = np.empty_like(grid_idx)
+        for dim in range(len(self.data_shape)):
+            location[:, dim] = self.get_gridstart_location_from_dim_index_arr(dim, grid_idx[:, dim])
+        return location
+
+    def get_patch_location_from_dataset_idx_arr(self, dataset_idx_arr):
+        """
+        Returns an (N, ndim) array with the start location of the patch for every dataset index.
+        """
+        return self.get_location_from_dataset_idx_arr(dataset_idx_arr) - self._patch_offset[None]
+
+    def dataset_idx_from_grid_idx_arr(self, grid_idx_arr):
+        """
+        Returns the dataset indices for an (N, ndim) array of grid indices.
+        """
+        grid_idx_arr = np.asarray(grid_idx_arr, dtype=np.int64)
+        return grid_idx_arr @ self._grid_counts
+
+    def get_dataset_idx_from_grid_location_arr(self, location_arr):
+        """
+        Returns the dataset indices for an (N, ndim) array of grid locations.
+        """
+        location_arr = np.asarray(location_arr, dtype=np.int64)
+        assert location_arr.shape[1] == len(self.data_shape), f"Locations must have the same dimension as data shape {self.data_shape}"
+        grid_idx = np.stack([self.get_grid_index_arr(dim, location_arr[:, dim]) for dim in range(len(self.data_shape))],
+                            axis=1)
+        return self.dataset_idx_from_grid_idx_arr(grid_idx)
+
+    def on_boundary_arr(self, dataset_idx_arr, dim:int, only_end:bool=False):
+        """
+        Vectorized on_boundary. Returns a boolean array.
+        """
+        dim_index = (np.asarray(dataset_idx_arr, dtype=np.int64) // self._grid_counts[dim]) % self._dim_grid_counts[dim]
+        if only_end:
+            return dim_index == self._dim_grid_counts[dim] - 1
+        return (dim_index == 0) | (dim_index == self._dim_grid_counts[dim] - 1)
+
     def next_grid_along_dim(self, dataset_idx:int, dim:int):
         """
         Returns the index of the grid in the specified dimension in the specified direction.
@@ -0,0 +1,83 @@
+"""
+Content-addressed cache of preprocessed data. An entry is identified by a hash of the data config, the data directory,
+the split and whatever else determines the preprocessing (see get_cache_key). It holds
+    <key>_data.npy: the preprocessed array, which is memory-mapped when loaded.
+    <key>_stats.pkl: named values, for example max_val, background values and mean/std.
+"""
+import mmap
+import os
+import pickle
+import tempfile
+
+import numpy as np
+
+from disentangle.data_loader.memmap_data import create_working_copy, get_cache_key, save_memmap
+
+
+class PreprocessingCache:
+
+    def __init__(self, cache_dir: str, key: str):
+        self._cache_dir = cache_dir
+        self._key = key
+        self._working_fpath = None
+
+    @classmethod
+    def from_config(cls, cache_dir, data_config, fpath, datasplit_type, val_fraction, test_fraction, **extra_keys):
+        key = get_cache_key(data_config, fpath, datasplit_type, val_fraction, test_fraction, **extra_keys)
+        return cls(cache_dir, key)
+
+    def data_fpath(self):
+        return os.path.join(self._cache_dir, f'{self._key}_data.npy')
+
+    def stats_fpath(self):
+        return os.path.join(self._cache_dir, f'{self._key}_stats.pkl')
+
+    def has_data(self):
+        return os.path.exists(self.data_fpath())
+
+    def load_data(self):
+        return np.load(self.data_fpath(), mmap_mode='r')
+
+    def create_working_copy(self, data, dtype=None):
+        """
+        A writable copy of data in a temporary file of the cache directory (see memmap_data.create_working_copy). When
+        it is preprocessed in place and passed to save_data, that file becomes the entry, without another copy.
+        """
+        output = create_working_copy(data, self._cache_dir, dtype=dtype, keep_file=True)
+        self._working_fpath = os.path.abspath(output.filename)
+        return output
+
+    def _is_working_copy(self, data):
+        # the whole mapped file, not a view into it.
+        return (isinstance(data, np.memmap) and isinstance(data.base, mmap.mmap) and self._working_fpath is not None
+                and os.path.abspath(data.filename) == self._working_fpath)
+
+    def save_data(self, data):
+        if self._is_working_copy(data):
+            data.flush()
+            os.replace(self._working_fpath, self.data_fpath())
+            self._working_fpath = None
+        else:
+            save_memmap(self.data_fpath(), data)
+        print(f'[{self.__class__.__name__}] Saved {self.data_fpath()}')
+
+    def _load_stats(self):
+        if not os.path.exists(self.stats_fpath()):
+            return {}
+        with open(self.stats_fpath(), 'rb') as f:
+            return pickle.load(f)
+
+    def get(self, name, default=None):
+        return self._load_stats().get(name, default)
+
+    def __contains__(self, name):
+        return name in self._load_stats()
+
+    def set(self, **values):
+        stats = self._load_stats()
+        stats.update(values)
+        os.makedirs(self._cache_dir, exist_ok=True)
+        fd, tmp_fpath = tempfile.mkstemp(suffix='.pkl', dir=self._cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(stats, f)
+        os.replace(tmp_fpath, self.stats_fpath())
@@ -46,10 +46,7 @@ class SingleChannelDloader(MultiChDloader):
     def __getitem__(self, index: Union[int, Tuple[int, int]]) -> Tuple[np.ndarray, np.ndarray]:
         inp, target = self._get_img(index)
         if self._enable_rotation:
-            # passing just the 2D input. 3rd dimension messes up things.
-            rot_dic = self._rotation_transform(image=img1[0], mask=img2[0])
-            img1 = rot_dic['image'][None]
-            img2 = rot_dic['mask'][None]
+            (inp, target), _ = self._rotate([inp, target], [])
 
         inp = self.normalize_input(inp)
         if isinstance(index, int):
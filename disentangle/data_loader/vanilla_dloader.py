@@ -1,11 +1,15 @@
 from typing import Tuple, Union
 
-import albumentations as A
 import numpy as np
 
+from disentangle.core.chunked_stats import (channel_moments, get_tail_quantiles, iter_frame_chunks,
+                                            merge_channel_moments, update_tail_quantiles, upperclip_)
 from disentangle.core.data_split_type import DataSplitType
 from disentangle.core.empty_patch_fetcher import EmptyPatchFetcher
+from disentangle.data_loader.d4_augmentation import D4Augmentation, apply_d4
+from disentangle.data_loader.memmap_data import create_working_copy, get_cache_key, get_memmap_train_val_data
 from disentangle.data_loader.patch_index_manager import GridIndexManager, TilingMode
+from disentangle.data_loader.preprocessing_cache import PreprocessingCache
 from disentangle.data_loader.target_index_switcher import IndexSwitcher
 from disentangle.data_loader.train_val_data import get_train_val_data
 
@@ -36,6 +40,8 @@ class MultiChDloader:
         """
         self._fpath = fpath
         self._data  = self._noise_data = None
+        # (data, channel_moments of data) of the last upper clipping, see _get_channel_moments.
+        self._clipped_moments = None
         self.Z = 1
         self._5Ddata = False
         self._tiling_mode = tiling_mode
@@ -44,6 +50,8 @@ class MultiChDloader:
         self._poisson_noise_factor = None
         self._train_index_switcher = None
         self._depth3D = data_config.get('depth3D',1)
+        # if set, the data is kept in memory-mapped .npy files in this directory instead of in RAM.
+        self._memmap_dir = data_config.get('memmap_dir', None)
         self._mode_3D = data_config.get('mode_3D', False)
 
         # NOTE: Input is the sum of the different channels. It is not the average of the different channels.
@@ -68,6 +76,9 @@ class MultiChDloader:
         else:
             self._datausage_fraction = 1.0
 
+        self._preprocessing_cache = self._get_preprocessing_cache(data_config, datasplit_type, val_fraction,
+                                                                  test_fraction, max_val)
+        self._preprocessing_cache_hit = False
         self.load_data(data_config,
                        datasplit_type,
                        val_fraction=val_fraction,
@@ -124,11 +135,20 @@ class MultiChDloader:
             self._empty_patch_replacement_channel_idx = data_config.empty_patch_replacement_channel_idx
             self._empty_patch_replacement_probab = data_config.empty_patch_replacement_probab
             data_frames = self._data[..., self._empty_patch_replacement_channel_idx]
+            empty_patch_cache_key = get_cache_key(data_config,
+                                                  self._fpath,
+                                                  datasplit_type,
+                                                  val_fraction,
+                                                  test_fraction,
+                                                  dloader=self.__class__.__name__,
+                                                  channel_idx=self._empty_patch_replacement_channel_idx)
             # NOTE: This is on the raw data. So, it must be called before removing the background.
             self._empty_patch_fetcher = EmptyPatchFetcher(self.idx_manager,
                                                           self._img_sz,
                                                           data_frames,
-                                                          max_val_threshold=data_config.empty_patch_max_val_threshold)
+                                                          max_val_threshold=data_config.empty_patch_max_val_threshold,
+                                                          cache_dir=data_config.get('empty_patch_cache_dir', None),
+                                                          cache_key=empty_patch_cache_key)
 
         self.rm_bkground_set_max_val_and_upperclip_data(max_val, datasplit_type)
 
@@ -151,9 +171,10 @@ class MultiChDloader:
         # assert self._enable_random_cropping is True or self._uncorrelated_channels is False
         # Randomly rotate [-90,90]
 
-        self._rotation_transform = None
+        self._d4_augmentation = None
         if self._enable_rotation:
-            self._rotation_transform = A.Compose([A.Flip(), A.RandomRotate90()])
+            # the Z flip only applies to 3D data.
+            self._d4_augmentation = D4Augmentation(flip_z=self._flipz_3D and self._5Ddata)
 
         if print_vars:
             msg = self._init_msg()
@@ -169,18 +190,54 @@ class MultiChDloader:
     def get_data_shape(self):
         return self._data.shape
 
+    def _get_preprocessing_cache(self, data_config, datasplit_type, val_fraction, test_fraction, max_val):
+        """
+        If data_config.preprocessing_cache_dir is set, the preprocessed data, max_val, background values and mean/std are
+        cached there and reused by later runs with the same data config, data directory and split. It defaults to
+        data_config.memmap_dir, so that the working copy of the memory-mapped data is made only once. The cache is not
+        used when the preprocessing is random (poisson noise) or needs the raw data (empty patch replacement).
+        """
+        cache_dir = data_config.get('preprocessing_cache_dir', None) or self._memmap_dir
+        if cache_dir is None:
+            return None
+        if data_config.get('poisson_noise_factor', -1) > 0 or data_config.get('empty_patch_replacement_enabled', False):
+            print(f'[{self.__class__.__name__}] Preprocessing cache is disabled with poisson noise and empty patch replacement')
+            return None
+        return PreprocessingCache.from_config(cache_dir,
+                                              data_config,
+                                              self._fpath,
+                                              datasplit_type,
+                                              val_fraction,
+                                              test_fraction,
+                                              dloader=self.__class__.__name__,
+                                              max_val=max_val)
+
     def load_data(self, data_config, datasplit_type, val_fraction=None, test_fraction=None, allow_generation=None):
-        self._data = get_train_val_data(data_config,
-                                        self._fpath,
-                                        datasplit_type,
-                                        val_fraction=val_fraction,
-                                        test_fraction=test_fraction,
-                                        allow_generation=allow_generation)
+        if self._preprocessing_cache is not None and self._preprocessing_cache.has_data():
+            self._data = self._preprocessing_cache.load_data()
+            self._preprocessing_cache_hit = True
+            print(f'[{self.__class__.__name__}] Loaded preprocessed data from {self._preprocessing_cache.data_fpath()}')
+        elif self._memmap_dir is not None:
+            self._data = get_memmap_train_val_data(self._memmap_dir,
+                                                   data_config,
+                                                   self._fpath,
+                                                   datasplit_type,
+                                                   val_fraction=val_fraction,
+                                                   test_fraction=test_fraction,
+                                                   allow_generation=allow_generation)
+        else:
+            self._data = get_train_val_data(data_config,
+                                            self._fpath,
+                                            datasplit_type,
+                                            val_fraction=val_fraction,
+                                            test_fraction=test_fraction,
+                                            allow_generation=allow_generation)
         self._loaded_data_preprocessing(data_config)
 
     def _loaded_data_preprocessing(self, data_config):
         old_shape = self._data.shape
-        if self._datausage_fraction < 1.0:
+        # the cached data has already been reduced.
+        if self._datausage_fraction < 1.0 and not self._preprocessing_cache_hit:
             framepixelcount = np.prod(self._data.shape[1:3])
             pixelcount = int(len(self._data) * framepixelcount * self._datausage_fraction)
             frame_count = int(np.ceil(pixelcount / framepixelcount))
@@ -229,55 +286,108 @@ class MultiChDloader:
     def get_background(self, channel_idx, frame_idx):
         return self._background_values[frame_idx, channel_idx]
 
-    def remove_background(self):
-
+    def remove_background(self, max_val_quantiles=None):
+        """
+        Subtracts the per frame, per channel background quantile. If max_val_quantiles (see get_tail_quantiles) are
+        given, the data after the subtraction is added to them in the same sweep.
+        """
         self._background_values = np.zeros((self._data.shape[0], self._data.shape[-1]))
 
         if self._background_quantile == 0.0:
             assert self._clip_background_noise_to_zero is False, 'This operation currently happens later in this function.'
+            if max_val_quantiles is not None:
+                for sl in iter_frame_chunks(self._data):
+                    update_tail_quantiles(max_val_quantiles, self._data[sl])
             return
 
         if self._data.dtype in [np.uint16]:
             # unsigned integer creates havoc
             self._data = self._data.astype(np.int32)
 
-        for ch in range(self._data.shape[-1]):
-            for idx in range(self._data.shape[0]):
-                qval = np.quantile(self._data[idx, ..., ch], self._background_quantile)
-                assert np.abs(
-                    qval
-                ) > 20, "We are truncating the qval to an integer which will only make sense if it is large enough"
-                # NOTE: Here, there can be an issue if you work with normalized data
-                qval = int(qval)
-                self.save_background(ch, idx, qval)
-                self._data[idx, ..., ch] -= qval
-
-        if self._clip_background_noise_to_zero:
-            self._data[self._data < 0] = 0
+        bkg_shape = (-1, ) + (1, ) * (self._data.ndim - 2) + (self._data.shape[-1], )
+        for sl in iter_frame_chunks(self._data):
+            chunk = self._data[sl]
+            qvals = np.quantile(chunk.reshape(len(chunk), -1, chunk.shape[-1]), self._background_quantile, axis=1)
+            assert np.all(
+                np.abs(qvals) > 20), "We are truncating the qval to an integer which will only make sense if it is large enough"
+            # NOTE: Here, there can be an issue if you work with normalized data
+            qvals = qvals.astype(np.int64)
+            self._background_values[sl] = qvals
+            chunk -= qvals.astype(self._data.dtype).reshape(bkg_shape)
+            if self._clip_background_noise_to_zero:
+                np.maximum(chunk, 0, out=chunk)
+            if max_val_quantiles is not None:
+                update_tail_quantiles(max_val_quantiles, chunk)
 
     def rm_bkground_set_max_val_and_upperclip_data(self, max_val, datasplit_type):
-        self.remove_background()
+        """
+        Background removal and the quantiles for max_val share one sweep over the data, the upper clipping and the
+        moments for compute_mean_std a second one.
+        """
+        if self._preprocessing_cache_hit:
+            self._background_values = self._preprocessing_cache.get('background_values')
+            self.max_val = self._preprocessing_cache.get('max_val')
+            return
+
+        if self._memmap_dir is not None and not self._data.flags.writeable:
+            # the loaded memmap is read-only and shared by all runs. Background removal and clipping happen in place on
+            # a disk-backed working copy.
+            dtype = self._data.dtype
+            if self._background_quantile > 0.0 and dtype in [np.uint16]:
+                # see remove_background
+                dtype = np.int32
+            if self._preprocessing_cache is not None:
+                # the working copy becomes the cache entry, which later runs load instead of copying the data again.
+                self._data = self._preprocessing_cache.create_working_copy(self._data, dtype=dtype)
+            else:
+                self._data = create_working_copy(self._data, self._memmap_dir, dtype=dtype)
+
+        max_val_quantiles = None
+        if max_val is None:
+            assert datasplit_type == DataSplitType.Train
+            max_val_quantiles = self._get_max_val_quantiles()
+        self.remove_background(max_val_quantiles)
+        if max_val_quantiles is not None:
+            max_val = self._max_val_from_quantiles(max_val_quantiles)
         self.set_max_val(max_val, datasplit_type)
         self.upperclip_data()
 
+        if self._preprocessing_cache is not None:
+            if not self._preprocessing_cache.has_data():
+                self._preprocessing_cache.save_data(self._data)
+            self._preprocessing_cache.set(background_values=self._background_values, max_val=self.max_val)
+            moments = self._get_channel_moments()
+            self._data = self._preprocessing_cache.load_data()
+            self._clipped_moments = (self._data, moments)
+
     def upperclip_data(self):
         if isinstance(self.max_val, list):
-            chN = self._data.shape[-1]
-            assert chN == len(self.max_val)
-            for ch in range(chN):
-                ch_data = self._data[..., ch]
-                ch_q = self.max_val[ch]
-                ch_data[ch_data > ch_q] = ch_q
-                self._data[..., ch] = ch_data
-        else:
-            self._data[self._data > self.max_val] = self.max_val
+            assert self._data.shape[-1] == len(self.max_val)
+        moments = upperclip_(self._data, self.max_val, return_moments=True)
+        self._clipped_moments = (self._data, moments)
 
-    def compute_max_val(self):
+    def _get_channel_moments(self):
+        """
+        channel_moments of the data. They are computed while clipping, so they are only recomputed if the data has been
+        replaced since (e.g. by reduce_data).
+        """
+        if self._clipped_moments is not None and self._clipped_moments[0] is self._data:
+            return self._clipped_moments[1]
+        return channel_moments(self._data)
+
+    def _get_max_val_quantiles(self):
+        return get_tail_quantiles(self._data, self._quantile, self._channelwise_quantile)
+
+    def _max_val_from_quantiles(self, quantiles):
         if self._channelwise_quantile:
-            max_val_arr = [np.quantile(self._data[..., i], self._quantile) for i in range(self._data.shape[-1])]
-            return max_val_arr
-        else:
-            return np.quantile(self._data, self._quantile)
+            return [quantile.get() for quantile in quantiles]
+        return quantiles[0].get()
+
+    def compute_max_val(self):
+        quantiles = self._get_max_val_quantiles()
+        for sl in iter_frame_chunks(self._data):
+            update_tail_quantiles(quantiles, self._data[sl])
+        return self._max_val_from_quantiles(quantiles)
 
     def set_max_val(self, max_val, datasplit_type):
 
@@ -588,28 +698,29 @@ class MultiChDloader:
 
     def compute_individual_mean_std(self):
         # numpy 1.19.2 has issues in computing for large arrays. https://github.com/numpy/numpy/issues/8869
-        # mean = np.mean(self._data, axis=(0, 1, 2))
-        # std = np.std(self._data, axis=(0, 1, 2))
-        mean_arr = []
-        std_arr = []
-        for ch_idx in range(self._data.shape[-1]):
-            mean_ = 0.0 if self._skip_normalization_using_mean else self._data[..., ch_idx].mean()
-            if self._noise_data is not None:
-                std_ = (self._data[..., ch_idx] + self._noise_data[..., ch_idx + 1]).std()
-            else:
-                std_ = self._data[..., ch_idx].std()
-
-            mean_arr.append(mean_)
-            std_arr.append(std_)
+        # The moments are therefore accumulated over chunks of frames, for all channels in one sweep.
+        mean_arr, std_arr = self._channel_mean_std()
+        if self._skip_normalization_using_mean:
+            mean_arr = np.zeros_like(mean_arr)
 
-        mean = np.array(mean_arr)
-        std = np.array(std_arr)
+        mean = mean_arr
+        std = std_arr
         if self._5Ddata: #NOTE: IDEALLY this should be only when the model expects 3D data.
             return mean[None, :, None, None, None], std[None, :, None, None, None]
         
         return mean[None, :, None, None], std[None, :, None, None]
 
     
+    def _channel_mean_std(self):
+        """
+        Per channel mean and std of the data. With noise, the std is that of the noisy data.
+        """
+        if self._noise_data is None:
+            count, mean, m2 = self._get_channel_moments()
+        else:
+            (count, mean, _), (count, _, m2) = channel_moments(self._data, noise=self._noise_data[..., 1:])
+        return mean, np.sqrt(m2 / count)
+
     def compute_mean_std(self, allow_for_validation_data=False):
         """
         Note that we must compute this only for training data.
@@ -617,6 +728,17 @@ class MultiChDloader:
         assert self._is_train is True or allow_for_validation_data, 'This is just allowed for training data'
         assert self._use_one_mu_std is True, 'This is the only supported case'
 
+        # with synthetic noise, the std depends on the noise realization and is therefore not cached.
+        use_cache = self._preprocessing_cache is not None and self._noise_data is None
+        if use_cache and 'mean_std' in self._preprocessing_cache:
+            return self._preprocessing_cache.get('mean_std')
+
+        mean_dict, std_dict = self._compute_mean_std()
+        if use_cache:
+            self._preprocessing_cache.set(mean_std=(mean_dict, std_dict))
+        return mean_dict, std_dict
+
+    def _compute_mean_std(self):
         if self._input_idx is not None:
             assert self._tar_idx_list is not None, 'tar_idx_list must be set if input_idx is set.'
             # assert self._noise_data is None, 'This is not supported with noise'
@@ -629,17 +751,19 @@ class MultiChDloader:
 
         if self._input_is_sum:
             assert self._noise_data is None, "This is not supported with noise"
-            mean = [np.mean(self._data[..., k:k + 1], keepdims=True) for k in range(self._num_channels)]
-            mean = np.sum(mean, keepdims=True)[0]
-            std = np.linalg.norm(
-                [np.std(self._data[..., k:k + 1], keepdims=True) for k in range(self._num_channels)],
-                keepdims=True)[0]
+            mean, std = self._channel_mean_std()
+            mean = np.sum(mean).reshape((1, ) * self._data.ndim)
+            std = np.linalg.norm(std).reshape((1, ) * self._data.ndim)
         else:
-            mean = np.mean(self._data, keepdims=True).reshape(1, 1, 1, 1)
             if self._noise_data is not None:
-                std = np.std(self._data + self._noise_data[..., 1:], keepdims=True).reshape(1, 1, 1, 1)
+                (count, mean, _), (count, noisy_mean, noisy_m2) = channel_moments(self._data,
+                                                                                  noise=self._noise_data[..., 1:])
+                mean = merge_channel_moments(count, mean, np.zeros_like(mean))[1]
+                count, _, m2 = merge_channel_moments(count, noisy_mean, noisy_m2)
             else:
-                std = np.std(self._data, keepdims=True).reshape(1, 1, 1, 1)
+                count, mean, m2 = merge_channel_moments(*self._get_channel_moments())
+            mean = np.reshape(mean, (1, 1, 1, 1))
+            std = np.sqrt(m2 / count).reshape(1, 1, 1, 1)
 
         mean = np.repeat(mean, self._num_channels, axis=1)
         std = np.repeat(std, self._num_channels, axis=1)
@@ -783,94 +907,14 @@ class MultiChDloader:
         return index
     
 
-    def _rotate2D(self, img_tuples, noise_tuples):
-        img_kwargs = {}
-        for i,img in enumerate(img_tuples):
-            for k in range(len(img)):
-                img_kwargs[f'img{i}_{k}'] = img[k]
-        
-        noise_kwargs = {}
-        for i,nimg in enumerate(noise_tuples):
-            for k in range(len(nimg)):
-                noise_kwargs[f'noise{i}_{k}'] = nimg[k]
-        
-
-        keys = list(img_kwargs.keys()) + list(noise_kwargs.keys())
-        self._rotation_transform.add_targets({k: 'image' for k in keys})
-        rot_dic = self._rotation_transform(image=img_tuples[0][0], **img_kwargs, **noise_kwargs)
-
-        rotated_img_tuples = []
-        for i,img in enumerate(img_tuples):
-            if len(img) == 1:
-                rotated_img_tuples.append(rot_dic[f'img{i}_0'][None])
-            else:
-                rotated_img_tuples.append(np.concatenate([rot_dic[f'img{i}_{k}'][None] for k in range(len(img))], axis=0))
-
-        rotated_noise_tuples = []
-        for i, nimg in enumerate(noise_tuples):
-            if len(nimg) == 1:
-                rotated_noise_tuples.append(rot_dic[f'noise{i}_0'][None])
-            else:
-                rotated_noise_tuples.append(np.concatenate([rot_dic[f'noise{i}_{k}'][None] for k in range(len(nimg))], axis=0))
-        
-        return rotated_img_tuples, rotated_noise_tuples
-    
     def _rotate(self, img_tuples, noise_tuples):
+        """
+        Applies the same random flip/rot90 (and Z flip, for 3D data) to all images and noise images of one sample.
+        """
+        params = self._d4_augmentation.sample_params(1)
+        rotated = [apply_d4(img[None], *params)[0] for img in (*img_tuples, *noise_tuples)]
+        return rotated[:len(img_tuples)], rotated[len(img_tuples):]
 
-        if self._5Ddata:
-            return self._rotate3D(img_tuples, noise_tuples)
-        else:
-            return self._rotate2D(img_tuples, noise_tuples)
-    
-    def _rotate3D(self, img_tuples, noise_tuples):
-        img_kwargs = {}
-        # random flip in z direction
-        flip_z = self._flipz_3D and np.random.rand() < 0.5
-        for i,img in enumerate(img_tuples):
-            for j in range(self._depth3D):
-                for k in range(len(img)):
-                    if flip_z:
-                        z_idx = self._depth3D - 1 - j
-                    else:
-                        z_idx = j
-                    img_kwargs[f'img{i}_{z_idx}_{k}'] = img[k,j]
-        
-        noise_kwargs = {}
-        for i,nimg in enumerate(noise_tuples):
-            for j in range(self._depth3D):
-                for k in range(len(nimg)):
-                    if flip_z:
-                        z_idx = self._depth3D - 1 - j
-                    else:
-                        z_idx = j
-                    noise_kwargs[f'noise{i}_{z_idx}_{k}'] = nimg[k,j]
-            
-        keys = list(img_kwargs.keys()) + list(noise_kwargs.keys())
-        self._rotation_transform.add_targets({k: 'image' for k in keys})
-        rot_dic = self._rotation_transform(image=img_tuples[0][0][0], **img_kwargs, **noise_kwargs)
-        rotated_img_tuples = []
-        for i,img in enumerate(img_tuples):
-            if len(img) == 1:
-                rotated_img_tuples.append(np.concatenate([rot_dic[f'img{i}_{j}_0'][None,None] for j in range(self._depth3D)], axis=1))
-            else:
-                temp_arr = []
-                for k in range(len(img)):
-                    temp_arr.append(np.concatenate([rot_dic[f'img{i}_{j}_{k}'][None,None] for j in range(self._depth3D)], axis=1))
-                rotated_img_tuples.append(np.concatenate(temp_arr, axis=0))
-
-        rotated_noise_tuples = []
-        for i, nimg in enumerate(noise_tuples):
-            if len(nimg) == 1:
-                rotated_noise_tuples.append(np.concatenate([rot_dic[f'noise{i}_{j}_0'][None,None] for j in range(self._depth3D)], axis=1))
-            else:
-                temp_arr = []
-                for k in range(len(nimg)):
-                    temp_arr.append(np.concatenate([rot_dic[f'noise{i}_{j}_{k}'][None,None] for j in range(self._depth3D)], axis=1))
-                rotated_noise_tuples.append(np.concatenate(temp_arr, axis=0))
-
-        return rotated_img_tuples, rotated_noise_tuples
-
-   
     def get_uncorrelated_img_tuples(self, index):
         img_tuples, noise_tuples = self._get_img(index)
         assert len(noise_tuples) == 0
@@ -928,6 +972,155 @@ class MultiChDloader:
         output.append(grid_size)
         return tuple(output)
 
+    # methods whose per-sample behaviour is reproduced by get_batch. If a subclass overrides any of them, batches are
+    # built from __getitem__.
+    _BATCHED_METHODS = ('__getitem__', '_get_img', '_load_img', '_crop_imgs', '_compute_input', '_compute_input_with_alpha',
+                        '_compute_target', '_get_random_hw', '_rotate')
+
+    def batched_fetch_supported(self):
+        if any(getattr(type(self), name) is not getattr(MultiChDloader, name) for name in self._BATCHED_METHODS):
+            return False
+        return (self._img_sz is not None and not self._5Ddata and self._train_index_switcher is None
+                and not self._uncorrelated_channels and not self._empty_patch_replacement_enabled)
+
+    def _get_random_hw_arr(self, h: int, w: int, n: int):
+        """
+        Vectorized _get_random_hw: n random starting positions.
+        """
+        if h == self._img_sz:
+            return np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+
+        h_start = np.random.randint(0, h - self._img_sz, size=n)
+        w_start = np.random.randint(0, w - self._img_sz, size=n)
+        if self._patch_sampling_prior is not None:
+            assert self._patch_sampling_prior == 'center'
+            use_prior = np.random.rand(n) <= self._patch_sampling_prior_probab
+            center_h = np.random.randint(0, h // 2 - self._img_sz, size=n) + h // 4
+            center_w = np.random.randint(0, w // 2 - self._img_sz, size=n) + w // 4
+            h_start = np.where(use_prior, center_h, h_start)
+            w_start = np.where(use_prior, center_w, w_start)
+        return h_start, w_start
+
+    def _get_patch_starts(self, indices):
+        """
+        (B,) frame indices and (B, 2) top-left corners of the patches.
+        """
+        patch_loc = self.idx_manager.get_patch_location_from_dataset_idx_arr(indices)
+        t = patch_loc[:, 0]
+        if self._enable_random_cropping:
+            h, w = self._data.shape[1:3]
+            return t, np.stack(self._get_random_hw_arr(h, w, len(indices)), axis=1)
+        return t, patch_loc[:, 1:-1]
+
+    def _extract_patches(self, data, t, starts):
+        """
+        Returns the (B, C, H, W) float32 patches data[t, h:h+H, w:w+W] for all rows of starts. Patches inside the
+        frame are gathered from a strided sliding-window view in one indexing operation. Patches which need
+        padding go through _crop_img.
+        """
+        patch_shape = tuple(self.idx_manager.patch_shape[1:-1])
+        frame_shape = np.array(data.shape[1:3])
+        inside = np.all((starts >= 0) & (starts + np.array(patch_shape) <= frame_shape), axis=1)
+        output = np.empty((len(t), data.shape[-1]) + patch_shape, dtype=np.float32)
+        if np.any(inside):
+            windows = np.lib.stride_tricks.sliding_window_view(data, patch_shape, axis=(1, 2))
+            output[inside] = windows[t[inside], starts[inside, 0], starts[inside, 1]]
+        for i in np.where(~inside)[0]:
+            frame = np.moveaxis(data[t[i]], -1, 0)
+            output[i] = self._crop_img(frame, tuple(starts[i]))
+        return output
+
+    def _sample_alpha_arr(self, n):
+        if self._start_alpha_arr is None:
+            return np.full((n, self._num_channels), 1 / self._num_channels)
+        start = np.array(self._start_alpha_arr)
+        end = np.array(self._end_alpha_arr)
+        return start[None] + np.random.rand(n, self._num_channels) * (end - start)[None]
+
+    def get_batch(self, indices):
+        """
+        Batched __getitem__: all patches of indices are extracted and normalized together.
+        Returns:
+            (inp, target[, alpha][, index]) with inp of shape (B, 1, H, W) and target of shape (B, C, H, W), float32.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        assert self.batched_fetch_supported(), 'Use __getitem__ for this configuration.'
+        t, starts = self._get_patch_starts(indices)
+        imgs = self._extract_patches(self._data, t, starts)
+        noise = None
+        if self._noise_data is not None and not self._disable_noise:
+            noise = self._extract_patches(self._noise_data, t, starts)
+
+        if self._enable_rotation:
+            params = self._d4_augmentation.sample_params(len(indices))
+            imgs = apply_d4(imgs, *params)
+            if noise is not None:
+                noise = apply_d4(noise, *params)
+
+        # add noise to input
+        inputs = imgs
+        if noise is not None:
+            factor = np.sqrt(2) if self._input_is_sum else 1.0
+            inputs = imgs + noise[:, :1] * factor
+
+        # alpha is cast to float32, as multiplying a float32 image with a python float is done in float32.
+        alpha = self._sample_alpha_arr(len(indices))
+        alpha32 = alpha.astype(np.float32)[..., None, None]
+        if self._input_idx is not None:
+            inp = inputs[:, self._input_idx:self._input_idx + 1]
+        else:
+            inp = 0
+            for ch in range(inputs.shape[1]):
+                inp += inputs[:, ch:ch + 1] * alpha32[:, ch:ch + 1]
+        if self._input_idx is not None or self._normalized_input is not False:
+            mean, std = self.get_mean_std_for_input()
+            mean = mean.reshape(-1)
+            std = std.reshape(-1)
+            assert np.all(mean == mean[0]) and np.all(std == std[0])
+            inp = (inp - mean[0]) / std[0]
+        inp = inp.astype(np.float32)
+        if self._input_is_sum:
+            inp = inputs.shape[1] * inp
+
+        # add noise to target.
+        if noise is not None:
+            imgs = imgs + noise[:, 1:]
+        if self._tar_idx_list is not None and isinstance(self._tar_idx_list, int):
+            target = imgs[:, self._tar_idx_list:self._tar_idx_list + 1]
+        else:
+            if self._tar_idx_list is not None:
+                imgs = imgs[:, list(self._tar_idx_list)]
+            target = imgs
+            if self._alpha_weighted_target:
+                assert self._input_is_sum is False
+                # same as _compute_target: the i-th selected channel is weighted with the i-th alpha.
+                target = imgs * alpha32[:, :imgs.shape[1]]
+
+        output = [inp, target]
+        if self._return_alpha:
+            output.append(alpha)
+        if self._return_index:
+            output.append(indices)
+        return tuple(output)
+
+    def __getitems__(self, indices):
+        """
+        Used by torch DataLoader to fetch a whole batch. The samples are views into the arrays of get_batch.
+        """
+        if not self.batched_fetch_supported() or not all(isinstance(idx, (int, np.integer)) for idx in indices):
+            return [self[idx] for idx in indices]
+
+        batch = self.get_batch(indices)
+        samples = []
+        for i in range(len(indices)):
+            sample = [batch[0][i], batch[1][i]]
+            if self._return_alpha:
+                sample.append(list(batch[2][i]))
+            if self._return_index:
+                sample.append(indices[i])
+            samples.append(tuple(sample))
+        return samples
+
 
 if __name__ == '__main__':
     # from disentangle.configs.microscopy_multi_channel_lvae_config import get_config
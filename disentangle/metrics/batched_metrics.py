@@ -0,0 +1,183 @@
+"""
+Batched evaluation metrics for lists of images which may have different shapes. Images with the same shape are stacked
+and each metric is computed with one call per batch of images. Every function returns the per-image scores in the input
+order, and they are the same values as when the images are scored one by one.
+"""
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+from scipy.ndimage import uniform_filter
+
+from disentangle.core.psnr import RangeInvariantPsnr
+from microssim import MicroMS3IM, MicroSSIM
+from torchmetrics.functional.image import multiscale_structural_similarity_index_measure
+
+METRICS = ('rangeinvpsnr', 'microssim', 'ms3im', 'ssim', 'msssim')
+
+
+def _batches_of_same_shape(img_list, batch_size):
+    """
+    Yields lists of indices such that all images of a list have the same shape.
+    """
+    shape_to_idx = {}
+    for i, img in enumerate(img_list):
+        shape_to_idx.setdefault(img.shape, []).append(i)
+    for idx_list in shape_to_idx.values():
+        for start in range(0, len(idx_list), batch_size):
+            yield idx_list[start:start + batch_size]
+
+
+def _stack(img_list, idx_list):
+    return np.stack([img_list[i] for i in idx_list])
+
+
+def range_invariant_psnr_scores(gt_list, pred_list, batch_size=4):
+    scores = np.zeros(len(gt_list))
+    for idx_list in _batches_of_same_shape(gt_list, batch_size):
+        # multiplication with 1.0 is to ensure that the data is float.
+        gt = _stack(gt_list, idx_list) * 1.0
+        pred = _stack(pred_list, idx_list) * 1.0
+        scores[idx_list] = RangeInvariantPsnr(gt, pred).numpy()
+    return scores
+
+
+def _supported_float_type(*dtypes):
+    """
+    The float type of skimage for the dtypes: float16 is promoted to float32, other non-float types to float64, and the
+    result is np.result_type of those.
+    """
+    float_types = []
+    for dtype in map(np.dtype, dtypes):
+        if dtype in [np.float32, np.float64]:
+            float_types.append(dtype)
+        else:
+            float_types.append(np.float32 if dtype == np.float16 else np.float64)
+    return np.result_type(*float_types)
+
+
+def ssim_scores(gt_list, pred_list, batch_size=4, win_size=7, K1=0.01, K2=0.03):
+    """
+    skimage.metrics.structural_similarity(gt, pred, data_range=gt.max() - gt.min()) for every pair, with the filtering
+    done on the stacked images. It is computed in the float type of both gt and pred, so a float64 pred is not rounded
+    to the float32 of gt.
+    """
+    scores = np.zeros(len(gt_list))
+    for idx_list in _batches_of_same_shape(gt_list, batch_size):
+        gt = _stack(gt_list, idx_list)
+        pred = _stack(pred_list, idx_list)
+        float_type = _supported_float_type(gt.dtype, pred.dtype)
+        ndim = gt.ndim - 1
+        reduce_axes = tuple(range(1, gt.ndim))
+        data_range = (gt.max(axis=reduce_axes) - gt.min(axis=reduce_axes)).reshape(-1, *([1] * ndim))
+        gt = gt.astype(float_type, copy=False)
+        pred = pred.astype(float_type, copy=False)
+
+        # no filtering across the batch dimension.
+        size = (1, ) + (win_size, ) * ndim
+        NP = win_size**ndim
+        cov_norm = NP / (NP - 1)
+        ux = uniform_filter(gt, size=size)
+        uy = uniform_filter(pred, size=size)
+        uxx = uniform_filter(gt * gt, size=size)
+        uyy = uniform_filter(pred * pred, size=size)
+        uxy = uniform_filter(gt * pred, size=size)
+        vx = cov_norm * (uxx - ux * ux)
+        vy = cov_norm * (uyy - uy * uy)
+        vxy = cov_norm * (uxy - ux * uy)
+
+        C1 = (K1 * data_range)**2
+        C2 = (K2 * data_range)**2
+        A1, A2, B1, B2 = (2 * ux * uy + C1, 2 * vxy + C2, ux**2 + uy**2 + C1, vx + vy + C2)
+        S = (A1 * A2) / (B1 * B2)
+
+        pad = (win_size - 1) // 2
+        crop = (slice(pad, -pad), ) * ndim
+        for i, idx in enumerate(idx_list):
+            scores[idx] = S[i][crop].mean(dtype=np.float64)
+    return scores
+
+
+def msssim_scores(gt_list, pred_list, batch_size=4):
+    """
+    MultiScaleStructuralSimilarityIndexMeasure(data_range=gt.max() - gt.min())(pred, gt) for every pair.
+    """
+    scores = np.zeros(len(gt_list))
+    for idx_list in _batches_of_same_shape(gt_list, batch_size):
+        gt = _stack(gt_list, idx_list)
+        pred = _stack(pred_list, idx_list)
+        reduce_axes = tuple(range(1, gt.ndim))
+        data_range = torch.Tensor(gt.max(axis=reduce_axes) - gt.min(axis=reduce_axes))
+        data_range = data_range.view(-1, *([1] * gt.ndim))
+        scores[idx_list] = multiscale_structural_similarity_index_measure(torch.Tensor(pred[:, None]),
+                                                                          torch.Tensor(gt[:, None]),
+                                                                          data_range=data_range,
+                                                                          reduction='none').numpy()
+    return scores
+
+
+def _micro_scores(metric_cls, gt_list, pred_list):
+    metric_obj = metric_cls()
+    metric_obj.fit(gt_list, pred_list)
+    return np.array([metric_obj.score(gt_list[i], pred_list[i]) for i in range(len(gt_list))])
+
+
+def microssim_scores(gt_list, pred_list, batch_size=4):
+    return _micro_scores(MicroSSIM, gt_list, pred_list)
+
+
+def ms3im_scores(gt_list, pred_list, batch_size=4):
+    return _micro_scores(MicroMS3IM, gt_list, pred_list)
+
+
+METRIC_FNS = {
+    'rangeinvpsnr': range_invariant_psnr_scores,
+    'microssim': microssim_scores,
+    'ms3im': ms3im_scores,
+    'ssim': ssim_scores,
+    'msssim': msssim_scores,
+}
+
+
+def _init_worker(num_threads):
+    torch.set_num_threads(num_threads)
+
+
+def _compute_metric(metric, gt_list, pred_list, batch_size):
+    return METRIC_FNS[metric](gt_list, pred_list, batch_size=batch_size)
+
+
+def compute_channelwise_scores(gt_channels, pred_channels, metrics=METRICS, num_workers=0, batch_size=4):
+    """
+    Args:
+        gt_channels: for every channel, a list of target images.
+        pred_channels: for every channel, a list of predicted images.
+        metrics: names of the metrics, see METRIC_FNS.
+        num_workers: every (metric, channel) pair is an independent job. With num_workers > 0, the jobs run on a pool of
+            that many processes.
+        batch_size: maximum number of images which are stacked together.
+    Returns:
+        metric name -> list with the per-image scores of every channel.
+    """
+    jobs = [(metric, ch_idx) for metric in metrics for ch_idx in range(len(gt_channels))]
+    if num_workers > 0:
+        # spawn instead of fork: forking a process which already uses torch threads can deadlock.
+        # every worker gets its share of the cores so that the workers' torch threads do not oversubscribe them.
+        num_threads = max(1, mp.cpu_count() // num_workers)
+        with ProcessPoolExecutor(max_workers=num_workers,
+                                 mp_context=mp.get_context('spawn'),
+                                 initializer=_init_worker,
+                                 initargs=(num_threads, )) as executor:
+            futures = [
+                executor.submit(_compute_metric, metric, gt_channels[ch_idx], pred_channels[ch_idx], batch_size)
+                for metric, ch_idx in jobs
+            ]
+            results = [future.result() for future in futures]
+    else:
+        results = [_compute_metric(metric, gt_channels[ch_idx], pred_channels[ch_idx], batch_size) for metric, ch_idx in jobs]
+
+    output = {metric: [None] * len(gt_channels) for metric in metrics}
+    for (metric, ch_idx), scores in zip(jobs, results):
+        output[metric][ch_idx] = scores
+    return output
@@ -210,8 +210,7 @@ class DenoiserSplitter(LadderVAE):
             net_loss = recons_loss + self.get_kl_weight() * kl_loss
 
         if enable_logging:
-            for i, x in enumerate(td_data['debug_qvar_max']):
-                self.log(f'qvar_max:{i}', x.item(), on_epoch=True)
+            self.log_qvar_max(td_data)
 
             self.log('reconstruction_loss', recons_loss_dict['loss'], on_epoch=True)
             self.log('kl_loss', kl_loss, on_epoch=True)
@@ -0,0 +1,92 @@
+"""
+A GaussianMixtureNoiseModel baked into a dense (signal, observation) log-likelihood table. Looking up a pixel costs the
+same as in HistNoiseModel, while the values come from the trained GMM.
+"""
+from typing import Tuple, Union
+
+import torch
+import torch.nn as nn
+
+
+class GMMLookupNoiseModel(nn.Module):
+    """
+    log p(observation | signal) is tabulated on a regular grid of `signal_bins` x `obs_bins` nodes and bilinearly
+    interpolated at lookup time. As in HistNoiseModel.likelihood, the interpolation is differentiable in the signal
+    direction. Signals and observations outside the tabulated range are clamped to its boundary.
+    """
+
+    def __init__(self, log_table: torch.Tensor, min_signal: float, max_signal: float, min_obs: float, max_obs: float):
+        super().__init__()
+        self.signal_bins, self.obs_bins = log_table.shape
+        self.min_signal = float(min_signal)
+        self.max_signal = float(max_signal)
+        self.min_obs = float(min_obs)
+        self.max_obs = float(max_obs)
+        # not persistent: the table is rebuilt from the GMM and so checkpoints stay compatible with the GMM version.
+        self.register_buffer('log_table', log_table.float().reshape(-1), persistent=False)
+        print(f'[{self.__class__.__name__}] Table:{self.signal_bins}x{self.obs_bins} '
+              f'Signal:[{self.min_signal:.1f},{self.max_signal:.1f}] Obs:[{self.min_obs:.1f},{self.max_obs:.1f}]')
+
+    @classmethod
+    def from_gmm(cls, gmm_model, bins: Union[int, Tuple[int, int]] = 1024, obs_padding_sigmas: float = 6.0,
+                 chunk_size: int = 64):
+        """
+        Tabulates gmm_model.log_likelihood.
+        Args:
+            gmm_model: a trained GaussianMixtureNoiseModel.
+            bins: number of signal and observation nodes. An int is used for both.
+            obs_padding_sigmas: the observation range is the signal range padded by this many times the largest sigma.
+            chunk_size: number of signal nodes evaluated at once while building the table.
+        """
+        signal_bins, obs_bins = (bins, bins) if isinstance(bins, int) else bins
+        min_signal = gmm_model.min_signal.item()
+        max_signal = gmm_model.max_signal.item()
+        signal_nodes = torch.linspace(min_signal, max_signal, signal_bins, device=gmm_model.weight.device)
+        gmm_model.to_device(signal_nodes)
+        with torch.no_grad():
+            _, sigma, _ = gmm_model.getGaussianParametersStacked(signal_nodes)
+            padding = obs_padding_sigmas * sigma.max().item()
+            min_obs = min_signal - padding
+            max_obs = max_signal + padding
+            obs_nodes = torch.linspace(min_obs, max_obs, obs_bins, device=signal_nodes.device)
+            rows = []
+            for start in range(0, signal_bins, chunk_size):
+                signal_chunk = signal_nodes[start:start + chunk_size, None].expand(-1, obs_bins)
+                obs_chunk = obs_nodes[None].expand(len(signal_chunk), -1)
+                rows.append(gmm_model.log_likelihood(obs_chunk, signal_chunk))
+            log_table = torch.cat(rows, dim=0).cpu()
+        return cls(log_table, min_signal, max_signal, min_obs, max_obs)
+
+    def make_learnable(self):
+        raise ValueError(f'{self.__class__.__name__} is a fixed table and cannot be learnable (noise_model_learnable). '
+                         'Use the gmm noise model to learn it.')
+
+    def to_device(self, cuda_tensor):
+        if self.log_table.device != cuda_tensor.device:
+            self.log_table = self.log_table.to(cuda_tensor.device)
+
+    @staticmethod
+    def _get_index_float(x, min_val, max_val, bins):
+        return torch.clamp((bins - 1) * (x - min_val) / (max_val - min_val), min=0.0, max=bins - 1 - 1e-3)
+
+    def log_likelihood(self, obs, signal):
+        """
+        Bilinearly interpolated log p(obs | signal) for every pixel.
+        """
+        self.to_device(signal)
+        signalF = self._get_index_float(signal, self.min_signal, self.max_signal, self.signal_bins)
+        obsF = self._get_index_float(obs.detach(), self.min_obs, self.max_obs, self.obs_bins)
+        signal_ = signalF.detach().floor().long()
+        obs_ = obsF.floor().long()
+        # gradients w.r.t. the signal flow through fact.
+        fact = signalF - signal_.float()
+        obs_fact = obsF - obs_.float()
+
+        row0 = signal_ * self.obs_bins
+        row1 = row0 + self.obs_bins
+        ll0 = self.log_table[row0 + obs_] * (1.0 - obs_fact) + self.log_table[row0 + obs_ + 1] * obs_fact
+        ll1 = self.log_table[row1 + obs_] * (1.0 - obs_fact) + self.log_table[row1 + obs_ + 1] * obs_fact
+        return ll0 * (1.0 - fact) + ll1 * fact
+
+    def likelihood(self, obs, signal):
+        return torch.exp(self.log_likelihood(obs, signal))
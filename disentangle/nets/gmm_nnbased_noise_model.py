@@ -127,3 +127,10 @@ class DeepGMMNoiseModel(GaussianMixtureNoiseModel):
             noiseModel.append(alpha[k])
 
         return noiseModel
+
+    def getGaussianParametersStacked(self, signals):
+        noiseModel = self.getGaussianParameters(signals)
+        mu = torch.stack(noiseModel[:self.n_gaussian], dim=0)
+        sigma = torch.stack(noiseModel[self.n_gaussian:2 * self.n_gaussian], dim=0)
+        log_alpha = torch.log(torch.stack(noiseModel[2 * self.n_gaussian:], dim=0))
+        return mu, sigma, log_alpha
@@ -159,6 +159,72 @@ class GaussianMixtureNoiseModel(nn.Module):
         tmp = tmp / torch.sqrt((2.0 * np.pi) * std_ * std_)
         return tmp
 
+    def polynomialRegressorStacked(self, weightParams, signals):
+        """Evaluates the polynomials of all rows of `weightParams` at once using the Horner scheme.
+                Parameters
+                ----------
+                weightParams : torch.cuda.FloatTensor
+                    A [n_rows, n_coeff] sized tensor.
+                signals : torch.cuda.FloatTensor
+                    Signals
+                Returns
+                -------
+                value : torch.cuda.FloatTensor
+                    A [n_rows, *signals.shape] sized tensor.
+        """
+        scaled_signals = (signals - self.min_signal) / (self.max_signal - self.min_signal)
+        view_shape = (-1, ) + (1, ) * signals.dim()
+        value = weightParams[:, -1].view(view_shape)
+        for i in range(weightParams.shape[1] - 2, -1, -1):
+            value = value * scaled_signals + weightParams[:, i].view(view_shape)
+        return value
+
+    def getGaussianParametersStacked(self, signals):
+        """Returns the noise model for given signals with all kernels evaluated together.
+                Parameters
+                ----------
+                signals : torch.cuda.FloatTensor
+                    Underlying signals
+                Returns
+                -------
+                mu, sigma, log_alpha: torch.cuda.FloatTensor
+                    Each is a [n_gaussian, *signals.shape] sized tensor. log_alpha is normalized over the kernels.
+        """
+        kernels = self.weight.shape[0] // 3
+        weight = torch.cat([self.weight[:kernels], torch.exp(self.weight[kernels:2 * kernels]), self.weight[2 * kernels:]],
+                           dim=0)
+        values = self.polynomialRegressorStacked(weight, signals)
+        mu = values[:kernels]
+        sigma = torch.sqrt(torch.clamp(values[kernels:2 * kernels], min=self.min_sigma))
+        # sum of alpha is forced to be 1. The tol added in getGaussianParameters cancels out here.
+        log_alpha = torch.log_softmax(values[2 * kernels:], dim=0)
+        # subtracting the alpha weighted average of the means from the means ensures that the GMM has mean=signals.
+        mu = mu - torch.sum(torch.exp(log_alpha) * mu, dim=0, keepdim=True) + signals
+        return mu, sigma, log_alpha
+
+    def log_mixture_density(self, observations, signals):
+        """Evaluates log(sum_k alpha_k N(observations; mu_k, sigma_k)) in log-space with a logsumexp over the kernels.
+        """
+        self.to_device(signals)
+        mu, sigma, log_alpha = self.getGaussianParametersStacked(signals)
+        log_normal = -0.5 * ((observations - mu) / sigma)**2 - torch.log(sigma) - 0.5 * np.log(2.0 * np.pi)
+        return torch.logsumexp(log_alpha + log_normal, dim=0)
+
+    def log_likelihood(self, observations, signals):
+        """Evaluates log(likelihood(observations, signals)) directly in log-space.
+                Parameters
+                ----------
+                observations : torch.cuda.FloatTensor
+                    Noisy observations
+                signals : torch.cuda.FloatTensor
+                    Underlying signals
+                Returns
+                -------
+                value : torch.cuda.FloatTensor
+                    Log-likelihood of observations given the signals and the GMM noise model
+        """
+        return torch.logaddexp(self.log_mixture_density(observations, signals), torch.log(self.tol))
+
     def likelihood(self, observations, signals):
         """Evaluates the likelihood of observations given the signals and the corresponding gaussian parameters.
                 Parameters
@@ -172,14 +238,7 @@ class GaussianMixtureNoiseModel(nn.Module):
                 value :p + self.tol
                     Likelihood of observations given the signals and the GMM noise model
         """
-        self.to_device(signals)
-        gaussianParameters = self.getGaussianParameters(signals)
-        p = 0
-        for gaussian in range(self.n_gaussian):
-            p += self.normalDens(
-                observations, gaussianParameters[gaussian],
-                gaussianParameters[self.n_gaussian + gaussian]) * gaussianParameters[2 * self.n_gaussian + gaussian]
-        return p + self.tol
+        return torch.exp(self.log_mixture_density(observations, signals)) + self.tol
 
     def getGaussianParameters(self, signals):
         """Returns the noise model for given signals
@@ -13,6 +13,7 @@ from torch import nn
 from torch.autograd import Variable
 
 from disentangle.analysis.pred_frame_creator import PredFrameCreator
+from disentangle.core.chunked_stats import combine_moments
 from disentangle.core.data_utils import Interpolate, crop_img_tensor, pad_img_tensor
 from disentangle.core.likelihoods import GaussianLikelihood, NoiseModelLikelihood
 from disentangle.core.loss_type import LossType
@@ -20,6 +21,8 @@ from disentangle.core.metric_monitor import MetricMonitor
 from disentangle.core.nn_submodules import GateLayer
 from disentangle.core.psnr import RangeInvariantPsnr
 from disentangle.core.sampler_type import SamplerType
+from disentangle.core.stochastic import NormalStochasticBlock
+from disentangle.core.stochastic_mode import StochasticMode
 from disentangle.loss.exclusive_loss import compute_exclusion_loss
 from disentangle.loss.nbr_consistency_loss import NeighborConsistencyLoss
 from disentangle.losses import free_bits_kl
@@ -49,6 +52,7 @@ class LadderVAE(pl.LightningModule):
         self.ch2_recons_w = config.loss.get('ch2_recons_w', 1)
         self._stochastic_use_naive_exponential = config.model.decoder.get('stochastic_use_naive_exponential', False)
         self._enable_topdown_normalize_factor = config.model.get('enable_topdown_normalize_factor', True)
+        self._stochastic_mode = config.model.get('stochastic_mode', StochasticMode.Full)
         
         # 3D related stuff
         self._mode_3D = config.model.get('mode_3D', False)
@@ -340,9 +344,32 @@ class LadderVAE(pl.LightningModule):
                     input_image_shape=self.img_shape,
                     normalize_latent_factor=normalize_latent_factor,
                     conv2d_bias=self.topdown_conv2d_bias,
-                    stochastic_use_naive_exponential=self._stochastic_use_naive_exponential))
+                    stochastic_use_naive_exponential=self._stochastic_use_naive_exponential,
+                    stochastic_mode=self._stochastic_mode))
         return top_down_layers
 
+    def set_stochastic_mode(self, stochastic_mode):
+        """
+        Sets the StochasticMode of all stochastic blocks, e.g. StochasticMode.Inference before prediction.
+        """
+        assert StochasticMode.contains(stochastic_mode), f'Invalid stochastic_mode: {stochastic_mode}'
+        self._stochastic_mode = stochastic_mode
+        for module in self.modules():
+            if isinstance(module, NormalStochasticBlock):
+                module.stochastic_mode = stochastic_mode
+
+    def log_qvar_max(self, td_data):
+        """
+        Logs the max of log(var) of q for every layer. The values are logged as tensors, so there is no device sync
+        on every step. In the lean mode, they are computed here from q_lv.
+        """
+        for i, x in enumerate(td_data['debug_qvar_max']):
+            if x is None:
+                if td_data.get('q_lv') is None or td_data['q_lv'][i] is None:
+                    continue
+                x = torch.max(td_data['q_lv'][i].get().detach())
+            self.log(f'qvar_max:{i}', x, on_epoch=True)
+
     def get_other_channel(self, ch1, input):
         assert self.data_std['target'].squeeze().shape == (2, )
         assert self.data_mean['target'].squeeze().shape == (2, )
@@ -767,6 +794,7 @@ class LadderVAE(pl.LightningModule):
         return recons_loss 
 
     def training_step(self, batch, batch_idx, enable_logging=True):
+        assert self._stochastic_mode != StochasticMode.Inference, 'KL divergence is not computed in the inference mode'
         if self.current_epoch == 0 and batch_idx == 0:
             self.log('val_psnr', 1.0, on_epoch=True)
 
@@ -816,7 +844,7 @@ class LadderVAE(pl.LightningModule):
         assert self.loss_type != LossType.ElboWithNbrConsistency
 
         if self.non_stochastic_version:
-            kl_loss = torch.Tensor([0.0]).cuda()
+            kl_loss = torch.zeros(1, device=x.device)
             net_loss = recons_loss
         else:
             if self.loss_type == LossType.DenoiSplitMuSplit:
@@ -834,8 +862,7 @@ class LadderVAE(pl.LightningModule):
             net_loss = recons_loss + kl_loss
 
         if enable_logging:
-            for i, x in enumerate(td_data['debug_qvar_max']):
-                self.log(f'qvar_max:{i}', x.item(), on_epoch=True)
+            self.log_qvar_max(td_data)
 
             self.log('reconstruction_loss', recons_loss_dict['loss'], on_epoch=True)
             self.log('kl_loss', kl_loss, on_epoch=True)
@@ -987,7 +1014,10 @@ class LadderVAE(pl.LightningModule):
 
         # Pad input to make everything easier with conv strides
         x_pad = self.pad_input(x)
+        bu_values = self._get_bu_values(x_pad)
+        return self._topdown_output(bu_values, img_size, x_pad)
 
+    def _get_bu_values(self, x_pad):
         # Bottom-up inference: return list of length n_layers (bottom to top)
         bu_values = self.bottomup_pass(x_pad)
 
@@ -996,7 +1026,9 @@ class LadderVAE(pl.LightningModule):
 
         if self._squish3d:
             bu_values = [torch.mean(self._3D_squisher[k](bu_value), dim=2) for k,bu_value in enumerate(bu_values)]
+        return bu_values
 
+    def _topdown_output(self, bu_values, img_size, x_pad):
         mode_layers = range(self.n_layers) if self.non_stochastic_version else None
         # Top-down inference/generation
         out, td_data = self.topdown_pass(bu_values, mode_layers=mode_layers)
@@ -1013,6 +1045,47 @@ class LadderVAE(pl.LightningModule):
 
         return out, td_data
 
+    def sample_outputs(self, x, num_samples, samples_per_pass=1):
+        """
+        Yields the outputs of forward(x) for num_samples samples of the top-down pass. The bottom-up pass, which is
+        deterministic, is run only once. samples_per_pass samples are drawn in one top-down pass by repeating the
+        bottom-up values along the batch dimension, so every yielded tensor has shape (k * B, ...), sample-major,
+        with k <= samples_per_pass.
+        """
+        img_size = x.size()[2:]
+        x_pad = self.pad_input(x)
+        bu_values = self._get_bu_values(x_pad)
+        for start in range(0, num_samples, samples_per_pass):
+            k = min(samples_per_pass, num_samples - start)
+            if k == 1:
+                yield self._topdown_output(bu_values, img_size, x_pad)[0]
+                continue
+
+            repeat = lambda t: None if t is None else t.repeat(k, *([1] * (t.dim() - 1)))
+            yield self._topdown_output([repeat(bu_value) for bu_value in bu_values], img_size, repeat(x_pad))[0]
+
+    @torch.no_grad()
+    def mmse_prediction(self, x, mmse_count, samples_per_pass=1, output_fn=None):
+        """
+        MMSE prediction for the normalized input x, with one bottom-up pass for all mmse_count samples (see
+        sample_outputs). The samples are accumulated into running moments and never stacked.
+        Args:
+            output_fn: maps the output of forward to the prediction. By default, the mean of the likelihood.
+        Returns:
+            mean and std (with Bessel's correction, as torch.std) over the samples.
+        """
+        if output_fn is None:
+            output_fn = lambda out: self.likelihood.get_mean_lv(out)[0]
+
+        moments = (0, 0.0, 0.0)
+        for out in self.sample_outputs(x, mmse_count, samples_per_pass=samples_per_pass):
+            pred = output_fn(out)
+            pred = pred.view(-1, len(x), *pred.shape[1:])
+            mean = pred.mean(dim=0)
+            moments = combine_moments(*moments, len(pred), mean, ((pred - mean)**2).sum(dim=0))
+        count, mean, m2 = moments
+        return mean, torch.sqrt(m2 / (count - 1))
+
     def bottomup_pass(self, inp):
         return self._bottomup_pass(inp, self.first_bottom_up, self.lowres_first_bottom_ups, self.bottom_up_layers)
 
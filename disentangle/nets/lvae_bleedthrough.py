@@ -150,16 +150,15 @@ class LadderVAEWithMixedRecons(LadderVAE):
 
         if enable_logging:
             self.log('mixed_reconstruction_loss', input_recons_loss, on_epoch=True)
-            for i, x in enumerate(td_data['debug_qvar_max']):
-                self.log(f'qvar_max:{i}', x.item(), on_epoch=True)
-                self.log('kl_loss', kl_loss, on_epoch=True)
-                self.log('grad_norm_bottom_up', self.grad_norm_bottom_up, on_epoch=True)
-                self.log('grad_norm_top_down', self.grad_norm_top_down, on_epoch=True)
-                self.log('lr', self.lr, on_epoch=True)
-                if channel_recons_loss != 0:
-                    self.log('channel_recons_loss', channel_recons_loss, on_epoch=True)
-                self.log('input_recons_loss', input_recons_loss, on_epoch=True)
-                self.log('training_loss', net_loss, on_epoch=True)
+            self.log_qvar_max(td_data)
+            self.log('kl_loss', kl_loss, on_epoch=True)
+            self.log('grad_norm_bottom_up', self.grad_norm_bottom_up, on_epoch=True)
+            self.log('grad_norm_top_down', self.grad_norm_top_down, on_epoch=True)
+            self.log('lr', self.lr, on_epoch=True)
+            if channel_recons_loss != 0:
+                self.log('channel_recons_loss', channel_recons_loss, on_epoch=True)
+            self.log('input_recons_loss', input_recons_loss, on_epoch=True)
+            self.log('training_loss', net_loss, on_epoch=True)
 
         output = {
             'loss': net_loss,
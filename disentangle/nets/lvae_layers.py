@@ -12,6 +12,7 @@ from disentangle.core.data_utils import crop_img_tensor, pad_img_tensor
 from disentangle.core.nn_submodules import ResidualBlock, ResidualGatedBlock
 from disentangle.core.non_stochastic import NonStochasticBlock
 from disentangle.core.stochastic import NormalStochasticBlock
+from disentangle.core.stochastic_mode import StochasticMode
 
 
 class TopDownLayer(nn.Module):
@@ -61,7 +62,8 @@ class TopDownLayer(nn.Module):
                  input_image_shape: Union[None, Tuple[int, int]] = None,
                  normalize_latent_factor=1.0,
                  conv2d_bias: bool = True,
-                 stochastic_use_naive_exponential=False):
+                 stochastic_use_naive_exponential=False,
+                 stochastic_mode=StochasticMode.Full):
         """
             Args:
                 z_dim:          This is the dimension of the latent space.
@@ -92,6 +94,7 @@ class TopDownLayer(nn.Module):
                             To achieve this, we centercrop the intermediate representation.
                 input_image_shape: This is the shape of the input patch. when retain_spatial_dims is set to True, then this is used to ensure that the output of this layer has this shape. 
                 normalize_latent_factor: Divide the latent space (q_params) by this factor.
+                stochastic_mode: StochasticMode of the stochastic block. Not used with non_stochastic_version.
                 conv2d_bias:    Whether or not bias should be present in the Conv2D layer.
         """
 
@@ -165,6 +168,7 @@ class TopDownLayer(nn.Module):
                 vanilla_latent_hw=vanilla_latent_hw,
                 restricted_kl=restricted_kl,
                 use_naive_exponential=stochastic_use_naive_exponential,
+                stochastic_mode=stochastic_mode,
             )
 
         if not is_top_layer:
@@ -199,6 +203,9 @@ class TopDownLayer(nn.Module):
                 )
         print(f'[{self.__class__.__name__}] normalize_latent_factor:{self.normalize_latent_factor}')
 
+    def computes_kl(self):
+        return self.non_stochastic_version or self.stochastic.stochastic_mode != StochasticMode.Inference
+
     def sample_from_q(self, input_, bu_value, var_clip_max=None, mask=None):
         """
         We sample from q
@@ -291,7 +298,7 @@ class TopDownLayer(nn.Module):
         if inference_mode:
             if self.is_top_layer:
                 q_params = bu_value
-                if mode_pred is False:
+                if mode_pred is False and self.computes_kl():
                     p_params, bu_value = self.align_pparams_buvalue(p_params, bu_value)
             else:
                 if use_uncond_mode:
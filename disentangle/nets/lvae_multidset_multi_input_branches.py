@@ -64,7 +64,11 @@ class LadderVaeMultiDatasetMultiBranch(LadderVaeTwoDset):
         for key in ['debug_qvar_max']:
             output_td_data[key] = []
             for i in range(len(td_data1[key])):
-                merged_value = torch.max(td_data1[key][i], td_data2[key][i])
+                if td_data1[key][i] is None:
+                    # not computed in the lean mode.
+                    merged_value = None
+                else:
+                    merged_value = torch.max(td_data1[key][i], td_data2[key][i])
                 output_td_data[key].append(merged_value)
 
         return output_td_data
@@ -136,8 +140,7 @@ class LadderVaeMultiDatasetMultiBranch(LadderVaeTwoDset):
             net_loss = recons_loss + self.get_kl_weight() * kl_loss
 
         if enable_logging:
-            for i, x in enumerate(td_data['debug_qvar_max']):
-                self.log(f'qvar_max:{i}', x.item(), on_epoch=True)
+            self.log_qvar_max(td_data)
 
             self.log('reconstruction_loss', recons_loss_dict['loss'], on_epoch=True)
             self.log('kl_loss', kl_loss, on_epoch=True)
@@ -95,8 +95,7 @@ class LadderVAEMultiTarget(LadderVAE):
         assert self.non_stochastic_version is False
 
         if enable_logging:
-            for i, x in enumerate(td_data['debug_qvar_max']):
-                self.log(f'qvar_max:{i}', x.item(), on_epoch=True)
+            self.log_qvar_max(td_data)
 
             self.log('reconstruction_loss', recons_loss, on_epoch=True)
             self.log('kl_loss', kl_loss, on_epoch=True)
@@ -240,8 +240,7 @@ class LadderVaeTwoDsetRestrictedRecons(LadderVAE):
             if exclusion_loss is not None:
                 self.log('exclusive_loss', exclusion_loss.item(), on_epoch=True)
 
-            for i, x in enumerate(td_data['debug_qvar_max']):
-                self.log(f'qvar_max:{i}', x.item(), on_epoch=True)
+            self.log_qvar_max(td_data)
 
             self.log('reconstruction_loss', recons_loss_dict['loss'], on_epoch=True)
             self.log('kl_loss', kl_loss, on_epoch=True)
@@ -118,8 +118,7 @@ class LadderVAECritic(LadderVAE):
             # Note the negative here. It will aim to maximize the discriminator loss.
             net_loss += -1 * self.critic_loss_weight * D_loss
 
-            for i, x in enumerate(td_data['debug_qvar_max']):
-                self.log(f'qvar_max:{i}', x.item(), on_epoch=True)
+            self.log_qvar_max(td_data)
 
             self.log('reconstruction_loss', recons_loss, on_epoch=True)
             self.log('kl_loss', kl_loss, on_epoch=True)
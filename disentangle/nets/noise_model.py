@@ -7,6 +7,7 @@ import torch.nn as nn
 
 from disentangle.core.data_type import DataType
 from disentangle.core.model_type import ModelType
+from disentangle.nets.gmm_lookup_noise_model import GMMLookupNoiseModel
 from disentangle.nets.gmm_nnbased_noise_model import DeepGMMNoiseModel
 from disentangle.nets.gmm_noise_model import GaussianMixtureNoiseModel
 from disentangle.nets.hist_gmm_noise_model import HistGMMNoiseModel
@@ -41,6 +42,27 @@ class DisentNoiseModel(nn.Module):
             ll_list.append(nmodel.likelihood(obs[:, ch_idx:ch_idx + 1], signal[:, ch_idx:ch_idx + 1]))
         return torch.cat(ll_list, dim=1)
 
+    def log_likelihood(self, obs, signal):
+        """
+        Same as torch.log(self.likelihood(obs, signal)), but noise models which can evaluate the log-likelihood directly
+        do so.
+        """
+        if obs.shape[1] == 1:
+            assert signal.shape[1] == 1
+            return self._nmodel_log_likelihood(self.nmodel_0, obs, signal)
+        assert obs.shape[1] == self._nm_cnt, f'{obs.shape[1]} != {self._nm_cnt}'
+        ll_list = []
+        for ch_idx in range(obs.shape[1]):
+            nmodel = getattr(self, f'nmodel_{ch_idx}')
+            ll_list.append(self._nmodel_log_likelihood(nmodel, obs[:, ch_idx:ch_idx + 1], signal[:, ch_idx:ch_idx + 1]))
+        return torch.cat(ll_list, dim=1)
+
+    @staticmethod
+    def _nmodel_log_likelihood(nmodel, obs, signal):
+        if hasattr(nmodel, 'log_likelihood'):
+            return nmodel.log_likelihood(obs, signal)
+        return torch.log(nmodel.likelihood(obs, signal))
+
 
 def last2path(fpath):
     return os.path.join(*fpath.split('/')[-2:])
@@ -279,7 +301,7 @@ def get_noise_model(config):
             nmodel1.make_learnable()
             nmodel2.make_learnable()
             nmodels = [nmodel1, nmodel2]
-        elif config.model.noise_model_type == 'gmm':
+        elif config.model.noise_model_type in ['gmm', 'gmm_lut']:
             print(f'Noise model Ch1: {config.model.noise_model_ch1_fpath}')
             print(f'Noise model Ch2: {config.model.noise_model_ch2_fpath}')
 
@@ -298,6 +320,11 @@ def get_noise_model(config):
                     nmodel4 = GaussianMixtureNoiseModel(params=np.load(config.model.noise_model_ch4_fpath))
                     nmodels = [nmodel1, nmodel2, nmodel3, nmodel4]
 
+            if config.model.noise_model_type == 'gmm_lut':
+                # GMM accuracy at histogram cost: the trained GMMs are baked into log-likelihood tables.
+                lut_bins = config.model.get('noise_model_lut_bins', 1024)
+                nmodels = [GMMLookupNoiseModel.from_gmm(nmodel, bins=lut_bins) for nmodel in nmodels]
+
         if config.model.get('noise_model_learnable', False):
             for nmodel in nmodels:
                 if nmodel is not None:
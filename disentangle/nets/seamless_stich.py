@@ -32,8 +32,7 @@ class SeamlessStitch(SeamlessStitchBase):
                                                                  patience=lr_patience,
                                                                  factor=lr_reduction_factor,
                                                                  threshold_mode='abs',
-                                                                 min_lr=1e-12,
-                                                                 verbose=True)
+                                                                 min_lr=1e-12)
         print(
             f'[{self.__class__.__name__}] Grid:{grid_size} LR:{learning_rate} LP:{lr_patience} LRF:{lr_reduction_factor}'
         )
@@ -50,39 +49,39 @@ class SeamlessStitch(SeamlessStitchBase):
 
     def _compute_left_loss(self, row_idx, col_idx):
         if col_idx == 0:
-            return 0.0
+            return None
         p = self.params[row_idx, col_idx]
 
         left_p_boundary = self.get_lboundary(row_idx, col_idx)
         right_p_boundary = self.get_rboundary(row_idx, col_idx - 1)
-        return (left_p_boundary, right_p_boundary, p)
+        return (left_p_boundary[..., 0], right_p_boundary[..., 0], p)
 
     def _compute_right_loss(self, row_idx, col_idx):
         if col_idx == self.params.shape[1] - 1:
-            return 0.0
+            return None
         p = self.params[row_idx, col_idx]
 
         left_p_boundary = self.get_lboundary(row_idx, col_idx + 1)
         right_p_boundary = self.get_rboundary(row_idx, col_idx)
-        return (right_p_boundary, left_p_boundary, p)
+        return (right_p_boundary[..., 0], left_p_boundary[..., 0], p)
 
     def _compute_top_loss(self, row_idx, col_idx):
         if row_idx == 0:
-            return 0.0
+            return None
         p = self.params[row_idx, col_idx]
 
         top_p_boundary = self.get_tboundary(row_idx, col_idx)
         bottom_p_boundary = self.get_bboundary(row_idx - 1, col_idx)
-        return (top_p_boundary, bottom_p_boundary, p)
+        return (top_p_boundary[..., 0, :], bottom_p_boundary[..., 0, :], p)
 
     def _compute_bottom_loss(self, row_idx, col_idx):
         if row_idx == self.params.shape[1] - 1:
-            return 0.0
+            return None
         p = self.params[row_idx, col_idx]
 
         top_p_boundary = self.get_tboundary(row_idx + 1, col_idx)
         bottom_p_boundary = self.get_bboundary(row_idx, col_idx)
-        return (bottom_p_boundary, top_p_boundary, p)
+        return (bottom_p_boundary[..., 0, :], top_p_boundary[..., 0, :], p)
 
     def _compute_loss(self,
                       row_idx,
@@ -0,0 +1,194 @@
+"""
+Seamless stitching in closed form. Instead of fitting the tile offsets with SGD (see SeamlessStitch.fit), the
+differences across all tile boundaries of all frames are extracted at once and the offsets are solved for directly. As
+in SeamlessStitch, the offset of a tile is added to channel 0 and subtracted from channel 1.
+    - coupled=True: the offsets of both tiles of a boundary are applied, so the tiles form a graph whose edges are the
+      shared boundaries. For L2, the offsets are the solution of one sparse least squares problem on this graph (a
+      weighted Laplacian system, block diagonal over the frames). For L1, it is solved with iteratively reweighted least
+      squares, every iteration being such a system. The offsets of a frame are only defined up to a constant, which is
+      chosen so that they have zero mean.
+    - coupled=False: the objective of SeamlessStitch, where the offset of a tile is fitted against the unadjusted
+      boundaries of its neighbours. Every tile is then solved on its own: the mean (L2) or the median (L1) of its
+      boundary differences.
+"""
+import numpy as np
+import torch
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
+
+from disentangle.core.seamless_stitch_base import SeamlessStitchBase
+
+
+def get_boundary_values(data, sz):
+    """
+    For every pair of neighbouring tiles i (left or top) and j (right or bottom) of (num_images, 2, H, W) frames, the
+    values v such that the boundary residuals after adding the offsets are p_i - p_j - v: the difference across the
+    boundary of channel 0, followed by the negated one of channel 1.
+    Returns:
+        (num_images, nR * (nC - 1) + (nR - 1) * nC, 2 * sz) array, first the horizontal then the vertical neighbours,
+        both in row-major order of tile i.
+    """
+    num_images, C, H, W = data.shape
+    assert C == 2, 'Seamless stitching needs 2 channels'
+    assert H % sz == 0 and W % sz == 0, f'Frame {H}x{W} is not a grid of {sz}x{sz} tiles'
+    nR, nC = H // sz, W // sz
+    tiles = data.reshape(num_images, C, nR, sz, nC, sz)
+    # left column of the right tile minus right column of the left tile: (num_images, C, nR, nC - 1, sz)
+    horizontal = np.moveaxis(tiles[:, :, :, :, 1:, 0] - tiles[:, :, :, :, :-1, -1], 3, -1)
+    # top row of the bottom tile minus bottom row of the top tile: (num_images, C, nR - 1, nC, sz)
+    vertical = tiles[:, :, 1:, 0] - tiles[:, :, :-1, -1]
+    values = []
+    for diff in [horizontal, vertical]:
+        diff = diff.reshape(num_images, C, -1, sz).astype(np.float64)
+        values.append(np.concatenate([diff[:, 0], -diff[:, 1]], axis=-1))
+    return np.concatenate(values, axis=1)
+
+
+def get_edge_tiles(nR, nC):
+    """
+    Tile indices (row-major) i and j of the neighbours, in the order of get_boundary_values.
+    """
+    idx = np.arange(nR * nC).reshape(nR, nC)
+    i = np.concatenate([idx[:, :-1].reshape(-1), idx[:-1, :].reshape(-1)])
+    j = np.concatenate([idx[:, 1:].reshape(-1), idx[1:, :].reshape(-1)])
+    return i, j
+
+
+def solve_graph_offsets(weights, targets, nR, nC):
+    """
+    Minimizes sum(weights * (p_i - p_j - targets)**2) over the offsets p of every frame, with zero mean offsets.
+    Args:
+        weights, targets: (num_images, num_edges), edges as in get_edge_tiles.
+    Returns:
+        (num_images, nR * nC) offsets.
+    """
+    num_images = len(weights)
+    T = nR * nC
+    i, j = get_edge_tiles(nR, nC)
+    frame_start = (np.arange(num_images) * T)[:, None]
+    I = (i[None] + frame_start).reshape(-1)
+    J = (j[None] + frame_start).reshape(-1)
+    w = weights.reshape(-1)
+    # the weighted Laplacian of the graph of every frame (duplicate entries are summed).
+    laplacian = sparse.csr_matrix((np.concatenate([w, w, -w, -w]), (np.concatenate(
+        [I, J, I, J]), np.concatenate([I, J, J, I]))),
+                                  shape=(num_images * T, num_images * T))
+    wt = (weights * targets).reshape(-1)
+    rhs = np.bincount(I, weights=wt, minlength=num_images * T) - np.bincount(J, weights=wt, minlength=num_images * T)
+
+    # the Laplacian is singular: the offset of the first tile of every frame is fixed to 0, then the mean is removed.
+    free = np.ones(num_images * T, dtype=bool)
+    free[frame_start[:, 0]] = False
+    offsets = np.zeros(num_images * T)
+    if free.any():
+        offsets[free] = spsolve(laplacian[free][:, free].tocsc(), rhs[free])
+    offsets = offsets.reshape(num_images, T)
+    return offsets - offsets.mean(axis=1, keepdims=True)
+
+
+def get_tile_values(values, nR, nC):
+    """
+    Values of get_boundary_values from the point of view of every tile, when only its own offset is applied:
+    (num_images, nR, nC, 4, 2 * sz), NaN where the tile has no neighbour.
+    """
+    num_images, _, K = values.shape
+    num_h = nR * (nC - 1)
+    horizontal = values[:, :num_h].reshape(num_images, nR, nC - 1, K)
+    vertical = values[:, num_h:].reshape(num_images, nR - 1, nC, K)
+    output = np.full((num_images, nR, nC, 4, K), np.nan)
+    # as the left (top) tile, the residual is p - v. As the right (bottom) tile, it is p + v.
+    output[:, :, :-1, 0] = horizontal
+    output[:, :, 1:, 1] = -horizontal
+    output[:, :-1, :, 2] = vertical
+    output[:, 1:, :, 3] = -vertical
+    return output
+
+
+class SeamlessStitchSolver(SeamlessStitchBase):
+
+    def __init__(self, grid_size, stitched_frame, coupled=True):
+        """
+        Args:
+            stitched_frame: (num_images, 2, H, W) tensor or array, H and W multiples of grid_size.
+            coupled: see the module docstring.
+        """
+        if isinstance(stitched_frame, np.ndarray):
+            stitched_frame = torch.from_numpy(stitched_frame)
+        super().__init__(grid_size, stitched_frame)
+        self._coupled = coupled
+        self._nR = stitched_frame.shape[-2] // self._sz
+        self._nC = stitched_frame.shape[-1] // self._sz
+        self._values = get_boundary_values(stitched_frame.cpu().numpy(), self._sz)
+        self._offsets = np.zeros((len(stitched_frame), self._nR, self._nC))
+        print(f'[{self.__class__.__name__}] Grid:{grid_size} Tiles:{self._nR}x{self._nC} Coupled:{coupled}')
+
+    def _edge_differences(self, offsets):
+        i, j = get_edge_tiles(self._nR, self._nC)
+        offsets = offsets.reshape(len(offsets), -1)
+        return offsets[:, i] - offsets[:, j]
+
+    def compute_loss(self, l1=True):
+        """
+        Mean absolute (l1) or squared boundary residual of the current offsets.
+        """
+        if self._coupled:
+            residuals = self._edge_differences(self._offsets)[..., None] - self._values
+        else:
+            residuals = self._offsets[..., None, None] - get_tile_values(self._values, self._nR, self._nC)
+        residuals = residuals[~np.isnan(residuals)]
+        return np.mean(np.abs(residuals)) if l1 else np.mean(residuals**2)
+
+    def fit(self, l1=True, num_iterations=20, eps=1e-6, tol=1e-6):
+        """
+        Solves for the offsets of all frames.
+        Args:
+            l1: L1 (as SeamlessStitch) or L2 boundary residuals.
+            num_iterations: maximum number of IRLS iterations for L1 with coupled tiles.
+            eps: residuals are clipped to eps times the mean absolute boundary difference when they are reweighted.
+            tol: IRLS stops once no offset changes by more than tol times the mean absolute boundary difference.
+        Returns:
+            the loss (see compute_loss) after every iteration.
+        """
+        shape = self._offsets.shape
+        if not self._coupled:
+            tile_values = get_tile_values(self._values, self._nR, self._nC).reshape(*shape, -1)
+            self._offsets = np.nanmedian(tile_values, axis=-1) if l1 else np.nanmean(tile_values, axis=-1)
+            return [self.compute_loss(l1=l1)]
+
+        # L2: every boundary pixel has the same weight, so an edge is summarized by the mean of its values.
+        targets = self._values.mean(axis=-1)
+        weights = np.full(targets.shape, float(self._values.shape[-1]))
+        self._offsets = solve_graph_offsets(weights, targets, self._nR, self._nC).reshape(shape)
+        loss_arr = [self.compute_loss(l1=l1)]
+        if not l1:
+            return loss_arr
+
+        scale = max(np.mean(np.abs(self._values)), np.finfo(np.float64).tiny)
+        for _ in range(num_iterations):
+            residuals = self._edge_differences(self._offsets)[..., None] - self._values
+            pixel_weights = 1 / np.maximum(np.abs(residuals), eps * scale)
+            weights = pixel_weights.sum(axis=-1)
+            targets = (pixel_weights * self._values).sum(axis=-1) / weights
+            offsets = solve_graph_offsets(weights, targets, self._nR, self._nC).reshape(shape)
+            change = np.max(np.abs(offsets - self._offsets))
+            self._offsets = offsets
+            loss_arr.append(self.compute_loss(l1=l1))
+            if change <= tol * scale:
+                break
+        return loss_arr
+
+    def get_offsets(self):
+        """
+        (num_images, nR, nC) offsets of the tiles.
+        """
+        return self._offsets.copy()
+
+    def get_ch0_offset(self, row_idx, col_idx):
+        return self._offsets[:, row_idx, col_idx][:, None, None]
+
+    def get_output(self):
+        data = self.get_data()
+        offsets = np.repeat(np.repeat(self._offsets, self._sz, axis=1), self._sz, axis=2)
+        data[:, 0] += offsets.astype(data.dtype)
+        data[:, 1] -= offsets.astype(data.dtype)
+        return data
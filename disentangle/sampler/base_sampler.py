@@ -4,14 +4,17 @@ from torch.utils.data import Sampler
 
 class BaseSampler(Sampler):
     """
-    Base sampler for the class which yields wo indices
+    Base sampler for the class which yields wo indices.
+    The indices of one epoch are kept in index_batches, a structured array with one integer field per entry of FIELDS.
+    Every batch is a (batch_size, len(FIELDS)) view of it.
     """
+    FIELDS = ('idx1', 'idx2', 'grid_size')
 
     def __init__(self, dataset, batch_size, grid_size=1) -> None:
         """
         Grid size of 1 ensures that any random crop can be taken.
         """
-        super().__init__(dataset)
+        super().__init__()
         self._dset = dataset
         self._grid_size = grid_size
         self.idx_max = self._dset.idx_manager.grid_count(grid_size=self._grid_size)
@@ -23,9 +26,11 @@ class BaseSampler(Sampler):
     def init(self):
         raise NotImplementedError("This needs to be implemented")
 
+    def empty_index_batches(self, count):
+        return np.zeros(count, dtype=[(name, np.int64) for name in self.FIELDS])
+
     def __iter__(self):
         self.init()
-        start_idx = 0
-        for _ in range(len(self.index_batches) // self._batch_size):
-            yield self.index_batches[start_idx:start_idx + self._batch_size].copy()
-            start_idx += self._batch_size
+        rows = self.index_batches.view(np.int64).reshape(len(self.index_batches), len(self.FIELDS))
+        for start_idx in range(0, len(rows) - self._batch_size + 1, self._batch_size):
+            yield rows[start_idx:start_idx + self._batch_size]
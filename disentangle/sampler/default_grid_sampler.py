@@ -12,7 +12,7 @@ class DefaultGridSampler(BaseSampler):
     """
 
     def init(self):
-        self.index_batches = []
-        l1_idx = np.random.randint(low=0, high=self.idx_max, size=len(self._dset))
-        grid_size = np.array([self._grid_size] * len(l1_idx))
-        self.index_batches = list(zip(l1_idx, l1_idx, grid_size))
+        self.index_batches = self.empty_index_batches(len(self._dset))
+        self.index_batches['idx1'] = np.random.randint(low=0, high=self.idx_max, size=len(self._dset))
+        self.index_batches['idx2'] = self.index_batches['idx1']
+        self.index_batches['grid_size'] = self._grid_size
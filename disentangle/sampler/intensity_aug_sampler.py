@@ -23,7 +23,7 @@ class IntensityAugValSampler(Sampler):
     INVALID = -955
 
     def __init__(self, dataset, grid_size, batch_size, fixed_alpha_idx=-1) -> None:
-        super().__init__(dataset)
+        super().__init__()
         # In validation, we just look at the cases which we'll find in the test case. alpha=0.5 is that case. This corresponds to the -1 class.
         self._alpha_idx = fixed_alpha_idx
         self._N = len(dataset)
@@ -54,7 +54,7 @@ class IntensityAugSampler(Sampler):
                  num_intensity_variations,
                  batch_size,
                  fixed_alpha=None) -> None:
-        super().__init__(dataset)
+        super().__init__()
         self._dset = dataset
         self._N = data_size
         self._alpha_class_N = ch1_alpha_interval_count
@@ -13,8 +13,14 @@ from torch.utils.data import Sampler
 
 
 class BaseSampler(Sampler):
+    """
+    The indices of one epoch are kept in index_batches, a structured array with the fields idx and grid_size. Every
+    batch is a (batch_size, 2) view of it.
+    """
+    DTYPE = [('idx', np.int64), ('grid_size', np.int64)]
+
     def __init__(self, dataset, batch_size) -> None:
-        super().__init__(dataset)
+        super().__init__()
         self._dset = dataset
         self._batch_size = batch_size
         self.idx_manager = self._dset.idx_manager
@@ -26,10 +32,9 @@ class BaseSampler(Sampler):
 
     def __iter__(self):
         self.init()
-        start_idx = 0
-        for _ in range(len(self.index_batches) // self._batch_size):
-            yield self.index_batches[start_idx:start_idx + self._batch_size].copy()
-            start_idx += self._batch_size
+        rows = self.index_batches.view(np.int64).reshape(len(self.index_batches), len(self.DTYPE))
+        for start_idx in range(0, len(rows) - self._batch_size + 1, self._batch_size):
+            yield rows[start_idx:start_idx + self._batch_size]
 
 
 class NeighborSampler(BaseSampler):
@@ -48,40 +53,46 @@ class NeighborSampler(BaseSampler):
     def dset_len(self, grid_size):
         return self.idx_manager.grid_count(grid_size=grid_size)
 
-    def _add_one_batch(self):
+    def _random_non_boundary_idx(self, count, grid_size):
+        """
+        count indices drawn uniformly among those which are not on the boundary: indices on the boundary are redrawn.
+        """
+        idx = np.random.randint(self.dset_len(grid_size), size=count)
+        rejected = np.flatnonzero(self.idx_manager.on_boundary_arr(idx, grid_size=grid_size))
+        while len(rejected) > 0:
+            idx[rejected] = np.random.randint(self.dset_len(grid_size), size=len(rejected))
+            rejected = rejected[self.idx_manager.on_boundary_arr(idx[rejected], grid_size=grid_size)]
+        return idx
+
+    def init(self):
+        num_batches = len(self._dset) // self._batch_size
         rand_sz = int(np.ceil(self._batch_size / 5))
         if self._nbr_set_count is not None:
             rand_sz = min(rand_sz, self._nbr_set_count)
+        nbr_sz = min(5 * rand_sz, self._batch_size)
 
-        rand_idx_list = []
-        rand_grid_list = []
-        for _ in range(rand_sz):
-            grid_size = np.random.choice(self._valid_gridsizes) if self._valid_gridsizes is not None else 1
-            rand_grid_list.append(grid_size)
-            idx = np.random.randint(self.dset_len(grid_size))
-            while self.idx_manager.on_boundary(idx, grid_size=grid_size):
-                idx = np.random.randint(self.dset_len(grid_size))
-            rand_idx_list.append(idx)
+        self.index_batches = np.zeros((num_batches, self._batch_size), dtype=self.DTYPE)
+        if rand_sz > 0:
+            count = num_batches * rand_sz
+            if self._valid_gridsizes is not None:
+                grid_sizes = np.random.choice(self._valid_gridsizes, size=count)
+            else:
+                grid_sizes = np.ones(count, dtype=np.int64)
 
-        batch_idx_list = []
-        for rand_idx, grid_size in zip(rand_idx_list, rand_grid_list):
-            batch_idx_list.append((rand_idx, grid_size))
-            batch_idx_list.append((self.idx_manager.get_left_nbr_idx(rand_idx, grid_size=grid_size), grid_size))
-            batch_idx_list.append((self.idx_manager.get_right_nbr_idx(rand_idx, grid_size=grid_size), grid_size))
-            batch_idx_list.append((self.idx_manager.get_top_nbr_idx(rand_idx, grid_size=grid_size), grid_size))
-            batch_idx_list.append((self.idx_manager.get_bottom_nbr_idx(rand_idx, grid_size=grid_size), grid_size))
+            # every set is the central element followed by its left, right, top and bottom neighbors.
+            nbr_sets = np.empty((count, 5), dtype=np.int64)
+            for grid_size in np.unique(grid_sizes):
+                mask = grid_sizes == grid_size
+                idx = self._random_non_boundary_idx(mask.sum(), grid_size)
+                nbr_sets[mask, 0] = idx
+                nbr_sets[mask, 1:] = self.idx_manager.get_nbr_idx_arr(idx, grid_size=grid_size)
 
-        if self._nbr_set_count is not None and len(batch_idx_list) < self._batch_size:
-            grid_size = 1  # This size ensures that patch can begin at any random pixel.
-            idx_list = list(np.random.randint(self.dset_len(grid_size), size=self._batch_size - len(batch_idx_list)))
-            gridsizes = [grid_size] * len(idx_list)
-            batch_idx_list += zip(idx_list, gridsizes)
-            self.index_batches += batch_idx_list
-        else:
-            self.index_batches += batch_idx_list[:self._batch_size]
+            self.index_batches['idx'][:, :nbr_sz] = nbr_sets.reshape(num_batches, -1)[:, :nbr_sz]
+            self.index_batches['grid_size'][:, :nbr_sz] = np.repeat(grid_sizes, 5).reshape(num_batches, -1)[:, :nbr_sz]
 
-    def init(self):
-        self.index_batches = []
-        num_batches = len(self._dset) // self._batch_size
-        for _ in range(num_batches):
-            self._add_one_batch()
+        if nbr_sz < self._batch_size:
+            grid_size = 1  # This size ensures that patch can begin at any random pixel.
+            self.index_batches['idx'][:, nbr_sz:] = np.random.randint(self.dset_len(grid_size),
+                                                                      size=(num_batches, self._batch_size - nbr_sz))
+            self.index_batches['grid_size'][:, nbr_sz:] = grid_size
+        self.index_batches = self.index_batches.reshape(-1)
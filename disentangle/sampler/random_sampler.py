@@ -9,8 +9,7 @@ class RandomSampler(BaseSampler):
     """
 
     def init(self):
-        self.index_batches = []
-        l1_idx = np.random.randint(low=0, high=self.idx_max, size=len(self._dset))
-        l2_idx = np.random.randint(low=0, high=self.idx_max, size=len(self._dset))
-        grid_size = np.array([self._grid_size] * len(l2_idx))
-        self.index_batches = list(zip(l1_idx, l2_idx, grid_size))
+        self.index_batches = self.empty_index_batches(len(self._dset))
+        self.index_batches['idx1'] = np.random.randint(low=0, high=self.idx_max, size=len(self._dset))
+        self.index_batches['idx2'] = np.random.randint(low=0, high=self.idx_max, size=len(self._dset))
+        self.index_batches['grid_size'] = self._grid_size
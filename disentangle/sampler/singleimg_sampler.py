@@ -8,9 +8,9 @@ class SingleImgSampler(BaseSampler):
     """
     Ensures that in one batch, one image is same across the batch. other image changes.
     """
-    def init(self):
-        self.index_batches = []
+    FIELDS = ('idx1', 'idx2')
 
+    def init(self):
         l1_range = self.label_idx_dict['1']
         l2_range = self.label_idx_dict['2']
         N = self._batch_size
@@ -25,9 +25,11 @@ class SingleImgSampler(BaseSampler):
 
         l1_idx = np.random.choice(np.arange(l1_range[0], l1_range[1]), size=SI_cnt * N, replace=SI_cnt * N > self.l1_N)
         l2_idx = np.random.choice(np.arange(l2_range[0], l2_range[1]), size=SI_cnt * N, replace=SI_cnt * N > self.l2_N)
-        for i in range(num_batches):
-            iby2 = i // 2
-            if i % 2 == 0:
-                self.index_batches += list(zip([l1_SI_idx[iby2]] * N, l2_idx[iby2 * N:(iby2 + 1) * N]))
-            else:
-                self.index_batches += list(zip(l1_idx[iby2 * N:(iby2 + 1) * N], [l2_SI_idx[iby2]] * N))
+
+        # batch i uses the (i // 2)-th single image of label1 (even i) or of label2 (odd i).
+        iby2 = np.arange(num_batches) // 2
+        even = (np.arange(num_batches) % 2 == 0)[:, None]
+        self.index_batches = self.empty_index_batches(num_batches * N).reshape(num_batches, N)
+        self.index_batches['idx1'] = np.where(even, l1_SI_idx[iby2][:, None], l1_idx.reshape(SI_cnt, N)[iby2])
+        self.index_batches['idx2'] = np.where(even, l2_idx.reshape(SI_cnt, N)[iby2], l2_SI_idx[iby2][:, None])
+        self.index_batches = self.index_batches.reshape(-1)
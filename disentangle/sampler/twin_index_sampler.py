@@ -11,7 +11,7 @@ class TwinIndexSampler(Sampler):
     """
 
     def __init__(self, dataset, batch_size) -> None:
-        super().__init__(dataset)
+        super().__init__()
         self._dset = dataset
         self._N = len(self._dset)
 
@@ -0,0 +1,74 @@
+"""
+Benchmark of the patch extraction of MultiChDloader: one patch at a time (__getitem__) against the batched fetch
+(get_batch). Reports patches/second on synthetic data.
+"""
+import argparse
+import time
+from unittest import mock
+
+import numpy as np
+
+import disentangle.data_loader.vanilla_dloader as vanilla_dloader
+import ml_collections
+from disentangle.core.data_split_type import DataSplitType
+from disentangle.data_loader.vanilla_dloader import MultiChDloader
+
+
+def get_dset(data, patch_size, enable_random_cropping):
+    data_config = ml_collections.ConfigDict({
+        'image_size': patch_size,
+        'num_channels': data.shape[-1],
+        'multiscale_lowres_count': None,
+        'target_separate_normalization': True,
+        'clip_percentile': 0.995,
+    })
+    with mock.patch.object(vanilla_dloader, 'get_train_val_data', return_value=data):
+        dset = MultiChDloader(data_config,
+                              '',
+                              DataSplitType.Train,
+                              val_fraction=0.1,
+                              test_fraction=0.1,
+                              normalized_input=True,
+                              enable_random_cropping=enable_random_cropping,
+                              use_one_mu_std=True,
+                              print_vars=False)
+    mean, std = dset.compute_mean_std()
+    dset.set_mean_std(mean, std)
+    return dset
+
+
+def single_sample_fetch(dset, indices):
+    samples = [dset[int(idx)] for idx in indices]
+    return np.stack([s[0] for s in samples]), np.stack([s[1] for s in samples])
+
+
+def batched_fetch(dset, indices):
+    return dset.get_batch(indices)
+
+
+def run(fn, dset, batch_size, repeats):
+    rng = np.random.RandomState(0)
+    fn(dset, rng.randint(len(dset), size=batch_size))
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(dset, rng.randint(len(dset), size=batch_size))
+    return batch_size * repeats / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_frames', type=int, default=20)
+    parser.add_argument('--frame_size', type=int, default=1024)
+    parser.add_argument('--num_channels', type=int, default=2)
+    parser.add_argument('--patch_size', type=int, default=64)
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--random_cropping', action='store_true')
+    args = parser.parse_args()
+
+    shape = (args.num_frames, args.frame_size, args.frame_size, args.num_channels)
+    data = (np.random.RandomState(0).rand(*shape) * 1000).astype(np.float32)
+    dset = get_dset(data, args.patch_size, args.random_cropping)
+    for name, fn in [('single', single_sample_fetch), ('batched', batched_fetch)]:
+        patches_per_sec = run(fn, dset, args.batch_size, args.repeats)
+        print(f'{name:>8}: {patches_per_sec:.0f} patches/s')
@@ -0,0 +1,65 @@
+"""
+Throughput of LadderVAE inference on the CPU, in patches/second, for the standard 64px BioSR configuration (with its
+lateral context inputs) and random weights. Every optimization of analysis/inference_engine.py is added one at a
+time, for every given number of threads.
+"""
+import argparse
+import copy
+import time
+
+import torch
+
+from disentangle.analysis.inference_engine import prepare_for_inference
+from disentangle.configs.biosr_config import get_config
+from disentangle.nets.lvae import LadderVAE
+
+VARIANTS = [
+    ('no_grad', dict(fuse_batchnorm=False), torch.no_grad),
+    ('inference_mode', dict(fuse_batchnorm=False), torch.inference_mode),
+    ('+fused BatchNorm', dict(), torch.inference_mode),
+    ('+channels_last', dict(channels_last=True), torch.inference_mode),
+    ('+export', dict(channels_last=True, export=True), torch.inference_mode),
+]
+
+
+def get_model(config):
+    num_inputs = config.data.multiscale_lowres_count or 1
+    data_mean = {'input': torch.zeros(1, num_inputs, 1, 1), 'target': torch.zeros(1, 2, 1, 1)}
+    data_std = {'input': torch.ones(1, num_inputs, 1, 1), 'target': torch.ones(1, 2, 1, 1)}
+    model = LadderVAE(data_mean, data_std, config)
+    for module in model.modules():
+        if isinstance(module, torch.nn.BatchNorm2d):
+            # BatchNorm statistics of a trained model.
+            module.running_mean.uniform_(-1, 1)
+            module.running_var.uniform_(0.5, 2)
+    return model.eval()
+
+
+def run(model, inp, grad_context, repeats, channels_last):
+    if channels_last:
+        inp = inp.contiguous(memory_format=torch.channels_last)
+    with grad_context():
+        model(inp)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model(inp)
+    return len(inp) * repeats / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, torch.get_num_threads()])
+    args = parser.parse_args()
+
+    config = get_config()
+    config.model.mode_pred = True
+    model = get_model(config)
+    num_inputs = config.data.multiscale_lowres_count or 1
+    inp = torch.randn(args.batch_size, num_inputs, config.data.image_size, config.data.image_size)
+    for num_threads in args.threads:
+        for name, kwargs, grad_context in VARIANTS:
+            prepared = prepare_for_inference(copy.deepcopy(model), device='cpu', num_threads=num_threads, **kwargs)
+            patches_per_sec = run(prepared, inp, grad_context, args.repeats, kwargs.get('channels_last', False))
+            print(f'threads:{num_threads} {name:>16}: {patches_per_sec:.1f} patches/s')
@@ -0,0 +1,114 @@
+"""
+Throughput of the training data pipeline for several DataLoader settings (config.dataloader, see
+data_loader/data_pipeline.py), on synthetic data. Every training step is simulated by --step_time seconds of sleep,
+during which the workers keep loading, as they do while the GPU computes. Reports samples/second and the fraction of
+the time the training loop (the GPU) waits for data, including the startup of the workers in every epoch.
+"""
+import argparse
+import time
+from unittest import mock
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, RandomSampler
+
+import disentangle.data_loader.vanilla_dloader as vanilla_dloader
+import ml_collections
+from disentangle.configs.biosr_config import get_config
+from disentangle.core.data_split_type import DataSplitType
+from disentangle.data_loader.data_pipeline import DATALOADER_DEFAULTS, get_dataloader_kwargs, share_dataset_memory
+from disentangle.data_loader.vanilla_dloader import MultiChDloader
+
+BASELINE = {
+    'pin_memory': False,
+    'persistent_workers': False,
+    'prefetch_factor': 2,
+    'share_memory': False,
+    'multiprocessing_context': None,
+}
+
+VARIANTS = [
+    ('baseline', BASELINE),
+    ('pinned, persistent', {
+        **DATALOADER_DEFAULTS, 'pin_memory': True,
+        'persistent_workers': True
+    }),
+    ('pinned, persistent, prefetch 4', {
+        **DATALOADER_DEFAULTS, 'pin_memory': True,
+        'persistent_workers': True,
+        'prefetch_factor': 4
+    }),
+    ('spawn', {
+        **BASELINE, 'multiprocessing_context': 'spawn'
+    }),
+    ('spawn, persistent, shared memory', {
+        **DATALOADER_DEFAULTS, 'multiprocessing_context': 'spawn',
+        'persistent_workers': True,
+        'share_memory': True
+    }),
+]
+
+
+def get_dset(config, num_frames, frame_size):
+    data = (np.random.rand(num_frames, frame_size, frame_size, 2) * 1000).astype(np.float32)
+    with mock.patch.object(vanilla_dloader, 'get_train_val_data', return_value=data):
+        dset = MultiChDloader(config.data,
+                              '',
+                              DataSplitType.Train,
+                              val_fraction=0.1,
+                              test_fraction=0.1,
+                              normalized_input=True,
+                              enable_rotation_aug=True,
+                              enable_random_cropping=True,
+                              use_one_mu_std=True,
+                              print_vars=False)
+    mean, std = dset.compute_mean_std()
+    dset.set_mean_std(mean, std)
+    return dset
+
+
+def run(dloader, epochs, step_time, device):
+    samples = 0
+    wait_time = 0
+    start = time.perf_counter()
+    for _ in range(epochs):
+        wait_start = time.perf_counter()
+        for inp, target in dloader:
+            inp = inp.to(device, non_blocking=True)
+            target = target.to(device, non_blocking=True)
+            wait_time += time.perf_counter() - wait_start
+            samples += len(inp)
+            time.sleep(step_time)
+            wait_start = time.perf_counter()
+    total_time = time.perf_counter() - start
+    return samples / total_time, wait_time / total_time
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_frames', type=int, default=32)
+    parser.add_argument('--frame_size', type=int, default=1024)
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--batches_per_epoch', type=int, default=50)
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--step_time', type=float, default=0.02)
+    args = parser.parse_args()
+
+    config = get_config()
+    with config.unlocked():
+        config.data.multiscale_lowres_count = None
+        config.training.num_workers = args.num_workers
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    dset = get_dset(config, args.num_frames, args.frame_size)
+    print(f'data: {dset._data.nbytes / 1e9:.2f}GB, {args.num_workers} workers, step time {args.step_time}s')
+    for name, settings in VARIANTS:
+        with config.unlocked():
+            config.dataloader = ml_collections.ConfigDict(settings)
+        if settings['share_memory']:
+            share_dataset_memory(dset)
+        sampler = RandomSampler(dset, num_samples=args.batches_per_epoch * args.batch_size)
+        dloader = DataLoader(dset, batch_size=args.batch_size, sampler=sampler, **get_dataloader_kwargs(config))
+        samples_per_sec, wait_fraction = run(dloader, args.epochs, args.step_time, device)
+        print(f'{name:>32}: {samples_per_sec:.1f} samples/s, waiting for data {100 * wait_fraction:.1f}% of the time')
+        del dloader
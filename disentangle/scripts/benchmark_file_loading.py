@@ -0,0 +1,51 @@
+"""
+Time to decode a set of synthetic TIFF files (data_loader/parallel_file_loader.py), one after another and in thread
+and process pools of the given sizes. With --compress, the files are zlib compressed, so that decoding costs CPU time.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import tifffile
+from disentangle.core.file_loading_backend import FileLoadingBackend
+from disentangle.core.tiff_reader import load_tiff
+from disentangle.data_loader.parallel_file_loader import load_files
+
+
+def write_files(dirpath, num_files, num_frames, frame_size, compress):
+    rng = np.random.RandomState(0)
+    fpaths = []
+    for i in range(num_files):
+        fpath = os.path.join(dirpath, f'{i}.tif')
+        data = (rng.rand(num_frames, frame_size, frame_size) * 1000).astype(np.uint16)
+        tifffile.imwrite(fpath, data, compression='zlib' if compress else None)
+        fpaths.append(fpath)
+    return fpaths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_files', type=int, default=16)
+    parser.add_argument('--num_frames', type=int, default=16)
+    parser.add_argument('--frame_size', type=int, default=1024)
+    parser.add_argument('--num_workers', type=int, nargs='+', default=[2, 4, 8])
+    parser.add_argument('--compress', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as dirpath:
+        fpaths = write_files(dirpath, args.num_files, args.num_frames, args.frame_size, args.compress)
+        variants = [('sequential', 0, FileLoadingBackend.Thread)]
+        for num_workers in args.num_workers:
+            variants.append((f'{num_workers} threads', num_workers, FileLoadingBackend.Thread))
+            variants.append((f'{num_workers} processes', num_workers, FileLoadingBackend.Process))
+
+        results = []
+        for name, num_workers, backend in variants:
+            start = time.perf_counter()
+            load_files(load_tiff, fpaths, num_workers=num_workers, backend=backend)
+            results.append((name, time.perf_counter() - start))
+        for name, elapsed in results:
+            print(f'{name:>16}: {elapsed:.2f}s')
@@ -0,0 +1,68 @@
+"""
+Benchmark of the GaussianMixtureNoiseModel log-likelihood: the per-kernel loop (getGaussianParameters + normalDens)
+against the stacked evaluation (log_likelihood). Reports time and peak memory per batch, including the backward pass.
+Peak memory is only reported on GPU.
+"""
+import argparse
+import time
+
+import torch
+
+from disentangle.nets.gmm_noise_model import GaussianMixtureNoiseModel
+
+
+def per_kernel_log_likelihood(nmodel, observations, signals):
+    nmodel.to_device(signals)
+    gaussianParameters = nmodel.getGaussianParameters(signals)
+    p = 0
+    for gaussian in range(nmodel.n_gaussian):
+        p += nmodel.normalDens(observations, gaussianParameters[gaussian],
+                               gaussianParameters[nmodel.n_gaussian + gaussian]) * gaussianParameters[
+                                   2 * nmodel.n_gaussian + gaussian]
+    return torch.log(p + nmodel.tol)
+
+
+def stacked_log_likelihood(nmodel, observations, signals):
+    return nmodel.log_likelihood(observations, signals)
+
+
+def run(fn, nmodel, observations, signals, repeats):
+    is_cuda = signals.is_cuda
+    fn(nmodel, observations, signals).mean().backward()
+    if is_cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        signals.grad = None
+        fn(nmodel, observations, signals).mean().backward()
+    if is_cuda:
+        torch.cuda.synchronize()
+    time_ms = (time.perf_counter() - start) / repeats * 1000
+    peak_mb = torch.cuda.max_memory_allocated() / 1024**2 if is_cuda else float('nan')
+    return time_ms, peak_mb
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--patch_size', type=int, default=64)
+    parser.add_argument('--n_gaussian', type=int, default=3)
+    parser.add_argument('--n_coeff', type=int, default=3)
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    nmodel = GaussianMixtureNoiseModel(min_signal=100.0,
+                                       max_signal=2000.0,
+                                       weight=None,
+                                       n_gaussian=args.n_gaussian,
+                                       n_coeff=args.n_coeff,
+                                       min_sigma=50)
+    shape = (args.batch_size, 1, args.patch_size, args.patch_size)
+    signals = (100 + 1900 * torch.rand(*shape, device=device)).requires_grad_(True)
+    observations = signals.detach() + 100 * torch.randn(*shape, device=device)
+
+    for name, fn in [('per-kernel', per_kernel_log_likelihood), ('stacked', stacked_log_likelihood)]:
+        time_ms, peak_mb = run(fn, nmodel, observations, signals, args.repeats)
+        print(f'{name:>10}: {time_ms:.2f} ms/batch, peak memory {peak_mb:.1f} MB')
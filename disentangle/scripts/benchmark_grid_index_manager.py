@@ -0,0 +1,80 @@
+"""
+Micro-benchmark of the GridIndexManager lookups. It reports the per-index cost of
+    1. the recursive grid_count computation which was used before the counts were cached,
+    2. the scalar lookups with cached counts,
+    3. the bulk (array) lookups.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from disentangle.data_loader.patch_index_manager import GridIndexManager, TilingMode
+
+
+class RecursiveGridIndexManager(GridIndexManager):
+    """
+    Recomputes the grid counts recursively on every call, as GridIndexManager did before caching them.
+    """
+
+    def get_individual_dim_grid_count(self, dim: int):
+        return self._compute_individual_dim_grid_count(dim)
+
+    def grid_count(self, dim: int):
+        if dim == len(self.data_shape) - 1:
+            return 1
+        return self.get_individual_dim_grid_count(dim + 1) * self.grid_count(dim + 1)
+
+    def get_location_from_dataset_idx(self, dataset_idx: int):
+        grid_idx = []
+        for dim in range(len(self.data_shape)):
+            grid_idx.append(dataset_idx // self.grid_count(dim))
+            dataset_idx = dataset_idx % self.grid_count(dim)
+        location = [self.get_gridstart_location_from_dim_index(dim, grid_idx[dim]) for dim in range(len(self.data_shape))]
+        return tuple(location)
+
+    def dataset_idx_from_grid_idx(self, grid_idx: tuple):
+        index = 0
+        for dim in range(len(grid_idx)):
+            index += grid_idx[dim] * self.grid_count(dim)
+        return index
+
+
+def _per_index_time_us(fn, idx_arr):
+    start = time.perf_counter()
+    fn(idx_arr)
+    return (time.perf_counter() - start) / len(idx_arr) * 1e6
+
+
+def benchmark(data_shape, grid_shape, patch_shape, num_indices):
+    args = (data_shape, grid_shape, patch_shape, TilingMode.ShiftBoundary)
+    old_manager = RecursiveGridIndexManager(*args)
+    manager = GridIndexManager(*args)
+    idx_arr = np.random.randint(0, manager.total_grid_count(), size=num_indices)
+
+    def scalar_lookup(mng):
+
+        def fn(idx_arr):
+            for idx in idx_arr:
+                loc = mng.get_location_from_dataset_idx(idx)
+                mng.get_dataset_idx_from_grid_location(loc)
+
+        return fn
+
+    def bulk_lookup(idx_arr):
+        loc = manager.get_location_from_dataset_idx_arr(idx_arr)
+        manager.get_dataset_idx_from_grid_location_arr(loc)
+
+    print(f'Data shape:{data_shape} Grid:{grid_shape} Patch:{patch_shape} Indices:{num_indices}')
+    print(f'\tRecursive counts: {_per_index_time_us(scalar_lookup(old_manager), idx_arr):.3f} us/index')
+    print(f'\tCached counts:    {_per_index_time_us(scalar_lookup(manager), idx_arr):.3f} us/index')
+    print(f'\tBulk lookup:      {_per_index_time_us(bulk_lookup, idx_arr):.3f} us/index')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_indices', type=int, default=100_000)
+    args = parser.parse_args()
+
+    benchmark((100, 1004, 1004, 2), (1, 32, 32, 2), (1, 64, 64, 2), args.num_indices)
+    benchmark((10, 50, 512, 512, 2), (1, 1, 32, 32, 2), (1, 5, 64, 64, 2), args.num_indices)
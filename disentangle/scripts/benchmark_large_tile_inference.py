@@ -0,0 +1,114 @@
+"""
+Benchmark of the large tile inference (analysis/large_tile_prediction.py) against the usual small patch tiling, as
+done in evaluate.py (patches of image_size on a grid of image_size // 2). Reports the throughput in megapixels/second
+of the frames and the PSNR of the MMSE predictions against the target, on synthetic data.
+Without --ckpt, the model has random weights and only the throughput and the PSNR between the two tilings are
+meaningful.
+"""
+import argparse
+import importlib
+import time
+from unittest import mock
+
+import numpy as np
+import torch
+from scipy.ndimage import gaussian_filter
+
+import disentangle.data_loader.vanilla_dloader as vanilla_dloader
+import ml_collections
+from disentangle.analysis.large_tile_prediction import get_receptive_field_margin, get_tile_size, set_large_tile_mode
+from disentangle.analysis.mmse_prediction import get_dset_predictions
+from disentangle.analysis.stitch_prediction import stitch_predictions
+from disentangle.core.data_split_type import DataSplitType
+from disentangle.core.psnr import PSNR
+from disentangle.core.stochastic_mode import StochasticMode
+from disentangle.data_loader.patch_index_manager import TilingMode
+from disentangle.data_loader.vanilla_dloader import MultiChDloader
+from disentangle.nets.lvae import LadderVAE
+
+
+def get_synthetic_data(num_frames, frame_size, num_channels, seed=0):
+    rng = np.random.RandomState(seed)
+    data = rng.rand(num_frames, frame_size, frame_size, num_channels)
+    data = gaussian_filter(data, sigma=(0, 4, 4, 0))
+    data = (data - data.min()) / (data.max() - data.min())
+    return (data * 1000).astype(np.float32)
+
+
+def get_dset(config, data):
+    with mock.patch.object(vanilla_dloader, 'get_train_val_data', return_value=data):
+        dset = MultiChDloader(config.data,
+                              '',
+                              DataSplitType.Train,
+                              val_fraction=0.1,
+                              test_fraction=0.1,
+                              normalized_input=True,
+                              enable_rotation_aug=False,
+                              enable_random_cropping=False,
+                              use_one_mu_std=True,
+                              tiling_mode=TilingMode.ShiftBoundary,
+                              overlapping_padding_kwargs={'mode': 'reflect'},
+                              print_vars=False)
+    mean, std = dset.compute_mean_std()
+    dset.set_mean_std(mean, std)
+    return dset
+
+
+def predict(model, dset, batch_size, mmse_count):
+    torch.manual_seed(0)
+    start = time.perf_counter()
+    pred_tiled, *_ = get_dset_predictions(model, dset, batch_size, mmse_count=mmse_count, num_workers=0)
+    pred = stitch_predictions(pred_tiled, dset)
+    return pred, time.perf_counter() - start
+
+
+def psnr(target, pred):
+    return np.mean([PSNR(target[..., i], pred[..., i]) for i in range(target.shape[-1])])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', type=str, default='disentangle.configs.biosr_config')
+    parser.add_argument('--ckpt', type=str, default=None)
+    parser.add_argument('--num_frames', type=int, default=2)
+    parser.add_argument('--frame_size', type=int, default=512)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--mmse_count', type=int, default=1)
+    parser.add_argument('--tile_size', type=int, default=None)
+    parser.add_argument('--margin', type=int, default=None)
+    args = parser.parse_args()
+
+    config = importlib.import_module(args.config).get_config()
+    with config.unlocked():
+        config.data.multiscale_lowres_count = None
+        config.model.mode_pred = True
+        config.model.stochastic_mode = StochasticMode.Inference
+    data = get_synthetic_data(args.num_frames, args.frame_size, config.data.get('num_channels', 2))
+    dset = get_dset(config, data)
+
+    mean, std = dset.get_mean_std()
+    model = LadderVAE({k: torch.Tensor(v) for k, v in mean.items()}, {k: torch.Tensor(v) for k, v in std.items()},
+                      config)
+    if args.ckpt is not None:
+        model.load_state_dict(torch.load(args.ckpt)['state_dict'], strict=False)
+    model = model.cuda().eval()
+    model.set_params_to_same_device_as(torch.Tensor([1]).cuda())
+
+    target = (data - mean['target'].reshape(1, 1, 1, -1)) / std['target'].reshape(1, 1, 1, -1)
+    megapixels = data[..., 0].size / 1e6
+
+    image_size = config.data.image_size
+    dset.set_img_sz(image_size, image_size // 2)
+    small_pred, small_time = predict(model, dset, args.batch_size, args.mmse_count)
+    print(f'small tiles ({image_size}px, grid {image_size // 2}px, {len(dset)} patches): '
+          f'{megapixels / small_time:.3f} MP/s PSNR: {psnr(target, small_pred):.2f}')
+
+    margin = get_receptive_field_margin(model) if args.margin is None else args.margin
+    tile_size = args.tile_size
+    if tile_size is None:
+        tile_size = get_tile_size(model, args.frame_size, margin, batch_size=1)
+    set_large_tile_mode(model, dset, tile_size, margin)
+    large_pred, large_time = predict(model, dset, 1, args.mmse_count)
+    print(f'large tiles ({tile_size}px, margin {margin}px, {len(dset)} patches): '
+          f'{megapixels / large_time:.3f} MP/s PSNR: {psnr(target, large_pred):.2f}')
+    print(f'PSNR of large against small tiles: {psnr(small_pred, large_pred):.2f}')
@@ -0,0 +1,90 @@
+"""
+Benchmark of the preprocessing of MultiChDloader (background removal, max_val, upper clipping and mean/std) against the
+baseline implementation (per frame np.quantile loops, np.quantile over the whole data, boolean masks and np.mean/np.std)
+on synthetic data. Both give the same background values, max_val and (up to rounding) mean/std.
+"""
+import argparse
+import time
+from unittest import mock
+
+import numpy as np
+
+import disentangle.data_loader.vanilla_dloader as vanilla_dloader
+import ml_collections
+from disentangle.core.data_split_type import DataSplitType
+from disentangle.data_loader.vanilla_dloader import MultiChDloader
+
+
+def baseline_preprocessing(data, background_quantile, quantile, channelwise_quantile):
+    """
+    The preprocessing before chunked_stats, for reference.
+    """
+    data = data.astype(np.int32) if data.dtype == np.uint16 else data.copy()
+    background_values = np.zeros((data.shape[0], data.shape[-1]))
+    if background_quantile > 0:
+        for ch in range(data.shape[-1]):
+            for idx in range(data.shape[0]):
+                qval = int(np.quantile(data[idx, ..., ch], background_quantile))
+                background_values[idx, ch] = qval
+                data[idx, ..., ch] -= qval
+    if channelwise_quantile:
+        max_val = [np.quantile(data[..., i], quantile) for i in range(data.shape[-1])]
+        for ch in range(data.shape[-1]):
+            ch_data = data[..., ch]
+            ch_data[ch_data > max_val[ch]] = max_val[ch]
+    else:
+        max_val = np.quantile(data, quantile)
+        data[data > max_val] = max_val
+    mean, std = np.mean(data), np.std(data)
+    return background_values, max_val, mean, std
+
+
+def dset_preprocessing(data, background_quantile, quantile, channelwise_quantile):
+    data_config = ml_collections.ConfigDict({
+        'image_size': 64,
+        'num_channels': data.shape[-1],
+        'multiscale_lowres_count': None,
+        'target_separate_normalization': True,
+        'background_quantile': background_quantile,
+        'clip_percentile': quantile,
+        'channelwise_quantile': channelwise_quantile,
+    })
+    with mock.patch.object(vanilla_dloader, 'get_train_val_data', return_value=data.copy()):
+        dset = MultiChDloader(data_config,
+                              '',
+                              DataSplitType.Train,
+                              val_fraction=0.1,
+                              test_fraction=0.1,
+                              normalized_input=True,
+                              use_one_mu_std=True,
+                              print_vars=False)
+    mean, std = dset.compute_mean_std()
+    return dset._background_values, dset.get_max_val(), mean['input'].reshape(-1)[0], std['input'].reshape(-1)[0]
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    output = fn(*args)
+    return output, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_frames', type=int, default=40)
+    parser.add_argument('--frame_size', type=int, default=1024)
+    parser.add_argument('--dtype', type=str, default='float32')
+    parser.add_argument('--background_quantile', type=float, default=0.0)
+    parser.add_argument('--clip_percentile', type=float, default=0.995)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    data = (rng.gamma(2, 300, size=(args.num_frames, args.frame_size, args.frame_size, 2)) + 100).astype(args.dtype)
+    for channelwise_quantile in [False, True]:
+        expected, baseline_time = timed(baseline_preprocessing, data, args.background_quantile, args.clip_percentile,
+                                        channelwise_quantile)
+        output, dset_time = timed(dset_preprocessing, data, args.background_quantile, args.clip_percentile,
+                                  channelwise_quantile)
+        assert np.array_equal(output[0], expected[0])
+        assert np.array_equal(output[1], expected[1])
+        assert np.allclose(output[2:], expected[2:], rtol=1e-6)
+        print(f'Channelwise:{channelwise_quantile} baseline: {baseline_time:.2f}s MultiChDloader: {dset_time:.2f}s')
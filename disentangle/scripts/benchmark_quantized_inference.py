@@ -0,0 +1,136 @@
+"""
+Accuracy and speed of the reduced precision inference (analysis/quantized_inference.py) against fp32 on the CPU, on the
+validation split of synthetic data. For every precision, reports the prediction time and its speed-up, the
+RangeInvariantPsnr of the MMSE prediction against the target and against the fp32 prediction, and the calibration of
+its standard deviation: the fitted scalar and offset (metrics/calibration.py) and the count weighted mean of
+|RMSE - RMV| over the bins.
+Without --ckpt, the model has random weights and only the speed and the agreement with fp32 are meaningful.
+"""
+import argparse
+import copy
+import importlib
+import time
+from unittest import mock
+
+import numpy as np
+import torch
+from scipy.ndimage import gaussian_filter
+
+import disentangle.data_loader.vanilla_dloader as vanilla_dloader
+from disentangle.analysis.inference_engine import prepare_for_inference
+from disentangle.analysis.mmse_prediction import get_dset_predictions
+from disentangle.analysis.quantized_inference import get_calibration_inputs, set_inference_precision
+from disentangle.analysis.stitch_prediction import stitch_predictions
+from disentangle.core.data_split_type import DataSplitType
+from disentangle.core.inference_precision import InferencePrecision
+from disentangle.core.psnr import RangeInvariantPsnr
+from disentangle.core.stochastic_mode import StochasticMode
+from disentangle.data_loader.patch_index_manager import TilingMode
+from disentangle.data_loader.vanilla_dloader import MultiChDloader
+from disentangle.metrics.calibration import Calibration, get_calibrated_factor_for_stdev
+from disentangle.nets.lvae import LadderVAE
+
+
+def get_synthetic_data(num_frames, frame_size, num_channels, seed=0):
+    rng = np.random.RandomState(seed)
+    data = rng.rand(num_frames, frame_size, frame_size, num_channels)
+    data = gaussian_filter(data, sigma=(0, 4, 4, 0))
+    data = (data - data.min()) / (data.max() - data.min())
+    return (data * 1000).astype(np.float32)
+
+
+def get_dset(config, data, datasplit_type, max_val=None):
+    with mock.patch.object(vanilla_dloader, 'get_train_val_data', return_value=data):
+        dset = MultiChDloader(config.data,
+                              '',
+                              datasplit_type,
+                              val_fraction=0.5,
+                              test_fraction=0.0,
+                              max_val=max_val,
+                              normalized_input=True,
+                              enable_rotation_aug=False,
+                              enable_random_cropping=False,
+                              use_one_mu_std=True,
+                              tiling_mode=TilingMode.ShiftBoundary,
+                              overlapping_padding_kwargs={'mode': 'reflect'},
+                              print_vars=False)
+    return dset
+
+
+def predict(model, dset, batch_size, mmse_count):
+    torch.manual_seed(0)
+    start = time.perf_counter()
+    pred_tiled, *_, pred_std_tiled = get_dset_predictions(model,
+                                                          dset,
+                                                          batch_size,
+                                                          mmse_count=mmse_count,
+                                                          num_workers=0)
+    elapsed = time.perf_counter() - start
+    return stitch_predictions(pred_tiled, dset), stitch_predictions(pred_std_tiled, dset), elapsed
+
+
+def range_invariant_psnr(target, pred):
+    return np.mean([RangeInvariantPsnr(target[..., i], pred[..., i]).mean().item() for i in range(target.shape[-1])])
+
+
+def calibration_report(pred, pred_std, target):
+    flatten = lambda x: x.reshape(-1, x.shape[-1])
+    factors = get_calibrated_factor_for_stdev(flatten(pred), flatten(pred_std), flatten(target))
+    stats_dict = Calibration(num_bins=30).compute_stats(pred, pred_std, target)
+    errors = []
+    for ch_idx, stats in stats_dict.items():
+        count = np.array(stats['bin_count'])
+        valid = count > 0
+        rmse = np.array([x for x, v in zip(stats['rmse'], valid) if v])
+        rmv = np.array(stats['rmv'])[valid]
+        errors.append(np.sum(count[valid] * np.abs(rmse - rmv)) / count.sum())
+    scalars = ','.join(f'{factors[i]["scalar"]:.3f}' for i in factors)
+    offsets = ','.join(f'{factors[i]["offset"]:.3f}' for i in factors)
+    return f'calib scalar:{scalars} offset:{offsets} |RMSE-RMV|:{np.mean(errors):.4f}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', type=str, default='disentangle.configs.biosr_config')
+    parser.add_argument('--ckpt', type=str, default=None)
+    parser.add_argument('--num_frames', type=int, default=8)
+    parser.add_argument('--frame_size', type=int, default=256)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--mmse_count', type=int, default=4)
+    parser.add_argument('--num_threads', type=int, default=None)
+    parser.add_argument('--num_calibration_patches', type=int, default=32)
+    args = parser.parse_args()
+
+    config = importlib.import_module(args.config).get_config()
+    with config.unlocked():
+        config.data.multiscale_lowres_count = None
+        config.model.mode_pred = True
+        config.model.stochastic_mode = StochasticMode.Inference
+    data = get_synthetic_data(args.num_frames, args.frame_size, config.data.get('num_channels', 2))
+    # the first half of the frames for training (calibration of INT8) and the second half for validation.
+    num_train = args.num_frames // 2
+    train_dset = get_dset(config, data[:num_train], DataSplitType.Train)
+    val_dset = get_dset(config, data[num_train:], DataSplitType.Val, max_val=train_dset.get_max_val())
+    mean, std = train_dset.compute_mean_std()
+    train_dset.set_mean_std(mean, std)
+    val_dset.set_mean_std(mean, std)
+    val_dset.set_img_sz(config.data.image_size, config.data.image_size // 2)
+
+    model = LadderVAE({k: torch.Tensor(v) for k, v in mean.items()}, {k: torch.Tensor(v) for k, v in std.items()},
+                      config)
+    if args.ckpt is not None:
+        model.load_state_dict(torch.load(args.ckpt, map_location='cpu')['state_dict'], strict=False)
+    model = prepare_for_inference(model, device='cpu', num_threads=args.num_threads)
+    calibration_inputs = get_calibration_inputs(model, train_dset, args.num_calibration_patches, args.batch_size)
+
+    target = (val_dset._data - mean['target'].reshape(1, 1, 1, -1)) / std['target'].reshape(1, 1, 1, -1)
+    fp32_pred, fp32_time = None, None
+    for precision in [InferencePrecision.FP32, InferencePrecision.BF16, InferencePrecision.INT8]:
+        quantized = set_inference_precision(copy.deepcopy(model), precision, calibration_inputs)
+        pred, pred_std, elapsed = predict(quantized, val_dset, args.batch_size, args.mmse_count)
+        if precision == InferencePrecision.FP32:
+            fp32_pred, fp32_time = pred, elapsed
+        print(f'{precision}: {elapsed:.2f}s speed-up:{fp32_time / elapsed:.2f}x '
+              f'RIPSNR:{range_invariant_psnr(target, pred):.2f} '
+              f'RIPSNR vs fp32:{range_invariant_psnr(fp32_pred, pred):.2f} '
+              f'{calibration_report(pred, pred_std, target)}')
@@ -0,0 +1,70 @@
+"""
+Time and loss of the seamless stitching solvers on synthetic frames whose tiles have random offsets: SGD
+(nets/seamless_stich.py, for --steps steps) and the closed-form solver (nets/seamless_stich_solver.py), with uncoupled
+(the SGD objective) and coupled tiles, L1 and L2. Reports the SGD objective (SeamlessStitch.compute_loss) of every
+solution, the mean absolute residual across the boundaries of the stitched output and the error of the offsets
+recovered (up to a constant) by the coupled solvers.
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from disentangle.nets.seamless_stich import SeamlessStitch
+from disentangle.nets.seamless_stich_solver import SeamlessStitchSolver, get_boundary_values
+
+
+def get_frames(num_images, frame_size, grid_size, seed=0):
+    rng = np.random.RandomState(seed)
+    y, x = np.meshgrid(np.arange(frame_size), np.arange(frame_size), indexing='ij')
+    clean = np.stack([np.sin(x / 100.0) + y / frame_size, np.cos(y / 100.0)])[None].repeat(num_images, axis=0)
+    num_tiles = frame_size // grid_size
+    offsets = rng.normal(0, 0.5, size=(num_images, num_tiles, num_tiles))
+    tiled = np.repeat(np.repeat(offsets, grid_size, axis=1), grid_size, axis=2)
+    frames = clean + rng.normal(0, 0.05, size=clean.shape)
+    frames[:, 0] += tiled
+    frames[:, 1] -= tiled
+    return frames.astype(np.float32), offsets
+
+
+def sgd_objective(sgd_model, offsets):
+    with torch.no_grad():
+        sgd_model.params.params.copy_(torch.from_numpy(offsets))
+        return sgd_model.compute_loss().item()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_images', type=int, default=4)
+    parser.add_argument('--frame_size', type=int, default=1024)
+    parser.add_argument('--grid_size', type=int, default=32)
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--learning_rate', type=float, default=10)
+    args = parser.parse_args()
+
+    frames, offsets = get_frames(args.num_images, args.frame_size, args.grid_size)
+    true_offsets = -(offsets - offsets.mean(axis=(1, 2), keepdims=True))
+    sgd_model = SeamlessStitch(args.grid_size, torch.from_numpy(frames), args.learning_rate)
+    print(f'no offsets: SGD objective:{sgd_objective(sgd_model, np.zeros_like(offsets)):.4f}')
+
+    start = time.perf_counter()
+    sgd_model.fit(steps=args.steps)
+    elapsed = time.perf_counter() - start
+    sgd_offsets = sgd_model.params.params.detach().numpy().copy()
+    print(f'SGD {args.steps} steps: {elapsed:.2f}s SGD objective:{sgd_objective(sgd_model, sgd_offsets):.4f}')
+
+    for coupled in [False, True]:
+        for l1 in [True, False]:
+            start = time.perf_counter()
+            solver = SeamlessStitchSolver(args.grid_size, frames, coupled=coupled)
+            loss_arr = solver.fit(l1=l1)
+            elapsed = time.perf_counter() - start
+            solved = solver.get_offsets()
+            seam = np.mean(np.abs(get_boundary_values(solver.get_output(), args.grid_size)))
+            msg = (f'{"coupled" if coupled else "uncoupled"} {"L1" if l1 else "L2"}: {elapsed:.2f}s '
+                   f'iterations:{len(loss_arr)} SGD objective:{sgd_objective(sgd_model, solved):.4f} '
+                   f'boundary residual:{seam:.4f}')
+            if coupled:
+                msg += f' offset error:{np.abs(solved - true_offsets).mean():.4f}'
+            print(msg)
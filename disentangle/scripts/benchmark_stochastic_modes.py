@@ -0,0 +1,91 @@
+"""
+Profile of NormalStochasticBlock in the Full, Lean and Inference StochasticMode, for the latent sizes of the layers of
+a LadderVAE. Reports, per layer, the time of a training step (forward + backward of the samplewise KL and a dummy
+reconstruction term; forward only in the inference mode) and the memory which autograd keeps for the backward pass
+(plus the peak memory on CUDA).
+"""
+import argparse
+import time
+
+import torch
+
+from disentangle.core.stochastic import NormalStochasticBlock
+from disentangle.core.stochastic_mode import StochasticMode
+
+
+class SavedTensorsCounter:
+    """
+    Sums the bytes of the tensors which autograd saves for the backward pass.
+    """
+
+    def __init__(self):
+        self.nbytes = 0
+
+    def pack(self, tensor):
+        self.nbytes += tensor.numel() * tensor.element_size()
+        return tensor
+
+    def __call__(self):
+        return torch.autograd.graph.saved_tensors_hooks(self.pack, lambda tensor: tensor)
+
+
+def step(block, p_params, q_params, stochastic_mode):
+    block.stochastic_mode = stochastic_mode
+    if stochastic_mode == StochasticMode.Inference:
+        with torch.inference_mode():
+            block(p_params, q_params=q_params)
+        return
+
+    out, data = block(p_params, q_params=q_params)
+    loss = data['kl_samplewise'].mean() + out.mean()
+    loss.backward()
+    # what training_step does with the diagnostics.
+    qvar_max = data['qvar_max']
+    if qvar_max is None:
+        qvar_max = torch.max(data['q_params'][1].get().detach())
+    qvar_max.item()
+
+
+def profile(block, p_params, q_params, stochastic_mode, repeats):
+    device = p_params.device
+    counter = SavedTensorsCounter()
+    with counter():
+        step(block, p_params, q_params, stochastic_mode)
+
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        step(block, p_params, q_params, stochastic_mode)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    step_time = (time.perf_counter() - start) / repeats
+    peak = torch.cuda.max_memory_allocated() if device.type == 'cuda' else None
+    return step_time, counter.nbytes, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--n_filters', type=int, default=64)
+    parser.add_argument('--z_dim', type=int, default=128)
+    parser.add_argument('--image_size', type=int, default=64)
+    parser.add_argument('--n_layers', type=int, default=4)
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    for layer in range(args.n_layers):
+        hw = args.image_size // 2**(layer + 1)
+        block = NormalStochasticBlock(args.n_filters, args.z_dim, args.n_filters).to(device)
+        p_params = torch.randn(args.batch_size, args.n_filters, hw, hw, device=device)
+        q_params = torch.randn(args.batch_size, args.n_filters, hw, hw, device=device)
+        for mode in [StochasticMode.Full, StochasticMode.Lean, StochasticMode.Inference]:
+            step_time, saved_bytes, peak = profile(block, p_params, q_params, mode, args.repeats)
+            msg = (f'layer {layer} ({hw}x{hw}) {StochasticMode.name(mode):>9}: {step_time * 1000:.2f} ms/step '
+                   f'saved for backward: {saved_bytes / 2**20:.1f} MiB')
+            if peak is not None:
+                msg += f' peak: {peak / 2**20:.1f} MiB'
+            print(msg)
@@ -14,37 +14,41 @@ import matplotlib.pyplot as plt
 import numpy as np
 import torch
 import torch.nn as nn
-from skimage.metrics import structural_similarity
 from torch.utils.data import DataLoader
 from tqdm import tqdm
 
 import ml_collections
 from disentangle.analysis.critic_notebook_utils import get_label_separated_loss, get_mmse_dict
+from disentangle.analysis.inference_engine import get_default_device, prepare_for_inference
+from disentangle.analysis.large_tile_prediction import get_receptive_field_margin, get_tile_size, set_large_tile_mode
 from disentangle.analysis.lvae_utils import get_img_from_forward_output
-from disentangle.analysis.mmse_prediction import get_dset_predictions
+from disentangle.analysis.mmse_prediction import get_dset_predictions, get_stitched_dset_predictions
 from disentangle.analysis.paper_plots import get_predictions as get_patch_predictions
 from disentangle.analysis.plot_utils import clean_ax, get_k_largest_indices, plot_imgs_from_idx
+from disentangle.analysis.quantized_inference import get_calibration_inputs, set_inference_precision
 from disentangle.analysis.results_handler import PaperResultsHandler
 from disentangle.analysis.stitch_prediction import stitch_predictions
 from disentangle.config_utils import load_config
 from disentangle.core.data_split_type import DataSplitType, get_datasplit_tuples
 from disentangle.core.data_type import DataType
+from disentangle.core.inference_precision import InferencePrecision
 from disentangle.core.loss_type import LossType
 from disentangle.core.model_type import ModelType
 from disentangle.core.psnr import PSNR, RangeInvariantPsnr
 from disentangle.core.ssim import compute_SE
+from disentangle.core.stochastic_mode import StochasticMode
 from disentangle.core.tiff_reader import load_tiff
 from disentangle.data_loader.lc_multich_dloader import LCMultiChDloader
 from disentangle.data_loader.patch_index_manager import TilingMode
+from disentangle.data_loader.preprocessing_cache import PreprocessingCache
 # from disentangle.data_loader.two_tiff_rawdata_loader import get_train_val_data
 from disentangle.data_loader.vanilla_dloader import MultiChDloader, get_train_val_data
+from disentangle.metrics.batched_metrics import compute_channelwise_scores
 from disentangle.metrics.calibration import Calibration, get_calibrated_factor_for_stdev
 from disentangle.nets.epistemic_uncertainty import enable_epistemic_uncertainty_computation_mode
 from disentangle.sampler.random_sampler import RandomSampler
 from disentangle.scripts.run import overwride_with_cmd_params
 from disentangle.training import create_dataset, create_model
-from microssim import MicroMS3IM, MicroSSIM
-from torchmetrics.image import MultiScaleStructuralSimilarityIndexMeasure
 
 torch.multiprocessing.set_sharing_strategy("file_system")
 DATA_ROOT = "/group/jug/ashesh/data/"
@@ -127,46 +131,27 @@ def _get_list_of_images_from_gt_pred(gt, pred, ch_idx):
     return gt_list, pred_list
 
 
-def compute_high_snr_stats(highres_data, pred_unnorm, verbose=True):
+def compute_high_snr_stats(highres_data, pred_unnorm, verbose=True, num_workers=0, batch_size=4):
     """
     last dimension is the channel dimension
+    Images of the same shape are scored together and, with num_workers > 0, the channels and metrics are evaluated on a
+    process pool. See disentangle.metrics.batched_metrics.
     """
-    # is_5D = isinstance(highres_data, np.ndarray) and len(highres_data.shape) == 5
-    
-    #  channel index -> ssim object
-    # ssim_obj_dict = {}
-    # m3ssim_obj_dict = {}
-    psnr_list = []
-    microssim_list = []
-    ms3im_list = []
-    ssim_list = []
-    msssim_list = []
+    gt_channels = []
+    pred_channels = []
     for ch_idx in range(highres_data[0].shape[-1]):
         # list of gt and prediction images. This handles both 2D and 3D data. This also handles when individual images are lists.
         gt_ch, pred_ch = _get_list_of_images_from_gt_pred(highres_data, pred_unnorm, ch_idx)
-        # PSNR
-        psnr_list.append(avg_range_inv_psnr(gt_ch, pred_ch))
-        
-        # MicroSSIM
-        microssim_obj = MicroSSIM()
-        microssim_obj.fit(gt_ch, pred_ch)
-        mssim_scores = [microssim_obj.score(gt_ch[i], pred_ch[i]) for i in range(len(gt_ch))]
-        microssim_list.append((np.mean(mssim_scores), compute_SE(mssim_scores)))
-        
-        # MicroS3IM
-        m3sim_obj = MicroMS3IM()
-        m3sim_obj.fit(gt_ch, pred_ch)
-        ms3im_scores = [m3sim_obj.score(gt_ch[i], pred_ch[i]) for i in range(len(gt_ch))]
-        ms3im_list.append((np.mean(ms3im_scores), compute_SE(ms3im_scores)))
-        # SSIM
-        ssim = [structural_similarity(gt_ch[i], pred_ch[i], data_range=gt_ch[i].max() - gt_ch[i].min()) for i in range(len(gt_ch))]
-        ssim_list.append((np.mean(ssim), compute_SE(ssim)))
-        # MSSSIM
-        ms_ssim = []
-        for i in range(len(gt_ch)):
-            ms_ssim_obj = MultiScaleStructuralSimilarityIndexMeasure(data_range=gt_ch[i].max() - gt_ch[i].min())
-            ms_ssim.append(ms_ssim_obj(torch.Tensor(pred_ch[i][None,None]), torch.Tensor(gt_ch[i][None,None])).item())
-        msssim_list.append((np.mean(ms_ssim), compute_SE(ms_ssim)))
+        gt_channels.append(gt_ch)
+        pred_channels.append(pred_ch)
+
+    scores = compute_channelwise_scores(gt_channels, pred_channels, num_workers=num_workers, batch_size=batch_size)
+    # same rounding as in avg_range_inv_psnr.
+    psnr_list = [(round(np.mean(ch_scores), 2), round(compute_SE(ch_scores), 3)) for ch_scores in scores['rangeinvpsnr']]
+    microssim_list = [(np.mean(ch_scores), compute_SE(ch_scores)) for ch_scores in scores['microssim']]
+    ms3im_list = [(np.mean(ch_scores), compute_SE(ch_scores)) for ch_scores in scores['ms3im']]
+    ssim_list = [(np.mean(ch_scores), compute_SE(ch_scores)) for ch_scores in scores['ssim']]
+    msssim_list = [(np.mean(ch_scores), compute_SE(ch_scores)) for ch_scores in scores['msssim']]
     if verbose:
         def ssim_str(ssim_tmp):
             return f'{np.round(ssim_tmp[0], 3):.3f}+-{np.round(ssim_tmp[1], 3):.3f}'
@@ -201,7 +186,22 @@ def get_data_without_synthetic_noise(data_dir, config, eval_datasplit_type):
     return _get_highres_data_internal(data_dir, data_config, config.training, eval_datasplit_type)
 
 
-def _get_highres_data_internal(data_dir, data_config, training_config, eval_datasplit_type):
+def _get_highres_max_val(data_dir, data_config, training_config):
+    """
+    max_val of the train split. It is cached in data_config.preprocessing_cache_dir, if set.
+    """
+    cache = None
+    if data_config.get('preprocessing_cache_dir', None) is not None:
+        cache = PreprocessingCache.from_config(data_config.preprocessing_cache_dir,
+                                               data_config,
+                                               data_dir,
+                                               DataSplitType.Train,
+                                               training_config.val_fraction,
+                                               training_config.test_fraction,
+                                               name='highres_max_val')
+        if 'max_val' in cache:
+            return cache.get('max_val')
+
     highres_data = get_train_val_data(
         data_config,
         data_dir,
@@ -213,7 +213,13 @@ def _get_highres_data_internal(data_dir, data_config, training_config, eval_data
         highres_data = np.concatenate([highres_data[i][0] for i in range(len(highres_data))], axis=0)
 
     hres_max_val = compute_max_val(highres_data, data_config)
-    del highres_data
+    if cache is not None:
+        cache.set(max_val=hres_max_val)
+    return hres_max_val
+
+
+def _get_highres_data_internal(data_dir, data_config, training_config, eval_datasplit_type):
+    hres_max_val = _get_highres_max_val(data_dir, data_config, training_config)
 
     highres_data = get_train_val_data(
         data_config,
@@ -345,6 +351,19 @@ def main(
     eval_calibration_factors=None,
     epistemic_uncertainty_data_collection=False,
     override_kwargs=None,
+    stream_predictions=False,
+    stitch_memmap_dir=None,
+    metric_workers=0,
+    mmse_samples_per_pass=1,
+    large_tile_inference=False,
+    large_tile_size=None,
+    large_tile_margin=None,
+    device=None,
+    num_threads=None,
+    channels_last=False,
+    export_graph=False,
+    precision=InferencePrecision.FP32,
+    num_calibration_patches=32,
 ):
     global DATA_ROOT, CODE_ROOT
 
@@ -498,6 +517,8 @@ def main(
     print(config)
     with config.unlocked():
         config.model.skip_nboundary_pixels_from_loss = None
+        if not compute_kl_loss:
+            config.model.stochastic_mode = StochasticMode.Inference
 
     padding_kwargs = {
         "mode": config.data.get("padding_mode", "constant"),
@@ -540,19 +561,27 @@ def main(
 
     model = create_model(config, deepcopy(mean_dict), deepcopy(std_dict))
     ckpt_fpath = get_best_checkpoint(ckpt_dir)
-    checkpoint = torch.load(ckpt_fpath)
+    device = get_default_device() if device is None else torch.device(device)
+    checkpoint = torch.load(ckpt_fpath, map_location=device)
 
     _ = model.load_state_dict(checkpoint["state_dict"], strict=False)
-    model.eval()
-    _ = model.cuda()
-
-    # model.data_mean = model.data_mean.cuda()
-    # model.data_std = model.data_std.cuda()
-    model.set_params_to_same_device_as(torch.Tensor([1]).cuda())
+    # with dropout enabled, BatchNorm cannot be folded into the convolutions.
+    model = prepare_for_inference(model,
+                                  device=device,
+                                  num_threads=num_threads,
+                                  channels_last=channels_last,
+                                  fuse_batchnorm=not epistemic_uncertainty_data_collection,
+                                  export=export_graph)
+    if precision != InferencePrecision.FP32:
+        assert not export_graph, 'Reduced precision cannot be applied to the exported graphs'
+        calibration_inputs = None
+        if precision == InferencePrecision.INT8:
+            calibration_inputs = get_calibration_inputs(model, train_dset, num_calibration_patches, batch_size)
+        model = set_inference_precision(model, precision, calibration_inputs)
     print("Loading from epoch", checkpoint["epoch"])
 
     def count_parameters(model):
-        return sum(p.numel() for p in model.parameters() if p.requires_grad)
+        return sum(p.numel() for p in model.parameters())
 
     print(f"Model has {count_parameters(model)/1000_000:.3f}M parameters")
     # reducing the data here.
@@ -566,8 +595,23 @@ def main(
     if (config.data.multiscale_lowres_count is not None and custom_image_size is not None):
         model.reset_for_different_output_size(custom_image_size)
 
+    if large_tile_inference:
+        # tiles much larger than the training patches, with a margin as wide as the receptive field.
+        frame_size = min(val_dset.get_data_shape()[-3:-1])
+        margin = large_tile_margin
+        if margin is None:
+            margin = get_receptive_field_margin(model)
+        tile_size = large_tile_size
+        if tile_size is None:
+            tile_size = get_tile_size(model,
+                                      frame_size,
+                                      margin,
+                                      batch_size=batch_size,
+                                      samples_per_pass=mmse_samples_per_pass)
+        set_large_tile_mode(model, val_dset, tile_size, margin)
+
     if epistemic_uncertainty_data_collection:
-        inp = torch.Tensor(val_dset[0][0][None]).cuda()
+        inp = torch.Tensor(val_dset[0][0][None]).to(device)
         enable_epistemic_uncertainty_computation_mode(model, inp=inp)
 
     # Predict samples and return that.
@@ -604,20 +648,34 @@ def main(
     
 
     
-    pred_tiled, rec_loss, logvar_tiled, patch_psnr_tuple, pred_std_tiled = get_dset_predictions(
-        model,
-        val_dset,
-        batch_size,
-        num_workers=num_workers,
-        mmse_count=mmse_count,
-        model_type=config.model.model_type,
-    )
-    if pred_tiled.shape[-1] != val_dset.get_img_sz():
-        pad = (val_dset.get_img_sz() - pred_tiled.shape[-1]) // 2
-        pred_tiled = np.pad(pred_tiled, ((0, 0), (0, 0), (pad, pad), (pad, pad)))
-
-    pred = stitch_predictions(pred_tiled, val_dset)
-    pred_std = stitch_predictions(pred_std_tiled,val_dset)
+    if stream_predictions:
+        # tiled predictions are stitched batch by batch and never kept in memory.
+        pred, rec_loss, patch_psnr_tuple, pred_std = get_stitched_dset_predictions(
+            model,
+            val_dset,
+            batch_size,
+            num_workers=num_workers,
+            mmse_count=mmse_count,
+            model_type=config.model.model_type,
+            memmap_dir=stitch_memmap_dir,
+            samples_per_pass=mmse_samples_per_pass,
+        )
+    else:
+        pred_tiled, rec_loss, logvar_tiled, patch_psnr_tuple, pred_std_tiled = get_dset_predictions(
+            model,
+            val_dset,
+            batch_size,
+            num_workers=num_workers,
+            mmse_count=mmse_count,
+            model_type=config.model.model_type,
+            samples_per_pass=mmse_samples_per_pass,
+        )
+        if pred_tiled.shape[-1] != val_dset.get_img_sz():
+            pad = (val_dset.get_img_sz() - pred_tiled.shape[-1]) // 2
+            pred_tiled = np.pad(pred_tiled, ((0, 0), (0, 0), (pad, pad), (pad, pad)))
+
+        pred = stitch_predictions(pred_tiled, val_dset)
+        pred_std = stitch_predictions(pred_std_tiled,val_dset)
 
     is_list_prediction = isinstance(pred, list)
 
@@ -709,7 +767,7 @@ def main(
     if highres_data is None:
         # Computing the output statistics.
         print(print_token)
-        stats_dict = compute_high_snr_stats(tar, pred_unnorm)
+        stats_dict = compute_high_snr_stats(tar, pred_unnorm, num_workers=metric_workers)
         output_stats = {}
         output_stats["rangeinvpsnr"] = stats_dict["rangeinvpsnr"]
         output_stats["microssim"] = stats_dict["microssim"]
@@ -731,7 +789,7 @@ def main(
                 highres_data = np.mean(highres_data, axis=-1, keepdims=True)
 
         print(print_token)
-        stats_dict = compute_high_snr_stats(highres_data, pred_unnorm)
+        stats_dict = compute_high_snr_stats(highres_data, pred_unnorm, num_workers=metric_workers)
         output_stats = {}
         output_stats["rangeinvpsnr"] = stats_dict["rangeinvpsnr"]
         output_stats["microssim"] = stats_dict["microssim"]
@@ -817,6 +875,19 @@ def save_hardcoded_ckpt_evaluations_to_file(
     eval_calibration=False,
     override_kwargs=None,
     epistemic_uncertainty_data_collection=False,
+    stream_predictions=False,
+    stitch_memmap_dir=None,
+    metric_workers=0,
+    mmse_samples_per_pass=1,
+    large_tile_inference=False,
+    large_tile_size=None,
+    large_tile_margin=None,
+    device=None,
+    num_threads=None,
+    channels_last=False,
+    export_graph=False,
+    precision=InferencePrecision.FP32,
+    num_calibration_patches=32,
     # trim_boundary=True,
 ):
     if ckpt_dir is None:
@@ -991,6 +1062,19 @@ def save_hardcoded_ckpt_evaluations_to_file(
                     eval_calibration_factors=eval_calibration_factors,
                     override_kwargs=override_kwargs,
                     epistemic_uncertainty_data_collection=epistemic_uncertainty_data_collection,
+                    stream_predictions=stream_predictions,
+                    stitch_memmap_dir=stitch_memmap_dir,
+                    metric_workers=metric_workers,
+                    mmse_samples_per_pass=mmse_samples_per_pass,
+                    large_tile_inference=large_tile_inference,
+                    large_tile_size=large_tile_size,
+                    large_tile_margin=large_tile_margin,
+                    device=device,
+                    num_threads=num_threads,
+                    channels_last=channels_last,
+                    export_graph=export_graph,
+                    precision=precision,
+                    num_calibration_patches=num_calibration_patches,
                 )
                 if data is None:
                     return None, None
@@ -1053,6 +1137,19 @@ if __name__ == "__main__":
     parser.add_argument("--eval_calibration", action="store_true")
     parser.add_argument("--override_kwargs", type=str, default=None)
     parser.add_argument("--epistemic_uncertainty_data_collection", action="store_true")
+    parser.add_argument("--stream_predictions", action="store_true")
+    parser.add_argument("--stitch_memmap_dir", type=str, default=None)
+    parser.add_argument("--metric_workers", type=int, default=0)
+    parser.add_argument("--mmse_samples_per_pass", type=int, default=1)
+    parser.add_argument("--large_tile_inference", action="store_true")
+    parser.add_argument("--large_tile_size", type=int, default=None)
+    parser.add_argument("--large_tile_margin", type=int, default=None)
+    parser.add_argument("--device", type=str, default=None)
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--channels_last", action="store_true")
+    parser.add_argument("--export_graph", action="store_true")
+    parser.add_argument("--precision", type=str, default=InferencePrecision.FP32, choices=["fp32", "bf16", "int8"])
+    parser.add_argument("--num_calibration_patches", type=int, default=32)
     # parser.add_argument("--donot_trim_boundary", action="store_true")
 
     args = parser.parse_args()
@@ -1073,5 +1170,18 @@ if __name__ == "__main__":
         eval_calibration=args.eval_calibration,
         override_kwargs=args.override_kwargs,
         epistemic_uncertainty_data_collection=args.epistemic_uncertainty_data_collection,
+        stream_predictions=args.stream_predictions,
+        stitch_memmap_dir=args.stitch_memmap_dir,
+        metric_workers=args.metric_workers,
+        mmse_samples_per_pass=args.mmse_samples_per_pass,
+        large_tile_inference=args.large_tile_inference,
+        large_tile_size=args.large_tile_size,
+        large_tile_margin=args.large_tile_margin,
+        device=args.device,
+        num_threads=args.num_threads,
+        channels_last=args.channels_last,
+        export_graph=args.export_graph,
+        precision=args.precision,
+        num_calibration_patches=args.num_calibration_patches,
         # trim_boundary=not args.donot_trim_boundary,
     )
@@ -27,6 +27,7 @@ from disentangle.core.data_type import DataType
 from disentangle.core.loss_type import LossType
 from disentangle.core.model_type import ModelType
 from disentangle.core.sampler_type import SamplerType
+from disentangle.data_loader.data_pipeline import get_dataloader_kwargs, share_dataset_memory
 from disentangle.sampler.default_grid_sampler import DefaultGridSampler
 from disentangle.sampler.intensity_aug_sampler import IntensityAugSampler, IntensityAugValSampler
 from disentangle.sampler.nbr_sampler import NeighborSampler
@@ -188,10 +189,10 @@ def get_mean_std_dict_for_model(config, train_dset):
 
 def main(argv):
     config = FLAGS.config
-    if FLAGS.override_kwargs:
-        overwride_with_cmd_params(config, json.loads(FLAGS.override_kwargs))
     # making older configs compatible with current version.
     config = get_updated_config(config)
+    if FLAGS.override_kwargs:
+        overwride_with_cmd_params(config, json.loads(FLAGS.override_kwargs))
 
     assert os.path.exists(FLAGS.workdir)
     cur_workdir, relative_path = get_workdir(config, FLAGS.workdir, FLAGS.use_max_version)
@@ -219,20 +220,17 @@ def main(argv):
         # assert np.abs(config.data.mean_val - data_mean) < 1e-3, f'{config.data.mean_val - data_mean}'
         # assert np.abs(config.data.std_val - data_std) < 1e-3, f'{config.data.std_val - data_std}'
 
+        if config.dataloader.share_memory and config.training.num_workers > 0:
+            shared_bytes = share_dataset_memory(train_data) + share_dataset_memory(val_data)
+            print(f'Moved {shared_bytes / 1e9:.2f}GB of data into shared memory')
+        dloader_kwargs = get_dataloader_kwargs(config)
+
         if config.data.sampler_type == SamplerType.DefaultSampler:
             batch_size = config.training.batch_size
             shuffle = True
 
-            train_dloader = DataLoader(train_data,
-                                       pin_memory=False,
-                                       num_workers=config.training.num_workers,
-                                       shuffle=shuffle,
-                                       batch_size=batch_size)
-            val_dloader = DataLoader(val_data,
-                                     pin_memory=False,
-                                     num_workers=config.training.num_workers,
-                                     shuffle=False,
-                                     batch_size=batch_size)
+            train_dloader = DataLoader(train_data, shuffle=shuffle, batch_size=batch_size, **dloader_kwargs)
+            val_dloader = DataLoader(val_data, shuffle=False, batch_size=batch_size, **dloader_kwargs)
 
         else:
 
@@ -260,14 +258,8 @@ def main(argv):
                                                     config.data.ch1_alpha_interval_count,
                                                     config.data.num_intensity_variations,
                                                     batch_size=config.training.batch_size)
-            train_dloader = DataLoader(train_data,
-                                       pin_memory=False,
-                                       batch_sampler=train_sampler,
-                                       num_workers=config.training.num_workers)
-            val_dloader = DataLoader(val_data,
-                                     pin_memory=False,
-                                     batch_sampler=val_sampler,
-                                     num_workers=config.training.num_workers)
+            train_dloader = DataLoader(train_data, batch_sampler=train_sampler, **dloader_kwargs)
+            val_dloader = DataLoader(val_data, batch_sampler=val_sampler, **dloader_kwargs)
 
         train_network(train_dloader, val_dloader, mean_dict, std_dict, config, 'BaselineVAECL', FLAGS.logdir)
 
@@ -0,0 +1,29 @@
+import torch
+import torch.nn as nn
+
+from disentangle.analysis.inference_engine import fuse_conv_batchnorm
+
+
+def get_block():
+    # 'bacdbacd' style: the first BatchNorm follows the input, the second one a convolution (through dropout).
+    block = nn.Sequential(nn.BatchNorm2d(4), nn.ReLU(), nn.Conv2d(4, 4, 3, padding=1), nn.Dropout2d(0.2),
+                          nn.BatchNorm2d(4), nn.ReLU(), nn.Conv2d(4, 4, 3, padding=1))
+    for module in block.modules():
+        if isinstance(module, nn.BatchNorm2d):
+            module.running_mean.uniform_(-1, 1)
+            module.running_var.uniform_(0.5, 2)
+            module.weight.data.uniform_(0.5, 2)
+            module.bias.data.uniform_(-1, 1)
+    return block.eval()
+
+
+def test_fuse_conv_batchnorm():
+    torch.manual_seed(0)
+    block = get_block()
+    inp = torch.randn(2, 4, 16, 16)
+    with torch.no_grad():
+        expected = block(inp)
+        assert fuse_conv_batchnorm(block) == 1
+        assert isinstance(block[0], nn.BatchNorm2d)
+        assert isinstance(block[4], nn.Identity)
+        assert torch.allclose(block(inp), expected, atol=1e-5)
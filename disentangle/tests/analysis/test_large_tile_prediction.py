@@ -0,0 +1,35 @@
+import torch
+import torch.nn as nn
+
+from disentangle.analysis.large_tile_prediction import get_receptive_field_margin, get_tile_size
+
+
+class ConvNet(nn.Module):
+    """
+    Stand-in for LadderVAE: n_convs 3x3 convolutions have a receptive field of n_convs pixels on every side.
+    """
+
+    def __init__(self, n_convs):
+        super().__init__()
+        self.convs = nn.Sequential(*[nn.Conv2d(1, 1, 3, padding=1) for _ in range(n_convs)])
+        self._multiscale_count = None
+        self.img_shape = (16, 16)
+        self.overall_downscale_factor = 4
+
+    def forward(self, x):
+        return self.convs(x), {}
+
+
+def test_receptive_field_margin():
+    torch.manual_seed(0)
+    assert get_receptive_field_margin(ConvNet(3), tol=1e-6) == 4
+    assert get_receptive_field_margin(ConvNet(6), tol=1e-6) == 8
+
+
+def test_tile_size_fits_memory_budget():
+    model = ConvNet(3)
+    # 3 float32 outputs of one channel.
+    bytes_per_pixel = 12
+    tile_size = get_tile_size(model, 1024, 4, batch_size=2, memory_budget=2 * bytes_per_pixel * 100**2)
+    assert tile_size == 100 // 4 * 4
+    assert get_tile_size(model, 64, 4, memory_budget=1e9) == 64
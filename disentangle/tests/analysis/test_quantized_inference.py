@@ -0,0 +1,38 @@
+import torch
+import torch.nn as nn
+
+from disentangle.analysis.quantized_inference import QuantizedConv, quantize_int8
+from disentangle.core.nn_submodules import ResidualBlock
+
+
+class ResNet(nn.Module):
+    """
+    Stand-in for LadderVAE: a float32 input convolution followed by residual blocks.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.first = nn.Conv2d(1, 8, 3, padding=1)
+        self.blocks = nn.Sequential(*[
+            ResidualBlock(8, nn.LeakyReLU, batchnorm=False, block_type='bacdbacd', dropout=0.1, gated=True)
+            for _ in range(2)
+        ])
+
+    def forward(self, x):
+        return self.blocks(self.first(x))
+
+
+def test_quantize_int8():
+    torch.manual_seed(0)
+    model = ResNet().eval()
+    calibration_inputs = [torch.randn(4, 1, 16, 16) for _ in range(2)]
+    inp = torch.randn(2, 1, 16, 16)
+    with torch.no_grad():
+        expected = model(inp)
+        # two convolutions and the gate convolution of every block.
+        assert quantize_int8(model, calibration_inputs) == 6
+        assert isinstance(model.first, nn.Conv2d)
+        assert isinstance(model.blocks[0].block[1], QuantizedConv)
+        output = model(inp)
+    assert output.dtype == torch.float32
+    assert (output - expected).abs().max() < 0.05 * expected.abs().max()
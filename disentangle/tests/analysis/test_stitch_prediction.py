@@ -1,10 +1,12 @@
+import os
 from unittest.mock import Mock
 
 import numpy as np
 
-from disentangle.analysis.stitch_prediction import stitch_predictions
+from disentangle.analysis.stitch_prediction import PredictionStitcher, allocate_stitched_output, stitch_predictions
 from disentangle.core.data_split_type import DataSplitType
-from disentangle.data_loader.patch_index_manager import TilingMode
+from disentangle.data_loader.multifile_dset import MultiFileDset
+from disentangle.data_loader.patch_index_manager import GridIndexManager, TilingMode
 from disentangle.data_loader.vanilla_dloader import MultiChDloader
 
 
@@ -100,3 +102,36 @@ def test_stich_prediction_3Dshifttiling(monkeypatch):
     stitched_pred = stitch_predictions(predictions, dset)
     eq_tensor = (stitched_pred== get_3Ddata())
     assert eq_tensor.all()
+
+
+def test_batchwise_stitching_matches_full_stitching():
+    data_shape = (2, 5, 70, 71, 2)
+    mng = GridIndexManager(data_shape, (1, 1, 8, 8, 2), (1, 3, 16, 16, 2), TilingMode.ShiftBoundary)
+    dset = Mock()
+    dset.idx_manager = mng
+    dset.get_data_shape.return_value = data_shape
+
+    predictions = np.random.rand(mng.total_grid_count(), 2, 3, 16, 16).astype(np.float32)
+    stitched_pred = stitch_predictions(predictions, dset)
+
+    stitcher = PredictionStitcher(dset, predictions.shape[1])
+    for start in range(0, len(predictions), 7):
+        stitcher.add_batch(predictions[start:start + 7])
+    assert (stitcher.get_output() == stitched_pred).all()
+
+
+def test_allocate_stitched_output_for_multiple_files(tmp_path):
+    dsets = [Mock(), Mock()]
+    dsets[0].get_data_shape.return_value = (2, 16, 16, 2)
+    dsets[1].get_data_shape.return_value = (3, 8, 8, 2)
+    dset = Mock(spec=MultiFileDset)
+    dset.dsets = dsets
+    # the directory has an extension-like suffix, which must not be changed.
+    memmap_dir = tmp_path / 'preds.npy_dir'
+    memmap_dir.mkdir()
+    outputs = allocate_stitched_output(dset, 2, memmap_fpath=str(memmap_dir / 'pred'))
+    assert [output.shape for output in outputs] == [(2, 16, 16, 2), (3, 8, 8, 2)]
+    assert sorted(os.listdir(memmap_dir)) == ['pred_0', 'pred_1']
+
+    outputs = allocate_stitched_output(dset, 2, memmap_fpath=str(memmap_dir / 'pred.npy'))
+    assert [output.filename for output in outputs] == [str(memmap_dir / f'pred_{i}.npy') for i in range(2)]
@@ -0,0 +1,86 @@
+import time
+
+import numpy as np
+
+import pytest
+from disentangle.core.chunked_stats import (channel_moments, chunked_quantile, get_tail_quantiles,
+                                            merge_channel_moments, update_tail_quantiles, upperclip_)
+
+
+def get_data(dtype):
+    data = np.random.RandomState(0).gamma(2, 300, size=(7, 50, 61, 3)).astype(dtype)
+    data[0, :10] = 0
+    return data
+
+
+@pytest.mark.parametrize('dtype', [np.uint16, np.int32, np.float32, np.float64])
+def test_chunked_quantile_is_same_as_numpy(dtype):
+    data = get_data(dtype)
+    for q in [0.0, 0.1, 0.5, 0.995, 1.0]:
+        for channel in [None, 1]:
+            expected = np.quantile(data if channel is None else data[..., channel], q)
+            output = chunked_quantile(data, q, channel=channel, chunk_elements=5000)
+            assert output == expected
+            assert output.dtype == expected.dtype
+
+
+def test_tail_quantiles():
+    data = get_data(np.int32)
+    data[1] = 700  # ties
+    for q in [0.0, 0.2, 0.5, 0.7, 0.995]:
+        for channelwise in [False, True]:
+            quantiles = get_tail_quantiles(data, q, channelwise)
+            for start in range(0, len(data), 2):
+                update_tail_quantiles(quantiles, data[start:start + 2])
+            output = [quantile.get() for quantile in quantiles]
+            if channelwise:
+                assert output == [np.quantile(data[..., c], q) for c in range(3)]
+            else:
+                assert output == [np.quantile(data, q)]
+
+
+def test_chunked_quantile_is_not_slower_than_numpy():
+    data = (np.random.RandomState(0).gamma(2, 300, size=(16, 512, 512, 2)) + 100).astype(np.float32)
+    numpy_time = []
+    chunked_time = []
+    for _ in range(3):
+        start = time.perf_counter()
+        np.quantile(data, 0.995)
+        numpy_time.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        chunked_quantile(data, 0.995, chunk_elements=2**21)
+        chunked_time.append(time.perf_counter() - start)
+    assert min(chunked_time) < min(numpy_time)
+
+
+def test_channel_moments():
+    data = get_data(np.float32)
+    noise = np.random.RandomState(1).normal(size=data.shape)
+    moments, noisy_moments = channel_moments(data, noise=noise, chunk_elements=5000)
+    count, mean, m2 = upperclip_(data.copy(), np.inf, chunk_elements=5000, return_moments=True)
+    assert count == moments[0] and np.allclose(mean, moments[1], rtol=1e-12) and np.allclose(m2, moments[2], rtol=1e-12)
+    data = data.astype(np.float64)
+    for (count, mean, m2), values in [(moments, data), (noisy_moments, data + noise)]:
+        assert count == len(values.reshape(-1, 3))
+        assert np.allclose(mean, values.reshape(-1, 3).mean(axis=0), rtol=1e-12)
+        assert np.allclose(np.sqrt(m2 / count), values.reshape(-1, 3).std(axis=0), rtol=1e-12)
+
+    count, mean, m2 = merge_channel_moments(*moments)
+    assert np.isclose(mean, data.mean(), rtol=1e-12)
+    assert np.isclose(np.sqrt(m2 / count), data.std(), rtol=1e-12)
+
+
+def test_upperclip():
+    data = get_data(np.int32)
+    expected = data.copy()
+    expected[expected > 700.5] = 700.5
+    upperclip_(data, 700.5, chunk_elements=5000)
+    assert np.array_equal(data, expected)
+
+    data = get_data(np.float32)
+    max_val = [100, 500.5, 1000]
+    expected = data.copy()
+    for ch in range(3):
+        expected[..., ch][expected[..., ch] > max_val[ch]] = max_val[ch]
+    upperclip_(data, max_val, chunk_elements=5000)
+    assert np.array_equal(data, expected)
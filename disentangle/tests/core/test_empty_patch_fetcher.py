@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+
+import pytest
+from disentangle.core.empty_patch_fetcher import EmptyPatchFetcher, running_max_1d
+from disentangle.data_loader.patch_index_manager import GridIndexManager, TilingMode
+
+
+def brute_force_max(frames, window):
+    N, H, W = frames.shape
+    output = np.zeros((N, H - window + 1, W - window + 1), dtype=frames.dtype)
+    for h in range(output.shape[1]):
+        for w in range(output.shape[2]):
+            output[:, h, w] = frames[:, h:h + window, w:w + window].max(axis=(1, 2))
+    return output
+
+
+def get_fetcher(frames, **kwargs):
+    idx_manager = GridIndexManager((*frames.shape, 1), (1, 16, 16, 1), (1, 16, 16, 1), TilingMode.ShiftBoundary)
+    return EmptyPatchFetcher(idx_manager, 16, frames, max_val_threshold=0.5, **kwargs)
+
+
+def get_frames(seed):
+    # bright squares on an empty background.
+    rng = np.random.RandomState(seed)
+    frames = rng.rand(2, 64, 64).astype(np.float32) * 0.1
+    for n, h, w in rng.randint(0, 56, size=(4, 3)):
+        frames[n % 2, h:h + 8, w:w + 8] = 1.0
+    return frames
+
+
+@pytest.mark.parametrize('window', [1, 3, 7, 16, 20])
+def test_running_max_1d(window):
+    arr = np.random.RandomState(0).rand(3, 20, 5)
+    output = running_max_1d(arr, window, axis=1)
+    expected = np.stack([arr[:, i:i + window].max(axis=1) for i in range(20 - window + 1)], axis=1)
+    assert np.array_equal(output, expected)
+
+
+@pytest.mark.parametrize('window', [1, 5, 16])
+def test_compute_max(window):
+    frames = get_frames(0)
+    assert np.array_equal(get_fetcher(frames).compute_max(window), brute_force_max(frames, window))
+
+
+def test_cache(tmp_path):
+    frames = get_frames(0)
+    idx_list = get_fetcher(frames, cache_dir=str(tmp_path), cache_key='a')._idx_list
+    assert len(os.listdir(tmp_path)) == 1
+
+    # same key: the empty indices are loaded, even though the frames differ.
+    other_frames = get_frames(1)
+    expected = get_fetcher(other_frames)._idx_list
+    assert not np.array_equal(idx_list, expected)
+    assert np.array_equal(get_fetcher(other_frames, cache_dir=str(tmp_path), cache_key='a')._idx_list, idx_list)
+
+    # another key is a miss.
+    assert np.array_equal(get_fetcher(other_frames, cache_dir=str(tmp_path), cache_key='b')._idx_list, expected)
+    assert len(os.listdir(tmp_path)) == 2
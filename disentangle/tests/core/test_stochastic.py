@@ -0,0 +1,37 @@
+import torch
+
+import pytest
+from disentangle.core.stochastic import NormalStochasticBlock
+from disentangle.core.stochastic_mode import StochasticMode
+
+
+def run_block(stochastic_mode, mode_pred=False, analytical_kl=False):
+    torch.manual_seed(0)
+    block = NormalStochasticBlock(8, 4, 8, stochastic_mode=stochastic_mode)
+    p_params = torch.randn(3, 8, 16, 16)
+    q_params = torch.randn(3, 8, 16, 16)
+    return block(p_params, q_params=q_params, mode_pred=mode_pred, analytical_kl=analytical_kl)
+
+
+@pytest.mark.parametrize('analytical_kl', [False, True])
+def test_lean_mode_only_computes_the_loss_kl(analytical_kl):
+    out, data = run_block(StochasticMode.Full, analytical_kl=analytical_kl)
+    lean_out, lean_data = run_block(StochasticMode.Lean, analytical_kl=analytical_kl)
+    assert torch.equal(out, lean_out)
+    assert torch.equal(data['z'], lean_data['z'])
+    assert torch.equal(data['kl_samplewise'], lean_data['kl_samplewise'])
+    for key in ['kl_elementwise', 'kl_spatial', 'kl_channelwise', 'logprob_q', 'qvar_max']:
+        assert data[key] is not None
+        assert lean_data[key] is None
+
+    # the diagnostic can be computed from q_params later.
+    _, q_lv = lean_data['q_params']
+    assert torch.equal(torch.max(q_lv.get()), data['qvar_max'])
+
+
+def test_inference_mode_skips_kl():
+    out, data = run_block(StochasticMode.Full, mode_pred=True)
+    inference_out, inference_data = run_block(StochasticMode.Inference)
+    assert torch.equal(out, inference_out)
+    for key in ['kl_samplewise', 'kl_spatial', 'kl_channelwise', 'logprob_q', 'qvar_max']:
+        assert inference_data[key] is None
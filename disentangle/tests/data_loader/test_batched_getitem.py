@@ -0,0 +1,103 @@
+import numpy as np
+
+import disentangle.data_loader.vanilla_dloader as vanilla_dloader
+import ml_collections
+import pytest
+from disentangle.core.data_split_type import DataSplitType
+from disentangle.data_loader.patch_index_manager import TilingMode
+from disentangle.data_loader.vanilla_dloader import MultiChDloader
+
+
+def get_dset(monkeypatch,
+             tiling_mode,
+             enable_random_cropping=False,
+             enable_rotation_aug=False,
+             normalized_input=True,
+             **config):
+    data = (np.random.RandomState(0).rand(3, 40, 44, 2) * 1000).astype(np.uint16)
+    monkeypatch.setattr(vanilla_dloader, 'get_train_val_data', lambda *args, **kwargs: data.copy())
+    data_config = ml_collections.ConfigDict({
+        'image_size': 16,
+        'num_channels': 2,
+        'multiscale_lowres_count': None,
+        'target_separate_normalization': True,
+        'clip_percentile': 0.99,
+        **config,
+    })
+    padding_kwargs = {'mode': 'reflect'} if tiling_mode == TilingMode.PadBoundary else None
+    dset = MultiChDloader(data_config,
+                          '/dummy/datadir',
+                          DataSplitType.Train,
+                          val_fraction=0.1,
+                          test_fraction=0.1,
+                          normalized_input=normalized_input,
+                          enable_random_cropping=enable_random_cropping,
+                          enable_rotation_aug=enable_rotation_aug,
+                          use_one_mu_std=True,
+                          tiling_mode=tiling_mode,
+                          overlapping_padding_kwargs=padding_kwargs)
+    dset.set_img_sz(16, 8 if tiling_mode == TilingMode.PadBoundary else 16)
+    mean, std = dset.compute_mean_std()
+    dset.set_mean_std(mean, std)
+    return dset
+
+
+@pytest.mark.parametrize('tiling_mode', [TilingMode.ShiftBoundary, TilingMode.PadBoundary])
+@pytest.mark.parametrize('config', [{}, {'input_is_sum': True}, {'return_index': True, 'target_idx_list': [1]}])
+def test_get_batch_is_same_as_getitem(monkeypatch, tiling_mode, config):
+    dset = get_dset(monkeypatch, tiling_mode, **config)
+    assert dset.batched_fetch_supported()
+    indices = np.arange(len(dset))[::-1]
+    batch = dset.get_batch(indices)
+    assert batch[0].dtype == np.float32 and batch[0].shape == (len(indices), 1, 16, 16)
+    for i, index in enumerate(indices):
+        sample = dset[int(index)]
+        assert len(sample) == len(batch)
+        for arr, batch_arr in zip(sample, batch):
+            assert np.array_equal(arr, batch_arr[i])
+
+    samples = dset.__getitems__(list(indices[:4]))
+    for i, sample in enumerate(samples):
+        assert np.array_equal(sample[1], batch[1][i])
+
+
+@pytest.mark.parametrize('normalized_input', [None, False])
+def test_get_batch_normalized_input(monkeypatch, normalized_input):
+    dset = get_dset(monkeypatch, TilingMode.ShiftBoundary, normalized_input=normalized_input)
+    indices = np.arange(len(dset))
+    batch = dset.get_batch(indices)
+    expected = [dset[int(i)] for i in indices]
+    for i in indices:
+        assert np.array_equal(batch[0][i], expected[i][0])
+        assert np.array_equal(batch[1][i], expected[i][1])
+
+
+def test_get_batch_with_random_cropping(monkeypatch):
+    dset = get_dset(monkeypatch, TilingMode.ShiftBoundary, enable_random_cropping=True)
+    np.random.seed(0)
+    inp, target = dset.get_batch(np.arange(8))
+    assert inp.shape == (8, 1, 16, 16) and target.shape == (8, 2, 16, 16)
+    # every target patch is a crop of its frame.
+    data = dset._data
+    for i, frame_idx in enumerate(dset.idx_manager.get_patch_location_from_dataset_idx_arr(np.arange(8))[:, 0]):
+        windows = np.lib.stride_tricks.sliding_window_view(data[frame_idx, ..., 0], (16, 16))
+        assert np.any(np.all(windows == target[i, 0], axis=(2, 3)))
+
+
+def test_get_batch_with_rotation(monkeypatch):
+    dset = get_dset(monkeypatch, TilingMode.ShiftBoundary)
+    inp, target = dset.get_batch(np.arange(len(dset)))
+    rot_dset = get_dset(monkeypatch, TilingMode.ShiftBoundary, enable_rotation_aug=True)
+    assert rot_dset.batched_fetch_supported()
+    rot_inp, rot_target = rot_dset.get_batch(np.arange(len(dset)))
+    for i in range(len(dset)):
+        for k in range(4):
+            for flip in [False, True]:
+                if np.array_equal(rot_target[i], np.rot90(target[i, ..., ::-1] if flip else target[i], k, axes=(1, 2))):
+                    assert np.array_equal(rot_inp[i], np.rot90(inp[i, ..., ::-1] if flip else inp[i], k, axes=(1, 2)))
+                    break
+            else:
+                continue
+            break
+        else:
+            assert False, f'patch {i} is not a flip/rotation of the original patch'
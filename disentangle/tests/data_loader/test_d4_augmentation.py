@@ -0,0 +1,42 @@
+import numpy as np
+import torch
+
+from disentangle.data_loader.d4_augmentation import D4Augmentation, apply_d4, sample_d4_params
+
+
+def d4_images(img):
+    """
+    All 8 flips/rotations of img, along the last two axes.
+    """
+    return [np.rot90(x, k, axes=(-2, -1)) for x in [img, img[..., ::-1]] for k in range(4)]
+
+
+def test_apply_d4_transforms_every_sample():
+    x = np.random.RandomState(0).rand(32, 2, 3, 8, 8).astype(np.float32)
+    params = sample_d4_params(len(x), flip_z=True, rng=np.random.RandomState(1))
+    output = apply_d4(x, *params)
+    torch_output = apply_d4(torch.from_numpy(x), *params)
+    assert np.array_equal(output, torch_output.numpy())
+
+    rot_k, hflip, zflip = params
+    assert len(np.unique(rot_k * 4 + hflip * 2 + zflip)) > 8
+    for i in range(len(x)):
+        img = x[i, :, ::-1] if zflip[i] else x[i]
+        img = img[..., ::-1] if hflip[i] else img
+        assert np.array_equal(output[i], np.rot90(img, rot_k[i], axes=(-2, -1)))
+
+
+def test_d4_augmentation_is_same_for_all_arrays():
+    inp = torch.rand(16, 1, 8, 8)
+    target = torch.cat([inp, 2 * inp], dim=1)
+    augmentation = D4Augmentation(seed=0)
+    aug_inp, aug_target = augmentation(inp, target)
+    assert torch.equal(aug_target[:, :1], aug_inp)
+    assert torch.equal(aug_target[:, 1:], 2 * aug_inp)
+
+    samples = [(inp[i].numpy(), target[i].numpy(), i) for i in range(len(inp))]
+    aug_inp, aug_target, index = augmentation.collate(samples)
+    assert torch.equal(index, torch.arange(len(inp)))
+    for i in range(len(inp)):
+        assert any(np.array_equal(aug_inp[i].numpy(), img) for img in d4_images(inp[i].numpy()))
+        assert torch.equal(aug_target[i, :1], aug_inp[i])
@@ -0,0 +1,90 @@
+import os
+import pickle
+from multiprocessing.reduction import ForkingPickler
+
+import numpy as np
+import torch.multiprocessing  # registers the reduction of shared tensors with ForkingPickler
+
+import ml_collections
+from disentangle.data_loader.d4_augmentation import D4Augmentation
+from disentangle.data_loader.data_pipeline import (MIN_SHARED_BYTES, MappedArray, SharedArray, get_dataloader_kwargs,
+                                                   share_dataset_memory)
+
+
+class DummyDset:
+
+    def __init__(self, data, small, inner=None):
+        self._data = data
+        self._small = small
+        self._inner = inner
+
+
+def test_shared_array_is_pickled_as_handle():
+    array = np.random.rand(512, 512).astype(np.float32)
+    shared = SharedArray.from_array(array)
+    assert np.array_equal(shared, array)
+    payload = bytes(ForkingPickler.dumps(shared))
+    assert len(payload) < array.nbytes // 100
+    restored = pickle.loads(payload)
+    assert np.array_equal(restored, array)
+    # views are pickled by value.
+    view = shared[:10]
+    assert np.array_equal(pickle.loads(pickle.dumps(view)), array[:10])
+
+
+def test_share_dataset_memory():
+    inner = DummyDset(np.ones(MIN_SHARED_BYTES, dtype=np.uint8), np.ones(10))
+    dset = DummyDset(np.zeros((256, 1024), dtype=np.float32), np.ones(10), inner=inner)
+    nbytes = share_dataset_memory(dset)
+    assert nbytes == dset._data.nbytes + inner._data.nbytes
+    assert isinstance(dset._data, SharedArray) and isinstance(inner._data, SharedArray)
+    assert not isinstance(dset._small, SharedArray)
+    # already shared.
+    assert share_dataset_memory(dset) == 0
+
+
+def test_memmap_is_pickled_by_path(tmp_path):
+    fpath = str(tmp_path / 'data.npy')
+    array = np.random.rand(256, 1024).astype(np.float32)
+    np.save(fpath, array)
+    dset = DummyDset(np.load(fpath, mmap_mode='r'), np.ones(10))
+    # memmaps do not take shared memory.
+    assert share_dataset_memory(dset) == 0
+    assert isinstance(dset._data, MappedArray)
+    payload = bytes(ForkingPickler.dumps(dset._data))
+    assert len(payload) < array.nbytes // 100
+    restored = pickle.loads(payload)
+    assert isinstance(restored, MappedArray)
+    assert np.array_equal(restored, array)
+    # views are pickled by value.
+    assert np.array_equal(pickle.loads(pickle.dumps(dset._data[3:5])), array[3:5])
+
+
+def test_unlinked_memmap_is_shared(tmp_path):
+    fpath = str(tmp_path / 'data.npy')
+    array = np.random.rand(256, 1024).astype(np.float32)
+    np.save(fpath, array)
+    dset = DummyDset(np.load(fpath, mmap_mode='r+'), np.ones(10))
+    os.remove(fpath)
+    assert share_dataset_memory(dset) == array.nbytes
+    assert isinstance(dset._data, SharedArray)
+    assert np.array_equal(pickle.loads(ForkingPickler.dumps(dset._data)), array)
+
+
+def test_get_dataloader_kwargs():
+    config = ml_collections.ConfigDict({'training': {'num_workers': 2}, 'dataloader': {'prefetch_factor': 4}})
+    kwargs = get_dataloader_kwargs(config)
+    assert kwargs['num_workers'] == 2
+    assert kwargs['prefetch_factor'] == 4
+    assert kwargs['persistent_workers'] is False
+    assert kwargs['pin_memory'] is False
+    assert 'worker_init_fn' not in kwargs
+
+    kwargs = get_dataloader_kwargs(config, num_workers=0)
+    assert 'prefetch_factor' not in kwargs and 'persistent_workers' not in kwargs
+
+
+def test_d4_augmentation_is_picklable():
+    augmentation = pickle.loads(pickle.dumps(D4Augmentation()))
+    x = np.random.rand(4, 1, 8, 8).astype(np.float32)
+    assert augmentation(x)[0].shape == x.shape
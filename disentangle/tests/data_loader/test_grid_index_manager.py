@@ -0,0 +1,23 @@
+import numpy as np
+
+import pytest
+from disentangle.data_loader.patch_index_manager import GridIndexManager, TilingMode
+
+
+@pytest.mark.parametrize('tiling_mode', [TilingMode.ShiftBoundary, TilingMode.TrimBoundary, TilingMode.PadBoundary])
+@pytest.mark.parametrize('data_shape,grid_shape,patch_shape', [((3, 130, 131, 2), (1, 32, 32, 2), (1, 64, 64, 2)),
+                                                                ((2, 7, 64, 70, 2), (1, 1, 8, 8, 2), (1, 3, 16, 16, 2))])
+def test_bulk_lookups_match_scalar_lookups(tiling_mode, data_shape, grid_shape, patch_shape):
+    manager = GridIndexManager(data_shape, grid_shape, patch_shape, tiling_mode)
+    idx_arr = np.arange(manager.total_grid_count())
+
+    locations = manager.get_location_from_dataset_idx_arr(idx_arr)
+    assert locations.shape == (len(idx_arr), len(data_shape))
+    for i in idx_arr[::7]:
+        assert tuple(locations[i]) == manager.get_location_from_dataset_idx(i)
+        assert tuple(manager.get_patch_location_from_dataset_idx_arr([i])[0]) == manager.get_patch_location_from_dataset_idx(i)
+        for dim in range(len(data_shape)):
+            assert manager.on_boundary_arr([i], dim)[0] == manager.on_boundary(i, dim)
+            assert manager.on_boundary_arr([i], dim, only_end=True)[0] == manager.on_boundary(i, dim, only_end=True)
+
+    assert (manager.get_dataset_idx_from_grid_location_arr(locations) == idx_arr).all()
@@ -0,0 +1,86 @@
+import numpy as np
+
+import disentangle.data_loader.multifile_dset as multifile_dset
+import ml_collections
+import pytest
+from disentangle.core.data_split_type import DataSplitType
+from disentangle.data_loader.index_routing import get_offsets, group_indices, route_indices
+from disentangle.data_loader.multifile_dset import MultiFileDset
+from disentangle.data_loader.multifile_raw_dloader import MultiChannelData, TwoChannelData
+
+
+def test_route_indices():
+    offsets = get_offsets([3, 0, 2, 5])
+    dset_idx, rel_idx = route_indices(offsets, np.arange(10))
+    assert dset_idx.tolist() == [0, 0, 0, 2, 2, 3, 3, 3, 3, 3]
+    assert rel_idx.tolist() == [0, 1, 2, 0, 1, 0, 1, 2, 3, 4]
+    assert route_indices(offsets, 4) == (2, 1)
+    for idx in [-1, 10]:
+        with pytest.raises(IndexError):
+            route_indices(offsets, idx)
+
+
+def test_group_indices():
+    offsets = get_offsets([3, 2, 5])
+    indices = [9, 0, 4, 5, 2]
+    groups = group_indices(offsets, indices)
+    assert [g[0] for g in groups] == [0, 1, 2]
+    for dset_idx, positions, rel_idx in groups:
+        for pos, rel in zip(positions, rel_idx):
+            assert route_indices(offsets, indices[pos]) == (dset_idx, rel)
+
+
+def test_raw_data_routing():
+    arrays = [np.random.rand(n, 4, 4) for n in [2, 5, 1]]
+    data = TwoChannelData(arrays, [-x for x in arrays], paths_data1=['a0', 'a1', 'a2'], paths_data2=['b0', 'b1', 'b2'])
+    frames = np.concatenate(arrays)
+    assert len(data) == len(frames)
+    indices = [7, 0, 3, 2]
+    for (frame, paths), idx in zip(data.get_items(indices), indices):
+        assert np.array_equal(frame, data[idx][0]) and paths == data[idx][1]
+        assert np.array_equal(frame[..., 0], frames[idx])
+    assert data[7][1] == ('a2', 'b2')
+
+    data = MultiChannelData([x[..., None] for x in arrays])
+    assert len(list(data)) == len(frames)
+    assert data.get_items([3])[0][1] is None
+
+
+def get_multifile_dset(monkeypatch):
+    rng = np.random.RandomState(0)
+    data = [((rng.rand(1, sz, sz, 2) * 1000).astype(np.float32), f'file{i}') for i, sz in enumerate([32, 48, 40])]
+    monkeypatch.setattr(multifile_dset, 'get_train_val_data', lambda *args, **kwargs: data)
+    data_config = ml_collections.ConfigDict({
+        'image_size': 16,
+        'num_channels': 2,
+        'multiscale_lowres_count': None,
+        'target_separate_normalization': True,
+        'clip_percentile': 0.99,
+    })
+    dset = MultiFileDset(data_config,
+                         '/dummy/datadir',
+                         DataSplitType.Train,
+                         val_fraction=0.1,
+                         test_fraction=0.1,
+                         normalized_input=True,
+                         use_one_mu_std=True)
+    mean, std = dset.compute_mean_std()
+    dset.set_mean_std(mean, std)
+    return dset
+
+
+def test_multifile_dset_routing(monkeypatch):
+    dset = get_multifile_dset(monkeypatch)
+    assert len(dset) == sum(len(d) for d in dset.dsets)
+    dset.set_img_sz(16, 8)
+    assert len(dset) == sum(len(d) for d in dset.dsets)
+
+    indices = np.random.RandomState(1).permutation(len(dset))[:20].tolist()
+    for sample, idx in zip(dset.__getitems__(indices), indices):
+        dset_idx, rel_idx = dset.get_dset_idx(idx)
+        expected = dset.dsets[dset_idx][int(rel_idx)]
+        assert len(sample) == len(expected)
+        for x, y in zip(sample, expected):
+            assert np.allclose(x, y)
+    with pytest.raises(IndexError):
+        dset[len(dset)]
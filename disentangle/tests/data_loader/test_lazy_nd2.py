@@ -0,0 +1,117 @@
+import os
+
+import numpy as np
+
+import dask.array as da
+import disentangle.data_loader.elisa3D_rawdata_loader as elisa_loader
+import disentangle.data_loader.lazy_nd2 as lazy_nd2
+import disentangle.data_loader.nikola_7D_rawdata_loader as nikola_loader
+import ml_collections
+import pytest
+from disentangle.core.data_split_type import DataSplitType, get_datasplit_tuples
+from disentangle.data_loader.lazy_nd2 import get_nd2_sizes, read_nd2_subset
+
+
+class RecordingArray:
+    """
+    Array-like which records the frames (indices of the leading axes) which are read from it.
+    """
+
+    def __init__(self, data, num_frame_axes):
+        self._data = data
+        self._num_frame_axes = num_frame_axes
+        self.shape = data.shape
+        self.dtype = data.dtype
+        self.ndim = data.ndim
+        self.read_frames = set()
+
+    def __getitem__(self, key):
+        output = self._data[key]
+        ranges = [range(*k.indices(n)) for k, n in zip(key[:self._num_frame_axes], self.shape)]
+        for frame in np.ndindex(*[len(r) for r in ranges]):
+            self.read_frames.add(tuple(r[i] for r, i in zip(ranges, frame)))
+        return output
+
+
+FILES = {}
+
+
+class FakeND2File:
+
+    def __init__(self, fpath):
+        self.sizes, self._array = FILES[os.path.basename(fpath)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def to_dask(self):
+        num_frame_axes = len(self.sizes) - 2
+        chunks = (1, ) * num_frame_axes + self._array.shape[num_frame_axes:]
+        return da.from_array(self._array, chunks=chunks)
+
+
+def add_file(fname, sizes, seed=0):
+    data = np.random.RandomState(seed).randint(0, 1000, size=tuple(sizes.values())).astype(np.uint16)
+    FILES[fname] = (sizes, RecordingArray(data, len(sizes) - 2))
+    return data
+
+
+@pytest.fixture(autouse=True)
+def fake_nd2(monkeypatch):
+    FILES.clear()
+    monkeypatch.setattr(lazy_nd2.nd2, 'ND2File', FakeND2File)
+
+
+def test_read_nd2_subset():
+    data = add_file('a.nd2', {'P': 5, 'Z': 6, 'C': 3, 'Y': 8, 'X': 8})
+    assert get_nd2_sizes('a.nd2') == {'T': 1, 'P': 5, 'Z': 6, 'C': 3, 'Y': 8, 'X': 8, 'S': 1}
+
+    subset = read_nd2_subset('a.nd2', P=[3, 1], Z=slice(2, 4), C=2, T=0)
+    assert subset.shape == (1, 2, 2, 1, 8, 8, 1)
+    assert np.array_equal(subset[0, :, :, 0, :, :, 0], data[[3, 1]][:, 2:4, 2])
+    # only the frames of the selected positions, Z planes and channels are read.
+    assert FILES['a.nd2'][1].read_frames == {(p, z, 2) for p in [1, 3] for z in [2, 3]}
+
+
+def test_nikola_split_reads_only_the_split(monkeypatch):
+    fnames = ['uSplit_14022025_highSNR.nd2', 'uSplit_20022025_highSNR.nd2', 'uSplit_20022025_001_highSNR.nd2']
+    monkeypatch.setattr(nikola_loader, 'get_raw_files_dict', lambda: {'high': fnames})
+    full = []
+    for i, fname in enumerate(fnames):
+        data = add_file(fname, {'P': 20, 'C': 5, 'Y': 4, 'X': 4}, seed=i)
+        # the reference: all channels of all positions, then the selection of channel_list and valid positions.
+        data = np.moveaxis(data[:, [1, 3]], 1, -1)
+        valid = nikola_loader.get_valid_positions(fname)
+        full.append(data[valid])
+    full = np.concatenate(full, axis=0).astype(np.float32)
+    assert len(full) == 60 - 3
+
+    config = ml_collections.ConfigDict({'dset_type': 'high', 'channel_idx_list': [1, 3], 'load_num_workers': 2})
+    _, val_idx, _ = get_datasplit_tuples(0.1, 0.1, len(full))
+    val = nikola_loader.get_train_val_data('', config, DataSplitType.Val, val_fraction=0.1, test_fraction=0.1)
+    assert np.array_equal(val, full[val_idx])
+    read_positions = set(frame[0] for _, array in FILES.values() for frame in array.read_frames)
+    assert len(read_positions) < 20
+
+    all_data = nikola_loader.get_train_val_data('', config, DataSplitType.All, val_fraction=0.1, test_fraction=0.1)
+    assert np.array_equal(all_data, full)
+
+    # an empty split.
+    test = nikola_loader.get_train_val_data('', config, DataSplitType.Test, val_fraction=0.1, test_fraction=0.0)
+    assert test.shape == (0, 4, 4, 2)
+
+
+def test_elisa_split(monkeypatch):
+    monkeypatch.setattr(elisa_loader, 'datafiles', lambda: ['a.nd2'])
+    data = add_file('a.nd2', {'P': 10, 'Z': 8, 'C': 3, 'Y': 4, 'X': 4})
+    config = ml_collections.ConfigDict({'zstart': 2, 'zstop': 6, 'channel_idx_list': [0, 2]})
+    train = elisa_loader.get_train_val_data('', config, DataSplitType.Train, val_fraction=0.2, test_fraction=0.2)
+
+    idx_list = np.random.RandomState(955).permutation(10)
+    train_idx = idx_list[get_datasplit_tuples(0.2, 0.2, 10)[0]]
+    expected = np.transpose(data[train_idx][:, 2:6][:, :, [0, 2]], (0, 1, 3, 4, 2)).astype(np.float32)
+    assert np.array_equal(train, expected)
+    assert set(frame[0] for frame in FILES['a.nd2'][1].read_frames) == set(train_idx)
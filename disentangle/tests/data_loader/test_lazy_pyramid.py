@@ -0,0 +1,85 @@
+import numpy as np
+from skimage.transform import resize
+
+import disentangle.data_loader.vanilla_dloader as vanilla_dloader
+import ml_collections
+import pytest
+from disentangle.core.data_split_type import DataSplitType
+from disentangle.data_loader.lazy_pyramid import LazyPyramid
+from disentangle.data_loader.lc_multich_dloader import LCMultiChDloader
+from disentangle.data_loader.patch_index_manager import TilingMode
+
+
+@pytest.mark.parametrize('dtype', [np.int32, np.float32])
+def test_lazy_pyramid_is_same_as_resize(dtype):
+    rng = np.random.RandomState(0)
+    data = (rng.rand(2, 64, 96, 2) * 1000).astype(dtype)
+    levels = [data]
+    for _ in range(3):
+        shape = levels[-1].shape
+        new_shape = (shape[0], shape[1] // 2, shape[2] // 2, shape[3])
+        levels.append(resize(levels[-1].astype(np.float32), new_shape).astype(dtype))
+
+    pyramid = LazyPyramid(data, 4)
+    for level in range(4):
+        H, W = levels[level].shape[1:3]
+        assert pyramid.shape(level) == levels[level].shape
+        for _ in range(20):
+            h0, w0 = rng.randint(H), rng.randint(W)
+            h1, w1 = rng.randint(h0 + 1, H + 1), rng.randint(w0 + 1, W + 1)
+            window = pyramid.get_window(level, 1, (h0, h1), (w0, w1))
+            assert window.dtype == dtype
+            assert np.array_equal(window, levels[level][1, h0:h1, w0:w1])
+
+
+def get_dset(monkeypatch, lazy_lowres_pyramid, enable_random_cropping):
+    data = (np.random.RandomState(0).rand(3, 64, 64, 2) * 1000).astype(np.uint16)
+    monkeypatch.setattr(vanilla_dloader, 'get_train_val_data', lambda *args, **kwargs: data.copy())
+    data_config = ml_collections.ConfigDict({
+        'image_size': 16,
+        'num_channels': 2,
+        'multiscale_lowres_count': 3,
+        'target_separate_normalization': True,
+        'background_quantile': 0.1,
+        'clip_percentile': 0.99,
+        'lazy_lowres_pyramid': lazy_lowres_pyramid,
+    })
+    dset = LCMultiChDloader(data_config,
+                            '/dummy/datadir',
+                            DataSplitType.Train,
+                            val_fraction=0.1,
+                            test_fraction=0.1,
+                            normalized_input=True,
+                            use_one_mu_std=True,
+                            num_scales=3,
+                            enable_random_cropping=enable_random_cropping,
+                            padding_kwargs={'mode': 'reflect'},
+                            tiling_mode=TilingMode.PadBoundary)
+    dset.set_img_sz(16, 8)
+    mean, std = dset.compute_mean_std()
+    dset.set_mean_std(mean, std)
+    return dset
+
+
+@pytest.mark.parametrize('enable_random_cropping', [False, True])
+def test_lazy_lc_dloader_is_same_as_eager(monkeypatch, enable_random_cropping):
+    dset = get_dset(monkeypatch, False, enable_random_cropping)
+    lazy_dset = get_dset(monkeypatch, True, enable_random_cropping)
+    assert isinstance(lazy_dset._scaled_data, LazyPyramid)
+    for idx in [0, 5, len(dset) // 2, len(dset) - 1]:
+        np.random.seed(idx)
+        sample = dset[idx]
+        np.random.seed(idx)
+        lazy_sample = lazy_dset[idx]
+        for arr, lazy_arr in zip(sample, lazy_sample):
+            assert np.array_equal(arr, lazy_arr)
+
+
+def test_lazy_lc_dloader_downsamples_once(monkeypatch):
+    dset = get_dset(monkeypatch, True, True)
+    calls = []
+    get_windows = dset._scaled_data.get_windows
+    monkeypatch.setattr(dset._scaled_data, 'get_windows', lambda *args: calls.append(args) or get_windows(*args))
+    dset[0]
+    # all the lowres scales come from one call.
+    assert len(calls) == 1 and sorted(calls[0][1]) == [1, 2]
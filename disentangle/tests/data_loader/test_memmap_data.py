@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+
+import disentangle.data_loader.memmap_data as memmap_data
+import disentangle.data_loader.vanilla_dloader as vanilla_dloader
+import ml_collections
+from disentangle.core.data_split_type import DataSplitType
+from disentangle.data_loader.vanilla_dloader import MultiChDloader
+
+
+def get_dset(data_config):
+    return MultiChDloader(data_config,
+                          '/dummy/datadir',
+                          DataSplitType.Train,
+                          val_fraction=0.1,
+                          test_fraction=0.1,
+                          normalized_input=True,
+                          use_one_mu_std=True)
+
+
+def test_memmap_dloader_matches_in_memory_dloader(tmp_path, monkeypatch):
+    data = (np.random.RandomState(0).rand(4, 64, 64, 2) * 1000).astype(np.uint16)
+    load_count = []
+
+    def get_train_val_data(*args, **kwargs):
+        load_count.append(1)
+        return data.copy()
+
+    monkeypatch.setattr(vanilla_dloader, 'get_train_val_data', get_train_val_data)
+    monkeypatch.setattr(memmap_data, 'get_train_val_data', get_train_val_data)
+
+    data_config = ml_collections.ConfigDict({
+        'image_size': 16,
+        'num_channels': 2,
+        'multiscale_lowres_count': None,
+        'target_separate_normalization': True,
+        'background_quantile': 0.1,
+        'clip_percentile': 0.99,
+    })
+    dset = get_dset(data_config)
+    data_config.memmap_dir = str(tmp_path)
+    memmap_dset = get_dset(data_config)
+    # the raw data is converted only once.
+    memmap_dset = get_dset(data_config)
+    assert len(load_count) == 2
+    assert isinstance(memmap_dset._data, np.memmap)
+
+    assert np.array_equal(dset._data, memmap_dset._data)
+    assert dset.get_max_val() == memmap_dset.get_max_val()
+    mean, std = dset.compute_mean_std()
+    dset.set_mean_std(mean, std)
+    memmap_dset.set_mean_std(mean, std)
+    for idx in [0, 7, len(dset) - 1]:
+        for arr, memmap_arr in zip(dset[idx], memmap_dset[idx]):
+            assert np.array_equal(arr, memmap_arr)
+
+
+def test_cache_key_ignores_non_data_keys():
+    data_config = ml_collections.ConfigDict({'image_size': 16, 'channel_idx_list': [0, 1]})
+    key = memmap_data.get_cache_key(data_config, '/dummy/datadir', DataSplitType.Train, 0.1, 0.1)
+    for name, value in [('empty_patch_cache_dir', '/tmp'), ('lazy_lowres_pyramid', True), ('load_num_workers', 8),
+                        ('load_backend', 'process'), ('load_memory_budget_gb', 2.0)]:
+        other_config = ml_collections.ConfigDict(data_config.to_dict())
+        other_config[name] = value
+        assert memmap_data.get_cache_key(other_config, '/dummy/datadir', DataSplitType.Train, 0.1, 0.1) == key
+
+    data_config.channel_idx_list = [1, 0]
+    assert memmap_data.get_cache_key(data_config, '/dummy/datadir', DataSplitType.Train, 0.1, 0.1) != key
+
+
+def test_memmap_working_copy_is_cached(tmp_path, monkeypatch):
+    data = (np.random.RandomState(0).rand(4, 64, 64, 2) * 1000).astype(np.uint16)
+    monkeypatch.setattr(memmap_data, 'get_train_val_data', lambda *args, **kwargs: data.copy())
+    data_config = ml_collections.ConfigDict({
+        'image_size': 16,
+        'num_channels': 2,
+        'multiscale_lowres_count': None,
+        'target_separate_normalization': True,
+        'background_quantile': 0.1,
+        'clip_percentile': 0.99,
+        'memmap_dir': str(tmp_path),
+    })
+    copies = []
+    create_working_copy = vanilla_dloader.PreprocessingCache.create_working_copy
+
+    def counted_create_working_copy(*args, **kwargs):
+        copies.append(1)
+        return create_working_copy(*args, **kwargs)
+
+    monkeypatch.setattr(vanilla_dloader.PreprocessingCache, 'create_working_copy', counted_create_working_copy)
+    dset = get_dset(data_config)
+    other_dset = get_dset(data_config)
+    # the preprocessed working copy is the cache entry: it is made only once, and no temporary file is left.
+    assert len(copies) == 1
+    assert len(os.listdir(tmp_path)) == 3
+    assert other_dset._preprocessing_cache_hit
+    assert np.array_equal(dset._data, other_dset._data)
+    assert dset.get_max_val() == other_dset.get_max_val()
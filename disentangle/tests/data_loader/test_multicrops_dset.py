@@ -0,0 +1,52 @@
+import numpy as np
+
+import disentangle.data_loader.multicrops_dset as multicrops_dset
+import ml_collections
+from disentangle.core.data_split_type import DataSplitType
+from disentangle.data_loader.multicrops_dset import MultiCropDset
+
+
+def get_dset(monkeypatch, enable_rotation_aug=False):
+    rng = np.random.RandomState(0)
+    data_arr = [
+        # the 10x10 image is too small for a crop.
+        [rng.gamma(2, 10, size=(40, 60)), rng.gamma(2, 30, size=(64, 48)), rng.rand(10, 10)],
+        [rng.normal(100, 5, size=(50, 50)), rng.normal(50, 20, size=(80, 32))],
+    ]
+    monkeypatch.setattr(multicrops_dset, 'get_train_val_data', lambda *args, **kwargs: data_arr)
+    data_config = ml_collections.ConfigDict({'image_size': 16, 'input_is_sum': True})
+    dset = MultiCropDset(data_config, '/dummy/datadir', DataSplitType.Train, enable_rotation_aug=enable_rotation_aug)
+    return dset, data_arr
+
+
+def test_compute_mean_std_is_exact(monkeypatch):
+    dset, data_arr = get_dset(monkeypatch)
+    mean, std = dset.compute_mean_std()
+    assert mean['target'].shape == (1, 2, 1, 1) and mean['input'].shape == (1, 1, 1, 1)
+    pixels = [np.concatenate([x.reshape(-1) for x in imgs if min(x.shape) >= 16]) for imgs in data_arr]
+    assert np.allclose(mean['target'].reshape(-1), [np.mean(x) for x in pixels])
+    assert np.allclose(std['target'].reshape(-1), [np.std(x) for x in pixels])
+    assert np.isclose(mean['input'].item(), sum(np.mean(x) for x in pixels))
+    assert np.isclose(std['input'].item(), np.sqrt(sum(np.var(x) for x in pixels)))
+
+
+def test_sampled_mean_std_is_close(monkeypatch):
+    dset, _ = get_dset(monkeypatch)
+    mean, std = dset.compute_mean_std()
+    sampled_mean, sampled_std = dset.compute_mean_std(num_crops=4000, seed=0)
+    for key in ['target', 'input']:
+        assert np.allclose(sampled_mean[key], mean[key], rtol=0.05)
+        assert np.allclose(sampled_std[key], std[key], rtol=0.1)
+
+
+def test_rotation_aug(monkeypatch):
+    dset, _ = get_dset(monkeypatch, enable_rotation_aug=True)
+    dset.set_mean_std(*dset.compute_mean_std())
+    imgs = [np.arange(256, dtype=np.float64).reshape(16, 16), np.arange(256, dtype=np.float64).reshape(16, 16) * 2]
+    for _ in range(10):
+        rotated = dset._rotate(imgs)
+        # all channels get the same transform, which is one of the 8 of D4.
+        assert np.array_equal(rotated[1], 2 * rotated[0])
+        assert any(np.array_equal(rotated[0], np.rot90(x, k)) for x in [imgs[0], imgs[0][:, ::-1]] for k in range(4))
+    inp, target = dset[0]
+    assert inp.shape == (1, 16, 16) and target.shape == (2, 16, 16)
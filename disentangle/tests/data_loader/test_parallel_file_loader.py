@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+import pytest
+from disentangle.core.file_loading_backend import FileLoadingBackend
+from disentangle.data_loader.parallel_file_loader import load_files
+
+
+def save_files(tmp_path, count):
+    fpaths = []
+    for i in range(count):
+        fpath = str(tmp_path / f'{i}.npy')
+        # later files are smaller, so that they finish first.
+        np.save(fpath, np.full((count - i, 64, 64), i, dtype=np.float32))
+        fpaths.append(fpath)
+    return fpaths
+
+
+@pytest.mark.parametrize('num_workers,backend', [(0, FileLoadingBackend.Thread), (4, FileLoadingBackend.Thread),
+                                                 (2, FileLoadingBackend.Process)])
+def test_load_files_keeps_order(tmp_path, num_workers, backend):
+    fpaths = save_files(tmp_path, 6)
+    data, timings = load_files(np.load, fpaths, num_workers=num_workers, backend=backend, return_timings=True)
+    for i, (x, timing) in enumerate(zip(data, timings)):
+        assert np.all(x == i) and len(x) == 6 - i
+        assert timing['fpath'] == fpaths[i] and timing['nbytes'] == x.nbytes and timing['seconds'] >= 0
+
+
+def test_load_files_memory_budget(tmp_path):
+    fpaths = save_files(tmp_path, 6)
+    lock = threading.Lock()
+    state = {'running': 0, 'max_running': 0}
+
+    def load_fn(fpath):
+        with lock:
+            state['running'] += 1
+            state['max_running'] = max(state['max_running'], state['running'])
+        time.sleep(0.05)
+        with lock:
+            state['running'] -= 1
+        return np.load(fpath)
+
+    # every file is larger than the budget, so they are decoded one at a time.
+    data = load_files(load_fn, fpaths, num_workers=4, memory_budget_gb=1e-6)
+    assert state['max_running'] == 1
+    assert all(np.all(x == i) for i, x in enumerate(data))
+
+    state['max_running'] = 0
+    load_files(load_fn, fpaths, num_workers=4)
+    assert state['max_running'] > 1
+
+
+def test_load_files_memory_budget_before_first_file(tmp_path):
+    fpaths = []
+    for i in range(6):
+        fpath = str(tmp_path / f'{i}.npy')
+        np.save(fpath, np.full((4, 64, 64), i, dtype=np.float32))
+        fpaths.append(fpath)
+    lock = threading.Lock()
+    state = {'running': 0, 'max_running': 0}
+
+    def load_fn(fpath):
+        with lock:
+            state['running'] += 1
+            state['max_running'] = max(state['max_running'], state['running'])
+        time.sleep(0.05)
+        with lock:
+            state['running'] -= 1
+        # decoded, a file is 10 times larger than on disk.
+        return np.repeat(np.load(fpath), 10, axis=0)
+
+    # 4 files fit into the budget by their size on disk, but a decoded file does not fit next to another one.
+    budget_gb = 4 * os.path.getsize(fpaths[0]) / 1e9
+    data = load_files(load_fn, fpaths, num_workers=4, memory_budget_gb=budget_gb)
+    assert state['max_running'] == 1
+    assert all(np.all(x == i) and len(x) == 40 for i, x in enumerate(data))
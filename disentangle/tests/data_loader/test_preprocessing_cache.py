@@ -0,0 +1,99 @@
+import numpy as np
+
+import disentangle.data_loader.vanilla_dloader as vanilla_dloader
+import ml_collections
+from disentangle.core.data_split_type import DataSplitType
+from disentangle.data_loader.vanilla_dloader import MultiChDloader
+
+
+def get_dset(data_config, datasplit_type=DataSplitType.Train, max_val=None):
+    return MultiChDloader(data_config,
+                          '/dummy/datadir',
+                          datasplit_type,
+                          val_fraction=0.1,
+                          test_fraction=0.1,
+                          normalized_input=True,
+                          use_one_mu_std=True,
+                          max_val=max_val)
+
+
+def test_preprocessing_cache(tmp_path, monkeypatch):
+    rng = np.random.RandomState(0)
+    split_data = {
+        DataSplitType.Train: (rng.rand(4, 64, 64, 2) * 1000).astype(np.uint16),
+        DataSplitType.Val: (rng.rand(2, 64, 64, 2) * 1000).astype(np.uint16),
+    }
+    load_count = []
+
+    def get_train_val_data(data_config, fpath, datasplit_type, **kwargs):
+        load_count.append(datasplit_type)
+        return split_data[datasplit_type].copy()
+
+    monkeypatch.setattr(vanilla_dloader, 'get_train_val_data', get_train_val_data)
+    data_config = ml_collections.ConfigDict({
+        'image_size': 16,
+        'num_channels': 2,
+        'multiscale_lowres_count': None,
+        'target_separate_normalization': True,
+        'background_quantile': 0.1,
+        'clip_percentile': 0.99,
+        'preprocessing_cache_dir': str(tmp_path),
+    })
+
+    dsets = []
+    stats = []
+    for _ in range(2):
+        train_dset = get_dset(data_config)
+        val_dset = get_dset(data_config, DataSplitType.Val, max_val=train_dset.get_max_val())
+        mean, std = train_dset.compute_mean_std()
+        dsets.append((train_dset, val_dset))
+        stats.append((mean, std))
+
+    # the second run is served from the cache.
+    assert load_count == [DataSplitType.Train, DataSplitType.Val]
+    (train0, val0), (train1, val1) = dsets
+    assert isinstance(train1._data, np.memmap)
+    assert train0.get_max_val() == train1.get_max_val()
+    assert np.array_equal(train0._background_values, train1._background_values)
+    for dset0, dset1 in [(train0, train1), (val0, val1)]:
+        assert np.array_equal(dset0._data, dset1._data)
+    for key in ['input', 'target']:
+        assert np.array_equal(stats[0][0][key], stats[1][0][key])
+        assert np.array_equal(stats[0][1][key], stats[1][1][key])
+
+    # a different config is a different cache entry.
+    data_config.clip_percentile = 0.98
+    get_dset(data_config)
+    assert load_count[-1] == DataSplitType.Train and len(load_count) == 3
+
+
+def test_preprocessing_matches_numpy(monkeypatch):
+    data = (np.random.RandomState(0).rand(5, 64, 64, 2) * 1000 + 100).astype(np.uint16)
+    monkeypatch.setattr(vanilla_dloader, 'get_train_val_data', lambda *args, **kwargs: data.copy())
+    for channelwise_quantile in [False, True]:
+        data_config = ml_collections.ConfigDict({
+            'image_size': 16,
+            'num_channels': 2,
+            'multiscale_lowres_count': None,
+            'target_separate_normalization': True,
+            'background_quantile': 0.1,
+            'clip_percentile': 0.99,
+            'channelwise_quantile': channelwise_quantile,
+        })
+        dset = get_dset(data_config)
+
+        # the preprocessing with numpy, frame by frame and channel by channel.
+        expected = data.astype(np.int32)
+        background = np.quantile(expected.reshape(5, -1, 2), 0.1, axis=1).astype(np.int64)
+        expected -= background[:, None, None].astype(np.int32)
+        if channelwise_quantile:
+            max_val = [np.quantile(expected[..., c], 0.99) for c in range(2)]
+        else:
+            max_val = np.quantile(expected, 0.99)
+        expected = np.minimum(expected, np.array(max_val).astype(np.int32))
+
+        assert np.array_equal(dset._background_values, background)
+        assert np.array_equal(dset.get_max_val(), max_val)
+        assert np.array_equal(dset._data, expected)
+        mean, std = dset.compute_mean_std()
+        assert np.allclose(mean['input'], expected.mean()) and np.allclose(std['input'], expected.std())
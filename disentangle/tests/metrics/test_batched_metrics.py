@@ -0,0 +1,56 @@
+import numpy as np
+import torch
+from skimage.metrics import structural_similarity
+
+from disentangle.core.psnr import RangeInvariantPsnr
+from disentangle.metrics.batched_metrics import compute_channelwise_scores, ssim_scores
+from torchmetrics.image import MultiScaleStructuralSimilarityIndexMeasure
+
+
+def per_image_scores(gt_list, pred_list):
+    """
+    The image by image evaluation which was used in compute_high_snr_stats.
+    """
+    psnr = [RangeInvariantPsnr(gt_list[i][None] * 1.0, pred_list[i][None] * 1.0).item() for i in range(len(gt_list))]
+    ssim = [
+        structural_similarity(gt_list[i], pred_list[i], data_range=gt_list[i].max() - gt_list[i].min())
+        for i in range(len(gt_list))
+    ]
+    ms_ssim = []
+    for i in range(len(gt_list)):
+        ms_ssim_obj = MultiScaleStructuralSimilarityIndexMeasure(data_range=gt_list[i].max() - gt_list[i].min())
+        ms_ssim.append(ms_ssim_obj(torch.Tensor(pred_list[i][None, None]), torch.Tensor(gt_list[i][None, None])).item())
+    return {'rangeinvpsnr': psnr, 'ssim': ssim, 'msssim': ms_ssim}
+
+
+def test_batched_scores_match_per_image_scores():
+    rng = np.random.RandomState(0)
+    # two shapes, and more images of one shape than the batch size.
+    shapes = [(192, 192)] * 5 + [(256, 224)] * 2
+    gt_channels = []
+    pred_channels = []
+    for _ in range(2):
+        gt_list = [rng.rand(*shape) * 1000 for shape in shapes]
+        pred_list = [(gt + 100 * rng.randn(*gt.shape)).astype(np.float32) for gt in gt_list]
+        gt_channels.append(gt_list)
+        pred_channels.append(pred_list)
+
+    scores = compute_channelwise_scores(gt_channels, pred_channels, metrics=('rangeinvpsnr', 'ssim', 'msssim'),
+                                        batch_size=3)
+    for ch_idx in range(len(gt_channels)):
+        expected = per_image_scores(gt_channels[ch_idx], pred_channels[ch_idx])
+        for metric, expected_scores in expected.items():
+            assert np.array_equal(scores[metric][ch_idx], np.array(expected_scores)), metric
+
+
+def test_ssim_scores_use_the_float_type_of_gt_and_pred():
+    rng = np.random.RandomState(0)
+    gt_list = [(rng.rand(64, 64) * 1000).astype(np.float32) for _ in range(3)]
+    pred_list = [gt + 100 * rng.randn(*gt.shape) for gt in gt_list]
+    scores = ssim_scores(gt_list, pred_list)
+    # float64 pred, so the float32 gt is promoted to float64 instead of rounding pred to float32.
+    expected = [
+        structural_similarity(gt.astype(np.float64), pred, data_range=gt.max() - gt.min())
+        for gt, pred in zip(gt_list, pred_list)
+    ]
+    assert np.array_equal(scores, np.array(expected))
@@ -0,0 +1,58 @@
+import numpy as np
+import torch
+
+import pytest
+from disentangle.nets.gmm_lookup_noise_model import GMMLookupNoiseModel
+from disentangle.nets.gmm_noise_model import GaussianMixtureNoiseModel
+
+
+def per_kernel_likelihood(nmodel, observations, signals):
+    """
+    The per-kernel loop which was used before the kernels were evaluated together.
+    """
+    gaussianParameters = nmodel.getGaussianParameters(signals)
+    p = 0
+    for gaussian in range(nmodel.n_gaussian):
+        p += nmodel.normalDens(observations, gaussianParameters[gaussian],
+                               gaussianParameters[nmodel.n_gaussian + gaussian]) * gaussianParameters[
+                                   2 * nmodel.n_gaussian + gaussian]
+    return p + nmodel.tol
+
+
+def test_stacked_likelihood_matches_per_kernel_likelihood():
+    torch.manual_seed(0)
+    np.random.seed(0)
+    nmodel = GaussianMixtureNoiseModel(min_signal=100.0, max_signal=2000.0, weight=None, n_gaussian=3, n_coeff=3,
+                                       min_sigma=50)
+    signals = 100 + 1900 * torch.rand(2, 1, 32, 32)
+    observations = signals + 100 * torch.randn(2, 1, 32, 32)
+
+    expected = per_kernel_likelihood(nmodel, observations, signals)
+    assert torch.allclose(nmodel.likelihood(observations, signals), expected, rtol=1e-4, atol=1e-12)
+    assert torch.allclose(nmodel.log_likelihood(observations, signals), torch.log(expected), rtol=1e-4, atol=1e-4)
+
+
+def test_lookup_table_matches_gmm():
+    torch.manual_seed(0)
+    np.random.seed(0)
+    nmodel = GaussianMixtureNoiseModel(min_signal=100.0, max_signal=2000.0, weight=None, n_gaussian=3, n_coeff=2,
+                                       min_sigma=400)
+    lut_model = GMMLookupNoiseModel.from_gmm(nmodel, bins=2048)
+    signals = (100 + 1900 * torch.rand(2, 1, 32, 32)).requires_grad_(True)
+    observations = signals.detach() + 50 * torch.randn(2, 1, 32, 32)
+
+    expected = nmodel.log_likelihood(observations, signals)
+    ll = lut_model.log_likelihood(observations, signals)
+    assert torch.allclose(ll, expected, atol=1e-2)
+
+    # differentiable in the signal direction.
+    ll.sum().backward()
+    assert signals.grad.abs().sum() > 0
+
+
+def test_lookup_table_is_not_learnable():
+    nmodel = GaussianMixtureNoiseModel(min_signal=100.0, max_signal=2000.0, weight=None, n_gaussian=3, n_coeff=2,
+                                       min_sigma=400)
+    lut_model = GMMLookupNoiseModel.from_gmm(nmodel, bins=64)
+    with pytest.raises(ValueError):
+        lut_model.make_learnable()
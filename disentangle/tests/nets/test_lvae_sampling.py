@@ -0,0 +1,55 @@
+import torch
+
+import pytest
+from disentangle.configs.biosr_config import get_config
+from disentangle.nets.lvae import LadderVAE
+
+
+def get_model():
+    config = get_config()
+    config.data.image_size = 32
+    config.data.multiscale_lowres_count = None
+    config.model.z_dims = [8, 8]
+    config.model.encoder.n_filters = 8
+    config.model.decoder.n_filters = 8
+    config.model.encoder.blocks_per_layer = 1
+    config.model.decoder.blocks_per_layer = 1
+    config.loss.restricted_kl = False
+    data_mean = {'input': torch.zeros(1, 1, 1, 1), 'target': torch.zeros(1, 2, 1, 1)}
+    data_std = {'input': torch.ones(1, 1, 1, 1), 'target': torch.ones(1, 2, 1, 1)}
+    torch.manual_seed(0)
+    return LadderVAE(data_mean, data_std, config).eval()
+
+
+@pytest.mark.parametrize('samples_per_pass', [1, 2, 4])
+def test_sample_outputs_with_mode_layers(samples_per_pass):
+    model = get_model()
+    # the latents of all layers are fixed to their mode (see _topdown_output), so every sample is the output of forward.
+    model.non_stochastic_version = True
+    x = torch.randn(3, 1, 32, 32)
+    with torch.no_grad():
+        expected = model(x)[0]
+        outputs = list(model.sample_outputs(x, 5, samples_per_pass=samples_per_pass))
+    assert sum(len(out) for out in outputs) == 5 * len(x)
+    for out in outputs:
+        assert len(out) <= samples_per_pass * len(x)
+        out = out.view(-1, *expected.shape)
+        assert torch.allclose(out, expected.expand_as(out), atol=1e-5)
+
+
+@pytest.mark.parametrize('samples_per_pass', [1, 3])
+def test_mmse_prediction(samples_per_pass):
+    model = get_model()
+    x = torch.randn(2, 1, 32, 32)
+    samples = []
+
+    def output_fn(out):
+        pred = model.likelihood.get_mean_lv(out)[0]
+        samples.extend(pred.view(-1, len(x), *pred.shape[1:]))
+        return pred
+
+    mean, std = model.mmse_prediction(x, 7, samples_per_pass=samples_per_pass, output_fn=output_fn)
+    assert len(samples) == 7
+    samples = torch.stack(samples)
+    assert torch.allclose(mean, torch.mean(samples, dim=0), atol=1e-6)
+    assert torch.allclose(std, torch.std(samples, dim=0), atol=1e-5)
@@ -0,0 +1,65 @@
+import numpy as np
+import torch
+
+from disentangle.nets.seamless_stich import SeamlessStitch
+from disentangle.nets.seamless_stich_solver import SeamlessStitchSolver
+
+
+def get_frames(num_images=2, nR=3, nC=4, sz=8, seed=0):
+    """
+    Smooth frames to which a random offset is added per tile (to channel 0, and subtracted from channel 1).
+    """
+    rng = np.random.RandomState(seed)
+    y, x = np.meshgrid(np.arange(nR * sz), np.arange(nC * sz), indexing='ij')
+    clean = 0.2 * np.stack([np.sin(x / 50.0) + y / 500.0, np.cos(y / 50.0)])[None].repeat(num_images, axis=0)
+    offsets = rng.normal(0, 1, size=(num_images, nR, nC))
+    tiled = np.repeat(np.repeat(offsets, sz, axis=1), sz, axis=2)
+    frames = clean.copy()
+    frames[:, 0] += tiled
+    frames[:, 1] -= tiled
+    return clean, frames.astype(np.float32), offsets
+
+
+def test_coupled_solver_removes_tile_offsets():
+    clean, frames, offsets = get_frames()
+    for l1 in [False, True]:
+        solver = SeamlessStitchSolver(8, frames)
+        loss_arr = solver.fit(l1=l1)
+        # the offsets are recovered up to a constant.
+        expected = -(offsets - offsets.mean(axis=(1, 2), keepdims=True))
+        assert np.abs(solver.get_offsets() - expected).max() < 0.05
+        assert loss_arr[-1] < 0.1 * np.mean(np.abs(offsets))
+        output = solver.get_output()
+        shift = (output - clean).mean(axis=(2, 3), keepdims=True)
+        assert np.abs(output - clean - shift).max() < 0.1
+
+
+def test_l1_is_robust_to_outliers():
+    clean, frames, offsets = get_frames(num_images=1)
+    # a bright spot on one boundary.
+    frames[0, 0, 8:16, 7] += 50
+    expected = -(offsets - offsets.mean(axis=(1, 2), keepdims=True))
+    errors = {}
+    for l1 in [False, True]:
+        solver = SeamlessStitchSolver(8, frames)
+        solver.fit(l1=l1)
+        errors[l1] = np.abs(solver.get_offsets() - expected).max()
+    assert errors[True] < 0.1 < errors[False]
+
+
+def test_uncoupled_solver_minimizes_the_sgd_objective():
+    _, frames, _ = get_frames(num_images=1, nR=4, nC=4)
+    solver = SeamlessStitchSolver(8, frames, coupled=False)
+    solver.fit(l1=True)
+    sgd_model = SeamlessStitch(8, torch.from_numpy(frames), learning_rate=1.0)
+
+    def sgd_loss(offsets):
+        with torch.no_grad():
+            sgd_model.params.params.copy_(torch.from_numpy(offsets))
+            return sgd_model.compute_loss().item()
+
+    best = solver.get_offsets()
+    best_loss = sgd_loss(best)
+    rng = np.random.RandomState(1)
+    for _ in range(5):
+        assert best_loss <= sgd_loss(best + rng.normal(0, 0.05, size=best.shape)) + 1e-6
@@ -1,6 +1,6 @@
 import numpy as np
 
-from disentangle.data_loader.patch_index_manager import GridAlignement, GridIndexManager
+from disentangle.data_loader.evaluation_dloader import GridAlignement, GridIndexManager
 from disentangle.sampler.default_grid_sampler import DefaultGridSampler
 
 
@@ -0,0 +1,43 @@
+import numpy as np
+
+from disentangle.data_loader.evaluation_dloader import GridAlignement, GridIndexManager
+from disentangle.sampler.nbr_sampler import NeighborSampler
+
+
+class DummyDset:
+
+    def __init__(self, data_shape, image_size) -> None:
+        self.idx_manager = GridIndexManager(data_shape, image_size, image_size, GridAlignement.LeftTop)
+
+    def __len__(self):
+        return self.idx_manager.grid_count()
+
+
+def test_nbr_sampler():
+    """
+    Tests that every batch starts with nbr_set_count sets of a central index, not on the boundary, followed by its
+    left, right, top and bottom neighbors, and that the rest of the batch has grid_size 1.
+    """
+    data_shape = (5, 128, 128, 2)
+    dset = DummyDset(data_shape, 16)
+    idx_manager = dset.idx_manager
+    batch_size = 16
+    nbr_set_count = 2
+    sampler = NeighborSampler(dset, batch_size, nbr_set_count=nbr_set_count, valid_gridsizes=[1, 8, 16])
+    batches = list(sampler)
+    assert len(batches) == len(dset) // batch_size
+    for batch in batches:
+        assert batch.shape == (batch_size, 2)
+        for i in range(nbr_set_count):
+            (idx, grid_size), *nbrs = batch[5 * i:5 * (i + 1)]
+            assert not idx_manager.on_boundary(idx, grid_size=grid_size)
+            assert [nbr[0] for nbr in nbrs] == [
+                idx_manager.get_left_nbr_idx(idx, grid_size=grid_size),
+                idx_manager.get_right_nbr_idx(idx, grid_size=grid_size),
+                idx_manager.get_top_nbr_idx(idx, grid_size=grid_size),
+                idx_manager.get_bottom_nbr_idx(idx, grid_size=grid_size)
+            ]
+            assert all(nbr[1] == grid_size for nbr in nbrs)
+        rest = batch[5 * nbr_set_count:]
+        assert np.all(rest[:, 1] == 1)
+        assert np.all((rest[:, 0] >= 0) & (rest[:, 0] < idx_manager.grid_count(grid_size=1)))